@@ -1,3 +1,5 @@
+import importlib
+
 import streamlit as st
 
 st.set_page_config(
@@ -38,4 +40,21 @@ st.markdown("""
 
 # フッター
 st.markdown("---")
-st.markdown("DXF file Analysis Tools")
\ No newline at end of file
+st.markdown("DXF file Analysis Tools")
+# 各機能ページで使用する重いモジュール（ezdxf, pandas, openpyxl, xlsxwriter）を
+# トップページの表示後に読み込んでおき、ページ初回表示時の待ち時間を短縮する
+for module_name in (
+    'ezdxf',
+    'pandas',
+    'openpyxl',
+    'xlsxwriter',
+    'utils.extract_labels',
+    'utils.compare_dxf',
+    'utils.compare_labels',
+    'utils.extract_symbols',
+    'utils.compare_partslist',
+):
+    try:
+        importlib.import_module(module_name)
+    except ImportError:
+        pass
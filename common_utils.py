@@ -1,22 +1,192 @@
 import os
+import io
+import shutil
 import tempfile
 import base64
+import hashlib
 import sys
 import traceback
 import re
+from contextlib import contextmanager
 
 def save_uploadedfile(uploadedfile):
     """アップロードされたファイルを一時ディレクトリに保存する"""
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploadedfile.name)[1]) as f:
-        f.write(uploadedfile.getbuffer())
+        # 1MiB単位でストリーム書き込みする
+        uploadedfile.seek(0)
+        shutil.copyfileobj(uploadedfile, f, length=1024 * 1024)
         return f.name
 
+@contextmanager
+def staged_upload(uploadedfile):
+    """
+    アップロードされたファイルを一時ファイルに保存し、そのパスを提供するコンテキストマネージャ
+    
+    処理中にエラーが発生した場合や処理が中断された場合でも、withブロックを抜ける際に
+    一時ファイルを確実に削除する。
+    
+    Args:
+        uploadedfile: StreamlitのUploadedFileオブジェクト
+        
+    Yields:
+        str: 一時ファイルのパス
+    """
+    path = save_uploadedfile(uploadedfile)
+    try:
+        yield path
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def hash_upload(uploadedfile):
+    """
+    アップロードされたファイルの内容のblake2bダイジェストを計算する
+    
+    内容全体をbytesとしてコピーせず、1MiB単位（BytesIOの場合はバッファを直接参照）で計算する。
+    
+    Args:
+        uploadedfile: StreamlitのUploadedFileオブジェクト（またはバイナリのファイルオブジェクト）
+        
+    Returns:
+        bytes: ダイジェスト値
+    """
+    uploadedfile.seek(0)
+    if hasattr(hashlib, "file_digest"):
+        digest = hashlib.file_digest(uploadedfile, "blake2b")
+    else:
+        # Python 3.10以前のフォールバック
+        digest = hashlib.blake2b()
+        while chunk := uploadedfile.read(1024 * 1024):
+            digest.update(chunk)
+    uploadedfile.seek(0)
+    return digest.digest()
+
+def hash_uploaded_file(uploadedfile):
+    """アップロードされたファイルの内容からキャッシュキー用のハッシュ値（16進文字列）を計算する"""
+    return hash_upload(uploadedfile).hex()
+
+def read_dxf_bytes(file_bytes):
+    """
+    DXFファイルのバイトデータからDrawingを読み込む（ASCII/バイナリDXFの両方に対応）
+    
+    Args:
+        file_bytes: DXFファイルのバイトデータ
+        
+    Returns:
+        Drawing: 読み込まれたDXFドキュメント
+    """
+    import ezdxf
+    from ezdxf.document import Drawing
+    
+    if file_bytes.startswith(b"AutoCAD Binary DXF"):
+        from ezdxf.lldxf.tagger import binary_tags_loader
+        return Drawing.load(binary_tags_loader(file_bytes))
+    
+    # HEADERセクションからエンコーディングを判定してからテキストとして読み込む
+    # （判定はファイル先頭のHEADERセクションしか読まないため、全体を文字列にデコードしない）
+    info = ezdxf.filemanagement.dxf_stream_info(
+        io.TextIOWrapper(io.BytesIO(file_bytes), encoding="utf-8", errors="ignore"))
+    stream = io.TextIOWrapper(io.BytesIO(file_bytes), encoding=info.encoding, errors="surrogateescape")
+    return ezdxf.read(stream)
+
+def parse_uploaded_dxf(uploaded_file):
+    """
+    アップロードされたDXFファイルを一時ファイルを経由せずに読み込む
+    
+    Args:
+        uploaded_file: StreamlitのUploadedFileオブジェクト
+        
+    Returns:
+        Drawing: 読み込まれたDXFドキュメント
+    """
+    return read_dxf_bytes(uploaded_file.getvalue())
+
+# DXFファイル読み込み時のバッファサイズ（既定の8KiBより大きくしてread()の回数を減らす）
+DXF_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+def read_dxf_file(filename):
+    """
+    DXFファイルを大きめの読み込みバッファで開いてDrawingを読み込む
+    
+    Args:
+        filename: DXFファイルパス
+        
+    Returns:
+        Drawing: 読み込まれたDXFドキュメント
+    """
+    import ezdxf
+    from ezdxf.lldxf.validator import is_dxf_file, is_binary_dxf_file
+    
+    filename = str(filename)
+    if is_binary_dxf_file(filename) or not is_dxf_file(filename):
+        # バイナリDXF（一括で読み込まれる）やDXFでないファイルのエラー処理はezdxfに任せる
+        return ezdxf.readfile(filename)
+    
+    # HEADERセクションからエンコーディングを判定してからテキストとして読み込む
+    info = ezdxf.filemanagement.dxf_file_info(filename)
+    with open(filename, mode="rt", encoding=info.encoding, errors="surrogateescape",
+              buffering=DXF_READ_BUFFER_SIZE) as fp:
+        doc = ezdxf.read(fp)
+    doc.filename = filename
+    return doc
+
+def load_dxf_document(dxf_source):
+    """
+    DXFファイルパス、バイトデータまたは読み込み済みのDrawingからDrawingを取得する
+    
+    Args:
+        dxf_source: DXFファイルパス、バイトデータまたは読み込み済みのDrawing
+        
+    Returns:
+        Drawing: DXFドキュメント
+    """
+    from ezdxf.document import Drawing
+    
+    if isinstance(dxf_source, Drawing):
+        return dxf_source
+    if isinstance(dxf_source, (bytes, bytearray, memoryview)):
+        return read_dxf_bytes(bytes(dxf_source))
+    return read_dxf_file(dxf_source)
+
 def create_download_link(data, filename, text="Download file"):
     """ダウンロード用のリンクを生成する（非推奨、st.download_buttonを使用すべき）"""
     b64 = base64.b64encode(data).decode()
     href = f'<a href="data:file/octet-stream;base64,{b64}" download="{filename}">{text}</a>'
     return href
 
+def ensure_extension(filename, extension):
+    """
+    出力ファイル名が指定の拡張子で終わっていなければ付け加える
+    
+    Args:
+        filename: ユーザーが入力したファイル名
+        extension: 拡張子（例: ".xlsx"）
+        
+    Returns:
+        str: 拡張子付きのファイル名
+    """
+    # 大文字小文字の違い（例: ".XLSX"）は同じ拡張子とみなす
+    if filename.lower().endswith(extension.lower()):
+        return filename
+    return filename + extension
+
+# ツールタイプ -> (ファイル名のサフィックス, 既定の拡張子)
+_OUTPUT_FILENAME_FORMATS = {
+    'labels': ("_labels", "txt"),
+    'diff': ("_diff", "dxf"),
+    'label_diff': ("_label_diff", "md"),
+    'symbols': ("_symbols", "txt"),
+    'partslist_diff': ("_partslist_diff", "md"),
+}
+
+_COMPARISON_FILENAME_FORMATS = {
+    'diff': ("", "dxf"),
+    'label_diff': ("_label_diff", "md"),
+    'partslist_diff': ("_partslist_diff", "md"),
+}
+
 def get_output_filename(input_filename, tool_type, extension=None):
     """
     統一されたファイル名生成関数
@@ -37,22 +207,9 @@ def get_output_filename(input_filename, tool_type, extension=None):
     while '.' in base_name:
         base_name = os.path.splitext(base_name)[0]
     
-    # ツールタイプに応じたサフィックスとファイル形式を追加
-    if tool_type == 'labels':
-        return f"{base_name}_labels.txt" if not extension else f"{base_name}_labels.{extension}"
-    elif tool_type == 'diff':
-        return f"{base_name}_diff.dxf" if not extension else f"{base_name}_diff.{extension}"
-    elif tool_type == 'label_diff':
-        return f"{base_name}_label_diff.md" if not extension else f"{base_name}_label_diff.{extension}"
-    elif tool_type == 'symbols':
-        return f"{base_name}_symbols.txt" if not extension else f"{base_name}_symbols.{extension}"
-    elif tool_type == 'partslist_diff':
-        return f"{base_name}_partslist_diff.md" if not extension else f"{base_name}_partslist_diff.{extension}"
-    else:
-        # デフォルト
-        if extension:
-            return f"{base_name}.{extension}"
-        return f"{base_name}.{tool_type}"
+    # ツールタイプに応じたサフィックスとファイル形式を追加（未知のツールタイプは拡張子として使用）
+    suffix, default_extension = _OUTPUT_FILENAME_FORMATS.get(tool_type, ("", tool_type))
+    return f"{base_name}{suffix}.{extension or default_extension}"
 
 def get_comparison_filename(file_a_name, file_b_name, tool_type, extension=None):
     """
@@ -77,18 +234,9 @@ def get_comparison_filename(file_a_name, file_b_name, tool_type, extension=None)
     while '.' in file_b_base:
         file_b_base = os.path.splitext(file_b_base)[0]
     
-    # ツールタイプに応じたファイル名を生成
-    if tool_type == 'diff':
-        return f"{file_a_base}_vs_{file_b_base}.dxf" if not extension else f"{file_a_base}_vs_{file_b_base}.{extension}"
-    elif tool_type == 'label_diff':
-        return f"{file_a_base}_vs_{file_b_base}_label_diff.md" if not extension else f"{file_a_base}_vs_{file_b_base}_label_diff.{extension}"
-    elif tool_type == 'partslist_diff':
-        return f"{file_a_base}_vs_{file_b_base}_partslist_diff.md" if not extension else f"{file_a_base}_vs_{file_b_base}_partslist_diff.{extension}"
-    else:
-        # デフォルト
-        if extension:
-            return f"{file_a_base}_vs_{file_b_base}.{extension}"
-        return f"{file_a_base}_vs_{file_b_base}.{tool_type}"
+    # ツールタイプに応じたファイル名を生成（未知のツールタイプは拡張子として使用）
+    suffix, default_extension = _COMPARISON_FILENAME_FORMATS.get(tool_type, ("", tool_type))
+    return f"{file_a_base}_vs_{file_b_base}{suffix}.{extension or default_extension}"
 
 def handle_error(e, show_traceback=True):
     """エラーを適切に処理して表示する"""
@@ -183,6 +331,9 @@ def compile_ref_designator_patterns():
                 continue
     return patterns
 
+# 妥当性チェック用のパターン（モジュール読み込み時に一度だけコンパイル）
+_REF_DESIGNATOR_PATTERNS = compile_ref_designator_patterns()
+
 def validate_ref_designator(label, patterns):
     """
     ラベルが参考指示子フォーマットに適合するかチェックする
@@ -199,6 +350,19 @@ def validate_ref_designator(label, patterns):
             return True
     return False
 
+# 機器符号のパターンを定義（括弧は1セットのみ有効）
+CIRCUIT_SYMBOL_PATTERNS = [
+    r'^[A-Z]{2,}$',                    # AA+ (例: CNCNT, FB)
+    r'^[A-Z]{2,}\([^()]+\)$',         # AA+(*) (例: FB(), MSS(MOTOR)) - 括弧内に括弧を含まない
+    r'^[A-Z]+\d+$',                   # AA+NN+ (例: R10, CN3, PSW1)
+    r'^[A-Z]+\d+\([^()]+\)$',         # AA+NN+(*) (例: R10(2.2K), MSSA(+)) - 括弧内に括弧を含まない
+    r'^[A-Z]+\d+[A-Z]$',              # AA+NN+A (例: X14A, RMSS2A)
+    r'^[A-Z]+\d+[A-Z]\([^()]+\)$',    # AA+NN+A(*) (例: U23B(DAC)) - 括弧内に括弧を含まない
+]
+
+# 全パターンを1つの正規表現にまとめてモジュール読み込み時にコンパイル（ラベルごとの照合を1回にする）
+_CIRCUIT_SYMBOL_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in CIRCUIT_SYMBOL_PATTERNS))
+
 def filter_non_circuit_symbols(labels, debug=False):
     """
     機器符号フォーマットに一致しないラベルをフィルタリングする
@@ -221,26 +385,13 @@ def filter_non_circuit_symbols(labels, debug=False):
     Returns:
         tuple: (フィルタリング後のラベルリスト, フィルタリングで除外されたラベル数)
     """
-    # 機器符号のパターンを定義（括弧は1セットのみ有効）
-    patterns = [
-        r'^[A-Z]{2,}$',                    # AA+ (例: CNCNT, FB)
-        r'^[A-Z]{2,}\([^()]+\)$',         # AA+(*) (例: FB(), MSS(MOTOR)) - 括弧内に括弧を含まない
-        r'^[A-Z]+\d+$',                   # AA+NN+ (例: R10, CN3, PSW1)
-        r'^[A-Z]+\d+\([^()]+\)$',         # AA+NN+(*) (例: R10(2.2K), MSSA(+)) - 括弧内に括弧を含まない
-        r'^[A-Z]+\d+[A-Z]$',              # AA+NN+A (例: X14A, RMSS2A)
-        r'^[A-Z]+\d+[A-Z]\([^()]+\)$',    # AA+NN+A(*) (例: U23B(DAC)) - 括弧内に括弧を含まない
-    ]
-    
-    # パターンをコンパイル
-    compiled_patterns = [re.compile(pattern) for pattern in patterns]
-    
     filtered_labels = []
     filtered_out = []
     
     for label in labels:
         # 括弧で囲まれた部分を削除してからチェック（ただし、機器符号パターンの括弧は保持）
         # まず元のラベルでパターンマッチを試行
-        matches_pattern = any(pattern.match(label) for pattern in compiled_patterns)
+        matches_pattern = _CIRCUIT_SYMBOL_RE.match(label) is not None
         
         if matches_pattern:
             # パターンに一致する場合は機器符号として採用
@@ -266,15 +417,11 @@ def validate_circuit_symbols(labels):
     Returns:
         list: 適合しない機器符号のリスト（ユニーク、アルファベット順）
     """
-    patterns = compile_ref_designator_patterns()
-    invalid_designators = []
-    
-    for label in labels:
-        if not validate_ref_designator(label, patterns):
-            invalid_designators.append(label)
-    
-    # ユニークかつアルファベット順でソート
-    return sorted(list(set(invalid_designators)))
+    # 同じラベルは一度だけチェックし、ユニークかつアルファベット順でソート
+    return sorted(
+        label for label in set(labels)
+        if not validate_ref_designator(label, _REF_DESIGNATOR_PATTERNS)
+    )
 
 def process_circuit_symbol_labels(labels, filter_non_parts=False, validate_ref_designators=False, debug=False):
     """
@@ -9,7 +9,204 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.extract_labels import extract_labels, get_layers_from_dxf
-from common_utils import save_uploadedfile, get_output_filename, handle_error
+from common_utils import get_output_filename, handle_error, hash_uploaded_file, read_dxf_bytes
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def parse_dxf_cached(file_hash, _file_bytes):
+    """
+    DXFファイルを解析し、ファイル内容のハッシュ値をキーとしてキャッシュする
+    
+    Drawingはpickle化のコストが解析と同程度になるため、cache_dataではなく
+    cache_resourceで共有する（呼び出し側ではドキュメントを変更しないこと）。
+    
+    Args:
+        file_hash: ファイル内容のハッシュ値（hash_uploaded_fileの戻り値）
+        _file_bytes: DXFファイルのバイトデータ（キャッシュキーには含めない）
+        
+    Returns:
+        Drawing: 読み込まれたDXFドキュメント
+    """
+    return read_dxf_bytes(_file_bytes)
+
+def set_layer_state(file_name, layer, is_selected):
+    """
+    レイヤーの選択状態を更新する
+    
+    状態が変化した場合のみ選択状態のリビジョン番号を進め、
+    選択レイヤーのキャッシュを無効化する
+    
+    Args:
+        file_name: ファイル名
+        layer: レイヤー名
+        is_selected: 選択状態
+    """
+    file_states = st.session_state.layer_states[file_name]
+    if file_states.get(layer) != is_selected:
+        file_states[layer] = is_selected
+        st.session_state.layer_rev = st.session_state.get('layer_rev', 0) + 1
+
+def get_selected_layers_by_file(layer_maps):
+    """
+    ファイルごとの選択レイヤーを取得する
+    
+    選択状態のリビジョン番号と各ファイルのレイヤー構成が前回と同じ場合は、
+    セッション状態にキャッシュした結果を再利用する
+    
+    Args:
+        layer_maps: ファイル名をキー、レイヤー名リストをバリューとする辞書
+        
+    Returns:
+        dict: ファイル名をキー、選択レイヤーのfrozensetをバリューとする辞書
+    """
+    # 同名で内容の異なるファイルが再アップロードされた場合に備え、ファイル名だけでなくレイヤー一覧もキーに含める
+    cache_key = (
+        st.session_state.get('layer_rev', 0),
+        tuple((file_name, tuple(layers)) for file_name, layers in layer_maps.items())
+    )
+    cached = st.session_state.get('selected_layers_cache')
+    if cached is not None and cached[0] == cache_key:
+        return cached[1]
+    
+    layer_states = st.session_state.get('layer_states', {})
+    selected_layers_by_file = {}
+    for file_name, layers in layer_maps.items():
+        if file_name in layer_states:
+            selected_layers_by_file[file_name] = frozenset(
+                layer for layer, is_selected in layer_states[file_name].items() if is_selected
+            )
+        else:
+            # レイヤー選択が行われていない場合は全レイヤーを選択
+            selected_layers_by_file[file_name] = frozenset(layers)
+    
+    st.session_state.selected_layers_cache = (cache_key, selected_layers_by_file)
+    return selected_layers_by_file
+
+@st.fragment
+def render_layer_selection(layer_maps, common_layers, file_names):
+    """
+    レイヤー選択UIを表示する
+    
+    フラグメントとして実行されるため、チェックボックス操作時はこの部分のみ再実行され、
+    ファイル保存やレイヤー読み込みを含むページ全体の再実行を回避する
+    
+    Args:
+        layer_maps: ファイル名をキー、レイヤー名リストをバリューとする辞書
+        common_layers: 全ファイル共通のレイヤー名リスト
+        file_names: アップロードされたファイル名のリスト
+    """
+    # 全ファイル共通のレイヤーがあるかどうか
+    has_common_layers = len(common_layers) > 0
+    
+    # レイヤー選択モード
+    st.subheader("レイヤー選択")
+    
+    # 共通レイヤーが存在しない場合
+    if not has_common_layers and len(layer_maps) > 1:
+        st.warning("アップロードされたファイル間に共通のレイヤーが見つかりませんでした。各ファイルのレイヤーを個別に選択してください。")
+    
+    # タブの構成を決定
+    tab_names = []
+    if len(layer_maps) > 1:
+        tab_names.append("共通レイヤー")
+    tab_names.extend([f"ファイル: {name}" for name in file_names])
+    
+    # タブを作成してファイルごとにレイヤー選択UIを表示
+    tabs = st.tabs(tab_names)
+    
+    # セッション状態の初期化
+    if 'layer_states' not in st.session_state:
+        st.session_state.layer_states = {}
+    
+    # 初期化: すべてのファイルとレイヤーをセッション状態に追加
+    for file_name, layers in layer_maps.items():
+        if file_name not in st.session_state.layer_states:
+            st.session_state.layer_states[file_name] = {}
+        
+        for layer in layers:
+            if layer not in st.session_state.layer_states[file_name]:
+                set_layer_state(file_name, layer, True)  # デフォルトで選択状態
+    
+    # タブインデックス
+    tab_index = 0
+    
+    # 共通レイヤータブ（複数ファイルの場合のみ）
+    if len(layer_maps) > 1:
+        with tabs[tab_index]:
+            if has_common_layers:
+                col3, col4 = st.columns([1, 3])
+                with col3:
+                    if st.button("全選択", key="common_select_all"):
+                        for file_name in layer_maps.keys():
+                            for layer in common_layers:
+                                set_layer_state(file_name, layer, True)
+                
+                with col4:
+                    if st.button("全解除", key="common_deselect_all"):
+                        for file_name in layer_maps.keys():
+                            for layer in common_layers:
+                                set_layer_state(file_name, layer, False)
+                
+                # 3列表示に変更
+                layer_cols = st.columns(3)
+                
+                # 共通レイヤーのチェックボックス
+                for i, layer in enumerate(common_layers):
+                    col_index = i % 3
+                    with layer_cols[col_index]:
+                        # 共通レイヤータブでは、すべてのファイルの同名レイヤーを一括で選択/解除
+                        # 現在の状態を取得（複数ファイルで同じレイヤーが全て選択されている場合のみTrue）
+                        is_all_selected = all(st.session_state.layer_states[file_name].get(layer, False) 
+                                             for file_name in layer_maps.keys())
+                        
+                        # チェックボックスを表示
+                        is_selected = st.checkbox(
+                            layer, 
+                            value=is_all_selected, 
+                            key=f"common_layer_{layer}"
+                        )
+                        
+                        # 選択状態を全ファイルの同名レイヤーに反映
+                        for file_name in layer_maps.keys():
+                            if layer in layer_maps[file_name]:  # ファイルにそのレイヤーが存在する場合のみ
+                                set_layer_state(file_name, layer, is_selected)
+            else:
+                st.info("アップロードされたファイル間に共通のレイヤーがありません。各ファイルタブでレイヤーを選択してください。")
+            
+            tab_index += 1
+    
+    # 各ファイルのタブ
+    for i, file_name in enumerate(file_names):
+        with tabs[tab_index + i]:
+            st.write(f"ファイル: {file_name}")
+            
+            if file_name in layer_maps and layer_maps[file_name]:
+                col5, col6 = st.columns([1, 3])
+                with col5:
+                    if st.button("全選択", key=f"file_{i}_select_all"):
+                        for layer in layer_maps[file_name]:
+                            set_layer_state(file_name, layer, True)
+                
+                with col6:
+                    if st.button("全解除", key=f"file_{i}_deselect_all"):
+                        for layer in layer_maps[file_name]:
+                            set_layer_state(file_name, layer, False)
+                
+                # 3列表示
+                file_layer_cols = st.columns(3)
+                
+                # 各ファイルのレイヤーチェックボックス
+                for j, layer in enumerate(layer_maps[file_name]):
+                    col_index = j % 3
+                    with file_layer_cols[col_index]:
+                        is_selected = st.checkbox(
+                            layer, 
+                            value=st.session_state.layer_states[file_name].get(layer, True),
+                            key=f"file_{i}_layer_{layer}"
+                        )
+                        set_layer_state(file_name, layer, is_selected)
+            else:
+                st.warning(f"このファイルにはレイヤーが見つかりませんでした。")
+
 
 def app():
     st.title('図面ラベル抽出')
@@ -105,18 +302,20 @@ def app():
     
     if has_files:
         try:
-            # すべてのファイルを一時保存
-            temp_files = []
-            for uploaded_file in uploaded_files:
-                temp_file = save_uploadedfile(uploaded_file)
-                temp_files.append((uploaded_file.name, temp_file))
+            # すべてのファイルを一時ファイルを経由せずにメモリ上で読み込む
+            dxf_docs = []
             
             # レイヤー情報の読み込み
             with st.spinner('レイヤー情報を読み込み中...'):
                 # 各ファイルのレイヤー情報を取得
-                for file_name, file_path in temp_files:
+                for uploaded_file in uploaded_files:
+                    file_name = uploaded_file.name
+                    file_hash = hash_uploaded_file(uploaded_file)
+                    # 読み込みに失敗した場合は抽出時にバイトデータから再度読み込み、エラー情報を結果に含める
+                    doc = uploaded_file.getvalue()
                     try:
-                        layers = get_layers_from_dxf(file_path)
+                        doc = parse_dxf_cached(file_hash, doc)
+                        layers = get_layers_from_dxf(doc)
                         layer_maps[file_name] = layers
                         
                         # 初回は全レイヤーを共通レイヤーとする
@@ -127,6 +326,7 @@ def app():
                             common_layers = [layer for layer in common_layers if layer in layers]
                     except Exception as e:
                         st.error(f"ファイル {file_name} のレイヤー情報読み込みでエラー: {str(e)}")
+                    dxf_docs.append((file_name, file_hash, doc))
             
             # ファイル・レイヤー選択UI
             st.subheader("ファイル選択")
@@ -142,118 +342,7 @@ def app():
                 st.session_state.show_layer_selection = True
             
             if layer_maps and st.session_state.show_layer_selection:
-                # 全ファイル共通のレイヤーがあるかどうか
-                has_common_layers = len(common_layers) > 0
-                
-                # レイヤー選択モード
-                st.subheader("レイヤー選択")
-                
-                # 共通レイヤーが存在しない場合
-                if not has_common_layers and len(layer_maps) > 1:
-                    st.warning("アップロードされたファイル間に共通のレイヤーが見つかりませんでした。各ファイルのレイヤーを個別に選択してください。")
-                
-                # タブの構成を決定
-                tab_names = []
-                if len(layer_maps) > 1:
-                    tab_names.append("共通レイヤー")
-                tab_names.extend([f"ファイル: {name}" for name, _ in temp_files])
-                
-                # タブを作成してファイルごとにレイヤー選択UIを表示
-                tabs = st.tabs(tab_names)
-                
-                # セッション状態の初期化
-                if 'layer_states' not in st.session_state:
-                    st.session_state.layer_states = {}
-                
-                # 初期化: すべてのファイルとレイヤーをセッション状態に追加
-                for file_name, layers in layer_maps.items():
-                    if file_name not in st.session_state.layer_states:
-                        st.session_state.layer_states[file_name] = {}
-                    
-                    for layer in layers:
-                        if layer not in st.session_state.layer_states[file_name]:
-                            st.session_state.layer_states[file_name][layer] = True  # デフォルトで選択状態
-                
-                # タブインデックス
-                tab_index = 0
-                
-                # 共通レイヤータブ（複数ファイルの場合のみ）
-                if len(layer_maps) > 1:
-                    with tabs[tab_index]:
-                        if has_common_layers:
-                            col3, col4 = st.columns([1, 3])
-                            with col3:
-                                if st.button("全選択", key="common_select_all"):
-                                    for file_name in layer_maps.keys():
-                                        for layer in common_layers:
-                                            st.session_state.layer_states[file_name][layer] = True
-                            
-                            with col4:
-                                if st.button("全解除", key="common_deselect_all"):
-                                    for file_name in layer_maps.keys():
-                                        for layer in common_layers:
-                                            st.session_state.layer_states[file_name][layer] = False
-                            
-                            # 3列表示に変更
-                            layer_cols = st.columns(3)
-                            
-                            # 共通レイヤーのチェックボックス
-                            for i, layer in enumerate(common_layers):
-                                col_index = i % 3
-                                with layer_cols[col_index]:
-                                    # 共通レイヤータブでは、すべてのファイルの同名レイヤーを一括で選択/解除
-                                    # 現在の状態を取得（複数ファイルで同じレイヤーが全て選択されている場合のみTrue）
-                                    is_all_selected = all(st.session_state.layer_states[file_name].get(layer, False) 
-                                                         for file_name in layer_maps.keys())
-                                    
-                                    # チェックボックスを表示
-                                    is_selected = st.checkbox(
-                                        layer, 
-                                        value=is_all_selected, 
-                                        key=f"common_layer_{layer}"
-                                    )
-                                    
-                                    # 選択状態を全ファイルの同名レイヤーに反映
-                                    for file_name in layer_maps.keys():
-                                        if layer in layer_maps[file_name]:  # ファイルにそのレイヤーが存在する場合のみ
-                                            st.session_state.layer_states[file_name][layer] = is_selected
-                        else:
-                            st.info("アップロードされたファイル間に共通のレイヤーがありません。各ファイルタブでレイヤーを選択してください。")
-                        
-                        tab_index += 1
-                
-                # 各ファイルのタブ
-                for i, (file_name, _) in enumerate(temp_files):
-                    with tabs[tab_index + i]:
-                        st.write(f"ファイル: {file_name}")
-                        
-                        if file_name in layer_maps and layer_maps[file_name]:
-                            col5, col6 = st.columns([1, 3])
-                            with col5:
-                                if st.button("全選択", key=f"file_{i}_select_all"):
-                                    for layer in layer_maps[file_name]:
-                                        st.session_state.layer_states[file_name][layer] = True
-                            
-                            with col6:
-                                if st.button("全解除", key=f"file_{i}_deselect_all"):
-                                    for layer in layer_maps[file_name]:
-                                        st.session_state.layer_states[file_name][layer] = False
-                            
-                            # 3列表示
-                            file_layer_cols = st.columns(3)
-                            
-                            # 各ファイルのレイヤーチェックボックス
-                            for j, layer in enumerate(layer_maps[file_name]):
-                                col_index = j % 3
-                                with file_layer_cols[col_index]:
-                                    is_selected = st.checkbox(
-                                        layer, 
-                                        value=st.session_state.layer_states[file_name].get(layer, True),
-                                        key=f"file_{i}_layer_{layer}"
-                                    )
-                                    st.session_state.layer_states[file_name][layer] = is_selected
-                        else:
-                            st.warning(f"このファイルにはレイヤーが見つかりませんでした。")
+                render_layer_selection(layer_maps, common_layers, [uploaded_file.name for uploaded_file in uploaded_files])
             
             # 処理実行ボタン
             process_button = st.button("ラベルを抽出")
@@ -263,16 +352,7 @@ def app():
                 # ボタンが押された場合は処理を実行
                 if process_button:
                     # 選択されたレイヤーを確認
-                    selected_layers_by_file = {}
-                    for file_name in layer_maps.keys():
-                        if 'layer_states' in st.session_state and file_name in st.session_state.layer_states:
-                            selected_layers_by_file[file_name] = [
-                                layer for layer, is_selected in st.session_state.layer_states[file_name].items() 
-                                if is_selected
-                            ]
-                        else:
-                            # レイヤー選択が行われていない場合は全レイヤーを選択
-                            selected_layers_by_file[file_name] = layer_maps[file_name]
+                    selected_layers_by_file = get_selected_layers_by_file(layer_maps)
                     
                     # レイヤーが選択されていない場合の警告
                     files_without_layers = [
@@ -288,18 +368,27 @@ def app():
                         # 結果を格納するための辞書
                         results = {}
                         
+                        # 同一内容のファイルの抽出結果を共有するための辞書
+                        results_by_content = {}
+                        
                         # 各ファイルを処理
-                        for file_name, file_path in temp_files:
+                        for file_name, file_hash, doc in dxf_docs:
                             # 選択されたレイヤー
                             selected_layers = selected_layers_by_file.get(file_name, [])
                             
                             # レイヤーが選択されていない場合は全レイヤーを対象とする
                             if not selected_layers:
-                                selected_layers = layer_maps.get(file_name, [])
+                                selected_layers = frozenset(layer_maps.get(file_name, []))
+                            
+                            # 内容と選択レイヤーが同じファイルは抽出済みの結果を再利用
+                            content_key = (file_hash, selected_layers)
+                            if content_key in results_by_content:
+                                results[file_name] = results_by_content[content_key]
+                                continue
                             
                             # ラベル抽出
                             labels, info = extract_labels(
-                                file_path, 
+                                doc, 
                                 filter_non_parts=filter_option, 
                                 sort_order=sort_value,
                                 selected_layers=selected_layers,
@@ -308,6 +397,7 @@ def app():
                             )
                             
                             results[file_name] = (labels, info)
+                            results_by_content[content_key] = results[file_name]
                         
                         # セッション状態に結果を保存
                         st.session_state.label_results = results
@@ -381,6 +471,7 @@ def app():
                         
                         # 結果表示用のタブ名を準備
                         result_tab_names = list(results.keys())
+                        result_tab_index = {name: i for i, name in enumerate(result_tab_names)}
                         
                         # コールバック関数でファイル選択を処理
                         def on_file_change():
@@ -390,14 +481,14 @@ def app():
                         # セレクトボックスを使用して選択肢を表示
                         # デフォルト値が保存されていない場合は最初のファイルを選択
                         default_file = st.session_state.selected_result_file
-                        if default_file not in result_tab_names and result_tab_names:
+                        if default_file not in result_tab_index and result_tab_names:
                             default_file = result_tab_names[0]
                             st.session_state.selected_result_file = default_file
                         
                         st.selectbox(
                             "ファイル選択", 
                             options=result_tab_names,
-                            index=result_tab_names.index(default_file) if default_file in result_tab_names else 0,
+                            index=result_tab_index.get(default_file, 0),
                             key="file_selector",
                             on_change=on_file_change
                         )
@@ -492,13 +583,6 @@ def app():
                                     mime="text/plain",
                                     key=f"download_{hash(selected_file)}"
                                 )
-            
-            # 一時ファイルの削除
-            for _, file_path in temp_files:
-                try:
-                    os.unlink(file_path)
-                except:
-                    pass
                     
         except Exception as e:
             handle_error(e)
@@ -1,13 +1,45 @@
 import streamlit as st
 import os
-import tempfile
 import sys
 
 # utils モジュールをインポート可能にするためのパスの追加
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.compare_dxf import compare_dxf_files_and_generate_dxf
-from common_utils import save_uploadedfile, get_comparison_filename, handle_error
+from utils.compare_dxf import compare_dxf_files_and_generate_dxf_bytes
+from common_utils import ensure_extension, get_comparison_filename, handle_error, hash_uploaded_file, read_dxf_bytes
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def parse_dxf_cached(file_hash, _file_bytes):
+    """
+    DXFファイルを解析し、ファイル内容のハッシュ値をキーとしてキャッシュする
+    （比較処理はドキュメントを変更しないため、解析結果をそのまま共有する）
+    
+    Args:
+        file_hash: ファイル内容のハッシュ値（hash_uploaded_fileの戻り値）
+        _file_bytes: DXFファイルのバイトデータ（キャッシュキーには含めない）
+        
+    Returns:
+        Drawing: 読み込まれたDXFドキュメント
+    """
+    return read_dxf_bytes(_file_bytes)
+
+# レイヤー色の選択肢（AutoCAD標準色番号, 表示名）
+_COLOR_OPTIONS = (
+    (1, "1 - 赤"),
+    (2, "2 - 黄"),
+    (3, "3 - 緑"),
+    (4, "4 - シアン"),
+    (5, "5 - 青"),
+    (6, "6 - マゼンタ"),
+    (7, "7 - 白/黒"),
+)
+
+# レイヤー色設定の一覧（キー, ラベル, デフォルトの選択肢インデックス）
+_COLOR_SETTINGS = (
+    ('deleted', "削除エンティティの色", 5),  # デフォルト: マゼンタ
+    ('added', "追加エンティティの色", 3),  # デフォルト: シアン
+    ('unchanged', "変更なしエンティティの色", 6),  # デフォルト: 白/黒
+)
 
 def app():
     st.title('図面差分抽出')
@@ -37,8 +69,7 @@ def app():
             output_filename = st.text_input("出力ファイル名", "diff.dxf")
     else:
         output_filename = st.text_input("出力ファイル名", "diff.dxf")
-    if not output_filename.endswith('.dxf'):
-        output_filename += '.dxf'
+    output_filename = ensure_extension(output_filename, '.dxf')
     
     # オプション設定
     with st.expander("オプション設定", expanded=False):
@@ -57,78 +88,70 @@ def app():
         
         with col2:
             st.write("**レイヤー色設定**")
-            deleted_color = st.selectbox(
-                "削除エンティティの色",
-                options=[(1, "1 - 赤"), (2, "2 - 黄"), (3, "3 - 緑"), (4, "4 - シアン"), (5, "5 - 青"), (6, "6 - マゼンタ"), (7, "7 - 白/黒")],
-                index=5,  # デフォルト: マゼンタ
-                format_func=lambda x: x[1]
-            )[0]
-            
-            added_color = st.selectbox(
-                "追加エンティティの色",
-                options=[(1, "1 - 赤"), (2, "2 - 黄"), (3, "3 - 緑"), (4, "4 - シアン"), (5, "5 - 青"), (6, "6 - マゼンタ"), (7, "7 - 白/黒")],
-                index=3,  # デフォルト: シアン
-                format_func=lambda x: x[1]
-            )[0]
-            
-            unchanged_color = st.selectbox(
-                "変更なしエンティティの色",
-                options=[(1, "1 - 赤"), (2, "2 - 黄"), (3, "3 - 緑"), (4, "4 - シアン"), (5, "5 - 青"), (6, "6 - マゼンタ"), (7, "7 - 白/黒")],
-                index=6,  # デフォルト: 白/黒
-                format_func=lambda x: x[1]
-            )[0]
+            colors = {}
+            for key, label, default_index in _COLOR_SETTINGS:
+                colors[key] = st.selectbox(
+                    label,
+                    options=_COLOR_OPTIONS,
+                    index=default_index,
+                    format_func=lambda x: x[1],
+                    key=f"{key}_color"
+                )[0]
+            deleted_color = colors['deleted']
+            added_color = colors['added']
+            unchanged_color = colors['unchanged']
     
     if uploaded_file_a is not None and uploaded_file_b is not None:
         try:
+            hash_a = hash_uploaded_file(uploaded_file_a)
+            hash_b = hash_uploaded_file(uploaded_file_b)
+            
+            # 前回の比較と入力ファイル・オプションが同じ場合は比較結果を再利用する
+            run_key = (hash_a, hash_b, tolerance, deleted_color, added_color, unchanged_color)
+            last_run = st.session_state.get('compare_dxf_last_run')
+            
             # ファイルが選択されたら処理ボタンを表示
             if st.button("差分を比較"):
-                # ファイルを一時ディレクトリに保存
-                temp_file_a = save_uploadedfile(uploaded_file_a)
-                temp_file_b = save_uploadedfile(uploaded_file_b)
-                temp_output = tempfile.NamedTemporaryFile(delete=False, suffix=".dxf").name
-                
-                with st.spinner('DXFファイルを比較中...'):
-                    result = compare_dxf_files_and_generate_dxf(
-                        temp_file_a, 
-                        temp_file_b, 
-                        temp_output,
-                        tolerance=tolerance,
-                        deleted_color=deleted_color,
-                        added_color=added_color,
-                        unchanged_color=unchanged_color
-                    )
-                    
-                    if result:
-                        st.success("DXFファイルの比較が完了しました")
+                if last_run is None or last_run[0] != run_key:
+                    with st.spinner('DXFファイルを比較中...'):
+                        # 解析済みのDXFをファイル内容のハッシュ値でキャッシュ（再実行時は再解析しない）
+                        doc_a = parse_dxf_cached(hash_a, uploaded_file_a.getvalue())
+                        doc_b = parse_dxf_cached(hash_b, uploaded_file_b.getvalue())
                         
-                        # 結果ファイルを読み込んでダウンロードボタンを作成
-                        with open(temp_output, 'rb') as f:
-                            dxf_data = f.read()
-                            
-                        st.download_button(
-                            label="差分DXFファイルをダウンロード",
-                            data=dxf_data,
-                            file_name=output_filename,
-                            mime="application/dxf",
+                        # 差分DXFはファイルを介さずバイトデータとして受け取る
+                        dxf_data = compare_dxf_files_and_generate_dxf_bytes(
+                            doc_a, 
+                            doc_b, 
+                            tolerance=tolerance,
+                            deleted_color=deleted_color,
+                            added_color=added_color,
+                            unchanged_color=unchanged_color
                         )
-                        
-                        # 差分情報の表示
-                        st.info(f"""
-                        生成されたDXFファイルでは、以下のレイヤーで差分が表示されます：
-                        - ADDED (色{added_color}): 比較対象ファイル(B)にのみ存在する要素
-                        - DELETED (色{deleted_color}): 基準ファイル(A)にのみ存在する要素
-                        - UNCHANGED (色{unchanged_color}): 両方のファイルに存在し変更がない要素
-                        """)
+                    
+                    if dxf_data is not None:
+                        last_run = (run_key, dxf_data)
+                        st.session_state.compare_dxf_last_run = last_run
                     else:
                         st.error("DXFファイルの比較に失敗しました")
+            
+            # 現在の入力に対する比較結果があれば表示（ダウンロード後の再実行でも比較をやり直さない）
+            if last_run is not None and last_run[0] == run_key:
+                st.success("DXFファイルの比較が完了しました")
+                
+                st.download_button(
+                    label="差分DXFファイルをダウンロード",
+                    data=last_run[1],
+                    file_name=output_filename,
+                    mime="application/dxf",
+                )
                 
-                # 一時ファイルの削除
-                try:
-                    os.unlink(temp_file_a)
-                    os.unlink(temp_file_b)
-                    os.unlink(temp_output)
-                except:
-                    pass
+                # 差分情報の表示
+                st.info(f"""
+                生成されたDXFファイルでは、以下のレイヤーで差分が表示されます：
+                - ADDED (色{added_color}): 比較対象ファイル(B)にのみ存在する要素
+                - DELETED (色{deleted_color}): 基準ファイル(A)にのみ存在する要素
+                - UNCHANGED (色{unchanged_color}): 両方のファイルに存在し変更がない要素
+                """)
                 
         except Exception as e:
             handle_error(e)
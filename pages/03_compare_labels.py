@@ -7,7 +7,42 @@ import pandas as pd
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.compare_labels import compare_labels_multi
-from common_utils import save_uploadedfile, handle_error
+from common_utils import ensure_extension, handle_error, hash_uploaded_file
+
+def compare_label_pairs(pair_keys, filter_non_parts, sort_order, validate_ref_designators, file_pairs,
+                        progress_callback=None):
+    """
+    ファイルペアのラベル比較を実行する
+    
+    Args:
+        pair_keys: ペア情報[(ファイル名A, ハッシュA, ファイル名B, ハッシュB, ペア名), ...]
+        filter_non_parts: 回路記号（候補）のみを抽出するかどうか
+        sort_order: ソート順
+        validate_ref_designators: 回路記号の妥当性をチェックするかどうか
+        file_pairs: ファイルペアのリスト[(file_a, file_b, pair_name), ...]
+        progress_callback: 進捗通知用のコールバック関数 callback(完了ファイル数, 総ファイル数)
+        
+    Returns:
+        bytes: 生成されたExcelファイルのバイナリデータ
+    """
+    file_sources = {}  # ファイル内容のハッシュ値 -> バイトデータ
+    source_pairs = []
+    # 一時ファイルを経由せず、バイトデータを直接ワーカーに渡す（同一内容のファイルは同じデータを共有）
+    for (_, hash_a, _, hash_b, _), (file_a, file_b, pair_name) in zip(pair_keys, file_pairs):
+        if hash_a not in file_sources:
+            file_sources[hash_a] = file_a.getvalue()
+        if hash_b not in file_sources:
+            file_sources[hash_b] = file_b.getvalue()
+        source_pairs.append((file_a, file_b, file_sources[hash_a], file_sources[hash_b], pair_name))
+    
+    # ペアごとのラベル抽出は並列実行され、進捗はコールバックで通知
+    return compare_labels_multi(
+        source_pairs,
+        filter_non_parts=filter_non_parts,
+        sort_order=sort_order,
+        validate_ref_designators=validate_ref_designators,
+        progress_callback=progress_callback
+    )
 
 def app():
     st.title('図面ラベル差分抽出')
@@ -60,8 +95,7 @@ def app():
     
     # 出力ファイル名設定
     output_filename = st.text_input("出力Excelファイル名", "label_diff_result.xlsx")
-    if not output_filename.endswith('.xlsx'):
-        output_filename += '.xlsx'
+    output_filename = ensure_extension(output_filename, '.xlsx')
     
     # ファイルペア登録UI
     st.subheader("ファイルペア登録")
@@ -153,23 +187,33 @@ def app():
         try:
             # ファイルが選択されたら処理ボタンを表示
             if st.button("ラベル差分を比較", disabled=len(file_pairs_valid) == 0):
-                # 全てのファイルを一時ディレクトリに保存
                 with st.spinner('DXFファイルを処理中...'):
-                    temp_file_pairs = []
-                    
-                    for file_a, file_b, pair_name in file_pairs_valid:
-                        temp_file_a = save_uploadedfile(file_a)
-                        temp_file_b = save_uploadedfile(file_b)
-                        temp_file_pairs.append((file_a, file_b, temp_file_a, temp_file_b, pair_name))
-                    
-                    # Excel出力を生成
-                    excel_data = compare_labels_multi(
-                        temp_file_pairs,
-                        filter_non_parts=filter_option,
-                        sort_order=sort_value,
-                        validate_ref_designators=validate_ref_designators
+                    # ファイル内容のハッシュ値をキャッシュキーとして使用
+                    pair_keys = tuple(
+                        (file_a.name, hash_uploaded_file(file_a), file_b.name, hash_uploaded_file(file_b), pair_name)
+                        for file_a, file_b, pair_name in file_pairs_valid
                     )
                     
+                    # 前回の比較と入力ファイル・オプションが同じ場合は比較結果を再利用する
+                    # （進捗バーを更新するため、st.cache_dataではなくセッション状態に保持する）
+                    run_key = (pair_keys, filter_option, sort_value, validate_ref_designators)
+                    last_run = st.session_state.get('compare_labels_last_run')
+                    if last_run is not None and last_run[0] == run_key:
+                        excel_data = last_run[1]
+                    else:
+                        # Excel出力を生成
+                        progress_bar = st.progress(0.0)
+                        excel_data = compare_label_pairs(
+                            pair_keys,
+                            filter_option,
+                            sort_value,
+                            validate_ref_designators,
+                            file_pairs_valid,
+                            progress_callback=lambda completed, total: progress_bar.progress(completed / total)
+                        )
+                        progress_bar.empty()
+                        st.session_state.compare_labels_last_run = (run_key, excel_data)
+                    
                     # 結果を表示
                     success_message = f"{len(file_pairs_valid)}ペアのDXFファイルの比較が完了しました"
                     
@@ -202,14 +246,7 @@ def app():
                         file_name=output_filename,
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     )
-                    
-                    # 一時ファイルの削除
-                    for _, _, temp_file_a, temp_file_b, _ in temp_file_pairs:
-                        try:
-                            os.unlink(temp_file_a)
-                            os.unlink(temp_file_b)
-                        except:
-                            pass
+
         
         except Exception as e:
             handle_error(e)
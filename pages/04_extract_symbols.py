@@ -2,92 +2,70 @@ import streamlit as st
 import os
 import sys
 import traceback
-import tempfile
+import io
 import pandas as pd
 
 # utils モジュールをインポート可能にするためのパスの追加
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.extract_symbols import extract_circuit_symbols
-from common_utils import save_uploadedfile, get_output_filename, handle_error
+from utils.extract_symbols import extract_circuit_symbols, find_all_possible_assembly_numbers, is_symbol_source_column
+from common_utils import ensure_extension, get_output_filename, handle_error, hash_uploaded_file
 
-def safe_save_uploadedfile(uploaded_file):
+# 結果プレビューに表示する最大行数
+_PREVIEW_MAX_LINES = 2000
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_excel_cached(file_hash, _file_bytes):
     """
-    アップロードされたファイルを安全に保存する関数
+    Excelファイルを読み込み、ファイル内容のハッシュ値をキーとしてキャッシュする
     
     Args:
-        uploaded_file: アップロードされたファイルオブジェクト
+        file_hash: ファイル内容のハッシュ値（hash_uploaded_fileの戻り値）
+        _file_bytes: Excelファイルのバイトデータ（キャッシュキーには含めない）
         
     Returns:
-        str: 保存されたファイルのパス
+        pandas.DataFrame: 読み込まれたデータフレーム
     """
-    try:
-        # まず通常の方法で保存を試みる
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as f:
-            f.write(uploaded_file.getbuffer())
-            return f.name
-    except Exception as e:
-        st.warning(f"標準的な方法でのファイル保存に失敗しました: {str(e)}。代替方法を試みます。")
-        try:
-            # 代替方法: バイナリモードで開く
-            temp_path = tempfile.mktemp(suffix=os.path.splitext(uploaded_file.name)[1])
-            with open(temp_path, 'wb') as f:
-                f.write(uploaded_file.getbuffer())
-            return temp_path
-        except Exception as e2:
-            st.error(f"ファイル保存の代替方法も失敗しました: {str(e2)}")
-            raise
+    # アップロードは.xlsxに限定しているためopenpyxlで直接読み込む
+    # （機器符号抽出で参照する列のみを読み込む）
+    return pd.read_excel(io.BytesIO(_file_bytes), engine='openpyxl', usecols=is_symbol_source_column)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def extract_circuit_symbols_cached(file_hash, assembly_number, include_maker_info, _df):
+    """
+    図面番号を指定して機器符号を抽出する（同一ファイル・同一オプションでの再実行時はキャッシュを返す）
+    
+    Args:
+        file_hash: ファイル内容のハッシュ値（hash_uploaded_fileの戻り値）
+        assembly_number: 図面番号
+        include_maker_info: メーカー情報を含めるかどうか
+        _df: 読み込み済みのデータフレーム（キャッシュキーには含めない）
+        
+    Returns:
+        tuple: (機器符号リスト, 処理情報)
+    """
+    return extract_circuit_symbols(
+        _df,
+        assembly_number=assembly_number,
+        use_all_assemblies=False,  # 常にFalse（個別処理）
+        include_maker_info=include_maker_info
+    )
 
-def find_assembly_numbers(excel_path):
+def find_assembly_numbers(file_hash, file_bytes):
     """
     Excelファイルから利用可能な図面番号一覧を抽出する
     
     Args:
-        excel_path: Excelファイルのパス
+        file_hash: ファイル内容のハッシュ値（hash_uploaded_fileの戻り値）
+        file_bytes: Excelファイルのバイトデータ
         
     Returns:
         list: 利用可能な図面番号のリスト
     """
     try:
-        # まずopenpyxlでExcelを読み込む
-        try:
-            df = pd.read_excel(excel_path, engine='openpyxl')
-        except Exception:
-            # openpyxlが失敗したら他のエンジンを試す
-            try:
-                df = pd.read_excel(excel_path, engine='xlrd')
-            except Exception:
-                # 最後の手段
-                df = pd.read_excel(excel_path, engine=None)
-        
-        # 図面番号列が存在するか確認
-        if "図面番号" not in df.columns:
-            # 大文字小文字の違いを無視して検索
-            for col in df.columns:
-                if col.lower() == "図面番号".lower():
-                    df = df.rename(columns={col: "図面番号"})
-                    break
-        
-        # 図面番号列がない場合
-        if "図面番号" not in df.columns:
-            return []
-        
-        # 利用可能な図面番号を検索
-        possible_assemblies = []
-        
-        for i in range(len(df) - 1):  # 最後の行は次の行がないので対象外
-            current_row = df.iloc[i]
-            next_row = df.iloc[i + 1]
-            
-            # 現在の行に図面番号があり、次の行の図面番号が空白の場合
-            if (pd.notna(current_row["図面番号"]) and 
-                (pd.isna(next_row["図面番号"]) or str(next_row["図面番号"]).strip() == "")):
-                # 有効な図面番号のみを追加（空白や特殊文字のみではないもの）
-                assembly_no = str(current_row["図面番号"]).strip()
-                if assembly_no and assembly_no not in possible_assemblies:
-                    possible_assemblies.append(assembly_no)
-        
-        return possible_assemblies
+        # 解析済みのデータフレームを再利用（再実行のたびにExcelを解析しない）
+        df = load_excel_cached(file_hash, file_bytes)
+        return find_all_possible_assembly_numbers(df)
     except Exception as e:
         st.error(f"図面番号抽出中にエラーが発生しました: {str(e)}")
         return []
@@ -102,19 +80,14 @@ def app():
     # ファイルがアップロードされた場合
     if uploaded_file is not None:
         try:
+            file_hash = hash_uploaded_file(uploaded_file)
+            
             with st.spinner('ファイルを解析中...'):
-                # ファイルを一時保存
-                temp_file = safe_save_uploadedfile(uploaded_file)
-                
                 # 図面番号を抽出
-                assembly_numbers = find_assembly_numbers(temp_file)
+                assembly_numbers = find_assembly_numbers(file_hash, uploaded_file.getvalue())
                 
                 if not assembly_numbers:
                     st.warning("図面番号が見つかりませんでした。ファイル形式を確認してください。")
-                    try:
-                        os.unlink(temp_file)
-                    except:
-                        pass
                     return
             
             # 図面番号の選択UI
@@ -173,8 +146,7 @@ def app():
                     default_filename = f"{assembly_numbers[0]}_symbols.txt" if assembly_numbers else "circuit_symbols.txt"
                 
                 output_filename = st.text_input("出力ファイル名", default_filename)
-                if not output_filename.endswith('.txt'):
-                    output_filename += '.txt'
+                output_filename = ensure_extension(output_filename, '.txt')
             
             with col2:
                 include_maker_info = st.checkbox("メーカー情報を含める", value=False,
@@ -192,6 +164,9 @@ def app():
                         total_symbols = 0
                         
                         with st.spinner('機器符号を抽出中...'):
+                            # Excelは1回だけ解析し、各図面番号の処理では解析済みのデータフレームを共有する
+                            df = load_excel_cached(file_hash, uploaded_file.getvalue())
+                            
                             # 処理結果の表示用プログレスバー
                             progress_bar = st.progress(0)
                             
@@ -206,11 +181,11 @@ def app():
                                 status_text.info(f"処理中: {assembly_number} ({i+1}/{len(selected_assemblies)})")
                                 
                                 # 図面番号を指定して機器符号を抽出
-                                symbols, info = extract_circuit_symbols(
-                                    temp_file,
-                                    assembly_number=assembly_number,
-                                    use_all_assemblies=False,  # 常にFalse（個別処理）
-                                    include_maker_info=include_maker_info
+                                symbols, info = extract_circuit_symbols_cached(
+                                    file_hash,
+                                    assembly_number,
+                                    include_maker_info,
+                                    df
                                 )
                                 
                                 # エラーがなければ結果を追加
@@ -232,15 +207,21 @@ def app():
                         st.info(f"対象データ行数: {total_processed_rows}")
                         st.info(f"抽出された機器符号数: {len(all_symbols)}")
                         
-                        # 抽出された機器符号の表示
-                        st.text_area("機器符号リスト", "\n".join(all_symbols), height=300)
+                        # 抽出された機器符号の表示（件数が多い場合は先頭のみ表示し、全件はダウンロードで取得）
+                        if len(all_symbols) > _PREVIEW_MAX_LINES:
+                            st.text_area(
+                                f"機器符号リスト (先頭{_PREVIEW_MAX_LINES}行)",
+                                "\n".join(all_symbols[:_PREVIEW_MAX_LINES]),
+                                height=300
+                            )
+                        else:
+                            st.text_area("機器符号リスト", "\n".join(all_symbols), height=300)
                         
-                        # ダウンロードボタンを作成
+                        # ダウンロードボタンを作成（全件のテキストはここで一度だけ生成する）
                         if all_symbols:
-                            txt_str = "\n".join(all_symbols)
                             st.download_button(
                                 label="テキストファイルをダウンロード",
-                                data=txt_str.encode('utf-8'),
+                                data="\n".join(all_symbols).encode('utf-8'),
                                 file_name=output_filename,
                                 mime="text/plain",
                             )
@@ -248,9 +229,6 @@ def app():
                     except Exception as e:
                         st.error(f"処理中にエラーが発生しました: {str(e)}")
                         st.error(traceback.format_exc())
-            
-            # 一時ファイルの削除は処理終了時のみ
-            # ページが再読み込みされると、新たにファイルが生成されるため
         
         except Exception as e:
             st.error(f"ファイル処理中に予期しないエラーが発生しました: {str(e)}")
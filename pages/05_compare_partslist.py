@@ -2,12 +2,36 @@ import streamlit as st
 import os
 import sys
 import traceback
+from contextlib import ExitStack
 
 # utils モジュールをインポート可能にするためのパスの追加
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.compare_partslist import compare_parts_list_multi
-from common_utils import save_uploadedfile, get_comparison_filename, handle_error
+from common_utils import staged_upload, ensure_extension, get_comparison_filename, handle_error, hash_uploaded_file
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def compare_parts_pairs_cached(pair_keys, _file_pairs):
+    """
+    ファイルペアの機器符号リスト比較を実行する（同一内容のファイルペアでの再実行時はキャッシュを返す）
+    
+    Args:
+        pair_keys: キャッシュキー用のペア情報[(ファイル名A, ハッシュA, ファイル名B, ハッシュB, ペア名), ...]
+        _file_pairs: ファイルペアのリスト[(file_a, file_b, pair_name), ...]（キャッシュキーには含めない）
+        
+    Returns:
+        bytes: 生成されたExcelファイルのバイナリデータ
+    """
+    # 一時ファイルはwithブロックを抜ける際（エラー時を含む）に削除される
+    with ExitStack() as stack:
+        # シート表示用のファイル名は一時ファイルのパスではなく元のファイル名を渡す
+        temp_file_pairs = [
+            (stack.enter_context(staged_upload(file_a)), file_a.name,
+             stack.enter_context(staged_upload(file_b)), file_b.name,
+             pair_name)
+            for file_a, file_b, pair_name in _file_pairs
+        ]
+        return compare_parts_list_multi(temp_file_pairs)
 
 def app():
     st.title('機器符号リスト差分抽出')
@@ -17,8 +41,7 @@ def app():
     with st.expander("オプション設定", expanded=True):
         # 出力ファイル名設定
         output_filename = st.text_input("出力Excelファイル名", "partslist_diff_result.xlsx")
-        if not output_filename.endswith('.xlsx'):
-            output_filename += '.xlsx'
+        output_filename = ensure_extension(output_filename, '.xlsx')
     
     # ファイルペア登録UI
     st.subheader("ファイル・ペアの登録")
@@ -102,52 +125,13 @@ def app():
             if st.button("機器符号リストを比較", disabled=len(file_pairs_valid) == 0):
                 # 全てのファイルを一時ディレクトリに保存
                 with st.spinner('機器符号リストファイルを処理中...'):
-                    temp_file_pairs = []
-                    
-                    # ファイルの保存とペア情報の作成
-                    # 元のファイル名を維持するために仕組みを変更
-                    for file_a, file_b, pair_name in file_pairs_valid:
-                        # 一時ファイルを保存
-                        temp_file_a = save_uploadedfile(file_a)
-                        temp_file_b = save_uploadedfile(file_b)
-                        
-                        # ファイル名情報を保持するために.nameを使う
-                        real_file_a = temp_file_a
-                        real_file_b = temp_file_b
-                        
-                        # ファイル名を追加 - 一時ファイルパスは使うが、シート表示用のファイル名はオリジナルのものに
-                        # ファイル名を変更
-                        try:
-                            # ディレクトリとファイル名を分離
-                            dir_a = os.path.dirname(temp_file_a)
-                            dir_b = os.path.dirname(temp_file_b)
-                            
-                            # 元のファイル名を取得
-                            orig_name_a = file_a.name
-                            orig_name_b = file_b.name
-                            
-                            # シンボリックリンクではなく、ファイル名を変更した新しい一時ファイルパスを作成
-                            new_temp_file_a = os.path.join(dir_a, f"orig_{orig_name_a}")
-                            new_temp_file_b = os.path.join(dir_b, f"orig_{orig_name_b}")
-                            
-                            # ファイル名を変更してコピー
-                            os.rename(temp_file_a, new_temp_file_a)
-                            os.rename(temp_file_b, new_temp_file_b)
-                            
-                            # 新しいパスを使用
-                            real_file_a = new_temp_file_a
-                            real_file_b = new_temp_file_b
-                        except Exception as e:
-                            st.warning(f"ファイル名の変更中にエラーが発生しました: {str(e)}")
-                            # エラーがあっても継続、元のパスを使用
-                            real_file_a = temp_file_a
-                            real_file_b = temp_file_b
-                        
-                        temp_file_pairs.append((real_file_a, real_file_b, pair_name))
-                    
                     try:
-                        # Excel出力を生成
-                        excel_data = compare_parts_list_multi(temp_file_pairs)
+                        # Excel出力を生成（同一内容のファイルペアでの再実行時はキャッシュを返す）
+                        pair_keys = tuple(
+                            (file_a.name, hash_uploaded_file(file_a), file_b.name, hash_uploaded_file(file_b), pair_name)
+                            for file_a, file_b, pair_name in file_pairs_valid
+                        )
+                        excel_data = compare_parts_pairs_cached(pair_keys, file_pairs_valid)
                         
                         if excel_data is None:
                             st.error("Excel出力の生成に失敗しました。データがNoneとして返されました。")
@@ -165,16 +149,6 @@ def app():
                     except Exception as e:
                         st.error(f"処理中にエラーが発生しました: {str(e)}")
                         st.text(traceback.format_exc())
-                    
-                    # 一時ファイルの削除
-                    for file_a, file_b, _ in temp_file_pairs:
-                        try:
-                            if os.path.exists(file_a):
-                                os.unlink(file_a)
-                            if os.path.exists(file_b):
-                                os.unlink(file_b)
-                        except Exception as e:
-                            st.warning(f"一時ファイルの削除中にエラー: {str(e)}")
         
         except Exception as e:
             handle_error(e)
@@ -4,27 +4,59 @@
 # 特に何も実装する必要はありません
 
 # ただし、利便性のために各モジュールの主要な関数をパッケージレベルでエクスポートします
-from .extract_labels import extract_labels, get_layers_from_dxf, process_multiple_dxf_files
+import os
+import sys
+from importlib import import_module
+
+# サブモジュールと同名の関数は、後からサブモジュールをインポートしても
+# utils.<名前> が関数を指すように、従来どおり即時インポートします
+from .extract_labels import extract_labels
 from .extract_hierarchy import extract_hierarchy
-from .compare_dxf import compare_dxf_files_and_generate_dxf
 from .compare_labels import compare_labels_multi as compare_labels
-from .extract_symbols import extract_circuit_symbols, find_all_possible_assembly_numbers
-from .compare_partslist import compare_parts_list_multi, normalize_label
-
-# 共通ユーティリティから回路記号処理機能をエクスポート
-try:
-    import sys
-    import os
-    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from common_utils import (
-        process_circuit_symbol_labels,
-        filter_non_circuit_symbols,
-        validate_circuit_symbols,
-        validate_ref_designator,
-        compile_ref_designator_patterns,
-        convert_format_to_regex
-    )
-except ImportError:
-    # common_utils.pyが見つからない場合は警告
-    import warnings
-    warnings.warn("共通ユーティリティ(common_utils.py)がインポートできませんでした", ImportWarning)
\ No newline at end of file
+
+# その他の関数は初回参照時に遅延インポートします
+# （ページからサブモジュールを直接インポートした場合に、他のサブモジュールまで読み込まないようにする）
+
+# エクスポート名 -> (モジュール名, モジュール内の名前)
+_LAZY_EXPORTS = {
+    'get_layers_from_dxf': ('.extract_labels', 'get_layers_from_dxf'),
+    'process_multiple_dxf_files': ('.extract_labels', 'process_multiple_dxf_files'),
+    'compare_dxf_files_and_generate_dxf': ('.compare_dxf', 'compare_dxf_files_and_generate_dxf'),
+    'compare_dxf_files_and_generate_dxf_bytes': ('.compare_dxf', 'compare_dxf_files_and_generate_dxf_bytes'),
+    'extract_circuit_symbols': ('.extract_symbols', 'extract_circuit_symbols'),
+    'find_all_possible_assembly_numbers': ('.extract_symbols', 'find_all_possible_assembly_numbers'),
+    'compare_parts_list_multi': ('.compare_partslist', 'compare_parts_list_multi'),
+    'normalize_label': ('.compare_partslist', 'normalize_label'),
+    # 共通ユーティリティから回路記号処理機能をエクスポート
+    'process_circuit_symbol_labels': ('common_utils', 'process_circuit_symbol_labels'),
+    'filter_non_circuit_symbols': ('common_utils', 'filter_non_circuit_symbols'),
+    'validate_circuit_symbols': ('common_utils', 'validate_circuit_symbols'),
+    'validate_ref_designator': ('common_utils', 'validate_ref_designator'),
+    'compile_ref_designator_patterns': ('common_utils', 'compile_ref_designator_patterns'),
+    'convert_format_to_regex': ('common_utils', 'convert_format_to_regex'),
+}
+
+__all__ = ['extract_labels', 'extract_hierarchy', 'compare_labels', *_LAZY_EXPORTS]
+
+
+def __getattr__(name):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module_name, attr_name = _LAZY_EXPORTS[name]
+    if module_name == 'common_utils':
+        try:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            module = import_module(module_name)
+        except ImportError:
+            # common_utils.pyが見つからない場合は警告
+            import warnings
+            warnings.warn("共通ユーティリティ(common_utils.py)がインポートできませんでした", ImportWarning)
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    else:
+        module = import_module(module_name, __name__)
+
+    # 2回目以降は通常の属性として参照できるようにする
+    value = getattr(module, attr_name)
+    globals()[name] = value
+    return value
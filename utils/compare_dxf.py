@@ -1,15 +1,22 @@
 import ezdxf
-import hashlib
-import json
+import io
 import math
-from collections import defaultdict
 from pathlib import Path
-from typing import Dict, List, Tuple, Set, Optional, Any
+from typing import Dict, List, Tuple, Set, Optional, Any, Iterable
 from decimal import Decimal, getcontext
 import logging
 import numpy as np
 import tempfile
 import os
+import sys
+
+# 共通ユーティリティをインポート
+try:
+    from common_utils import load_dxf_document
+except ImportError:
+    # common_utils.pyが見つからない場合のフォールバック
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from common_utils import load_dxf_document
 
 # 高精度計算設定
 getcontext().prec = 50
@@ -17,6 +24,11 @@ getcontext().prec = 50
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 単位行列とそのスケール情報（読み取り専用で共有し、エンティティごとに作り直さない）
+_IDENTITY_MATRIX = np.eye(4, dtype=np.float64)
+_IDENTITY_MATRIX.flags.writeable = False
+_IDENTITY_SCALE_INFO = ((1.0, 1.0, 1.0), False)
+
 
 class ToleranceConfig:
     """許容誤差設定クラス"""
@@ -27,10 +39,22 @@ class ToleranceConfig:
         self.connection_tolerance = base_tolerance * 0.1
         self.text_position_tolerance = base_tolerance * 2
         self.angle_tolerance = 0.1
+        # 角度の正規化に使うラジアン単位の許容誤差（比較中は変わらないため事前に計算）
+        self.angle_tolerance_rad = math.radians(self.angle_tolerance)
         self.length_tolerance = base_tolerance
+        # (エンティティタイプ, 属性) -> 許容誤差 のキャッシュ
+        self._tolerance_cache = {}
         
     def get_tolerance_for_entity(self, entity_type: str, attribute: str = None) -> float:
-        """エンティティタイプ・属性に応じた許容誤差を取得"""
+        """エンティティタイプ・属性に応じた許容誤差を取得（組み合わせごとに一度だけ判定する）"""
+        key = (entity_type, attribute)
+        tolerance = self._tolerance_cache.get(key)
+        if tolerance is None:
+            tolerance = self._tolerance_cache[key] = self._resolve_tolerance(entity_type, attribute)
+        return tolerance
+    
+    def _resolve_tolerance(self, entity_type: str, attribute: str = None) -> float:
+        """エンティティタイプ・属性に応じた許容誤差を判定"""
         if entity_type in ['TEXT', 'MTEXT', 'ATTRIB']:
             return self.text_position_tolerance
         elif entity_type == 'POINT' or (attribute and 'connection' in attribute.lower()):
@@ -44,22 +68,30 @@ class ToleranceConfig:
 class CoordinateTransformer:
     """座標変換専用クラス"""
     
+    __slots__ = ('tolerance_config', 'debug')
+    
     def __init__(self, tolerance_config: ToleranceConfig, debug: bool = False):
         self.tolerance_config = tolerance_config
         self.debug = debug
         
-    def normalize_coordinate_precise(self, value: float, tolerance: float) -> float:
-        """高精度座標正規化"""
-        if tolerance <= 0:
-            return value
+    def quantize_to_bucket(self, value: float, tolerance: float) -> int:
+        """許容誤差グリッド上の整数バケット番号を取得（10進数での偶数丸めと同じ結果）"""
+        scaled = value / tolerance
+        fraction = abs(scaled - math.trunc(scaled))
         
-        try:
+        # 丸めの境界（.5付近）にある場合のみDecimalで厳密に判定し、それ以外は浮動小数点で丸める
+        if abs(fraction - 0.5) <= 1e-9 * max(1.0, abs(scaled)):
             decimal_value = Decimal(str(value))
             decimal_tolerance = Decimal(str(tolerance))
-            normalized = (decimal_value / decimal_tolerance).quantize(Decimal('1')) * decimal_tolerance
-            return float(normalized)
-        except Exception:
-            return round(value / tolerance) * tolerance
+            return int((decimal_value / decimal_tolerance).quantize(Decimal('1')))
+        return round(scaled)
+    
+    def normalize_coordinate_precise(self, value: float, tolerance: float) -> float:
+        """高精度座標正規化（整数バケット番号×許容誤差）"""
+        if tolerance <= 0 or not math.isfinite(value):
+            return value
+        
+        return self.quantize_to_bucket(value, tolerance) * tolerance
     
     def normalize_coordinate_with_context(self, coord: Any, entity_type: str, 
                                         attribute: str = None) -> Any:
@@ -84,8 +116,10 @@ class CoordinateTransformer:
     def create_transformation_matrix(self, insert_entity) -> np.ndarray:
         """INSERTエンティティから4x4変換行列を作成"""
         try:
+            insert_dxf = insert_entity.dxf
+            
             # 挿入点
-            insert_point = getattr(insert_entity.dxf, 'insert', (0, 0, 0))
+            insert_point = getattr(insert_dxf, 'insert', (0, 0, 0))
             if hasattr(insert_point, 'x'):
                 tx, ty, tz = float(insert_point.x), float(insert_point.y), float(getattr(insert_point, 'z', 0))
             else:
@@ -95,38 +129,30 @@ class CoordinateTransformer:
                 tz = float(coords[2]) if len(coords) > 2 else 0.0
             
             # 回転角度
-            rotation_deg = getattr(insert_entity.dxf, 'rotation', 0.0)
-            rotation = math.radians(float(rotation_deg))
+            rotation_deg = float(getattr(insert_dxf, 'rotation', 0.0))
             
             # スケール
-            xscale = float(getattr(insert_entity.dxf, 'xscale', 1.0))
-            yscale = float(getattr(insert_entity.dxf, 'yscale', 1.0))
-            zscale = float(getattr(insert_entity.dxf, 'zscale', 1.0))
-            
-            # 変換行列を作成
-            scale_matrix = np.array([
-                [xscale, 0.0, 0.0, 0.0],
-                [0.0, yscale, 0.0, 0.0],
-                [0.0, 0.0, zscale, 0.0],
-                [0.0, 0.0, 0.0, 1.0]
-            ], dtype=np.float64)
+            xscale = float(getattr(insert_dxf, 'xscale', 1.0))
+            yscale = float(getattr(insert_dxf, 'yscale', 1.0))
+            zscale = float(getattr(insert_dxf, 'zscale', 1.0))
             
-            cos_r, sin_r = math.cos(rotation), math.sin(rotation)
-            rotation_matrix = np.array([
-                [cos_r, -sin_r, 0.0, 0.0],
-                [sin_r, cos_r, 0.0, 0.0],
-                [0.0, 0.0, 1.0, 0.0],
-                [0.0, 0.0, 0.0, 1.0]
-            ], dtype=np.float64)
-            
-            translation_matrix = np.array([
-                [1.0, 0.0, 0.0, tx],
-                [0.0, 1.0, 0.0, ty],
-                [0.0, 0.0, 1.0, tz],
+            # 変換行列（平行移動 @ 回転 @ スケール）を中間の行列を作らずに直接組み立てる
+            # 回転なしのINSERTが大半のため、その場合は三角関数の計算を省略する
+            if rotation_deg == 0.0:
+                cos_r, sin_r = 1.0, 0.0
+            else:
+                rotation = math.radians(rotation_deg)
+                cos_r, sin_r = math.cos(rotation), math.sin(rotation)
+            matrix = np.array([
+                [cos_r * xscale, -sin_r * yscale, 0.0, tx],
+                [sin_r * xscale, cos_r * yscale, 0.0, ty],
+                [0.0, 0.0, zscale, tz],
                 [0.0, 0.0, 0.0, 1.0]
             ], dtype=np.float64)
             
-            return translation_matrix @ rotation_matrix @ scale_matrix
+            # 0.0を加えて負のゼロ(-0.0)を0.0にそろえる（行列積で組み立てた場合と同じ値にする）
+            matrix += 0.0
+            return matrix
             
         except Exception as e:
             logger.warning(f"Error creating transformation matrix: {e}")
@@ -148,6 +174,10 @@ class CoordinateTransformer:
         except Exception:
             return point
     
+    def transform_points(self, points: np.ndarray, transform_matrix: np.ndarray) -> np.ndarray:
+        """(N, 3)の点配列を変換行列で一括変換"""
+        return points @ transform_matrix[:3, :3].T + transform_matrix[:3, 3]
+    
     def extract_scale_factors(self, transform_matrix: np.ndarray) -> Tuple[float, float, float]:
         """変換行列からスケールファクターを抽出"""
         try:
@@ -157,11 +187,20 @@ class CoordinateTransformer:
             return (scale_x, scale_y, scale_z)
         except Exception:
             return (1.0, 1.0, 1.0)
+    
+    def get_scale_info(self, transform_matrix: np.ndarray) -> Tuple[Tuple[float, float, float], bool]:
+        """変換行列のスケールファクターと、スケールが掛かっているか（1以外か）を取得"""
+        scale_x, scale_y, scale_z = scale_factors = self.extract_scale_factors(transform_matrix)
+        # 1に十分近い（1e-6以内）スケールは等倍とみなす
+        is_scaled = max(abs(scale_x - 1.0), abs(scale_y - 1.0), abs(scale_z - 1.0)) > 1e-6
+        return scale_factors, is_scaled
 
 
 class EntityExpander:
     """INSERTエンティティ展開専用クラス"""
     
+    __slots__ = ('transformer', 'debug', 'excluded_attributes', '_block_cache')
+    
     def __init__(self, transformer: CoordinateTransformer, debug: bool = False):
         self.transformer = transformer
         self.debug = debug
@@ -170,6 +209,7 @@ class EntityExpander:
             'objectid', 'uuid', 'app_data', 'doc', 'entitydb', 'is_alive', 
             'is_virtual', 'is_copy', 'soft_pointer_ids', 'hard_pointer_ids'
         }
+        self._block_cache = {}
     
     def safe_get_dxf_attributes(self, entity) -> Dict:
         """安全なDXF属性取得"""
@@ -213,23 +253,42 @@ class EntityExpander:
         
         return vertices
     
-    def transform_entity_to_absolute(self, entity, transform_matrix: np.ndarray) -> Optional[Dict]:
-        """エンティティを絶対座標に変換"""
+    def transform_entity_to_absolute(self, entity, transform_matrix: np.ndarray,
+                                     clean_attrs: Optional[Dict] = None,
+                                     base_points: Optional[Tuple[List[str], Optional[np.ndarray]]] = None,
+                                     scale_info: Optional[Tuple[Tuple[float, float, float], bool]] = None) -> Optional[Dict]:
+        """
+        エンティティを絶対座標に変換
+        
+        clean_attrs・base_points・scale_info（get_scale_infoの結果）を渡した場合は、
+        属性の再取得・座標の収集・スケールファクターの抽出を省略する。
+        """
         try:
             entity_type = entity.dxftype()
-            clean_attrs = self.safe_get_dxf_attributes(entity)
-            transformed_attrs = clean_attrs.copy()
+            if clean_attrs is None:
+                # このエンティティ用に取得した属性辞書はコピーせずにそのまま書き換える
+                clean_attrs = transformed_attrs = self.safe_get_dxf_attributes(entity)
+            else:
+                # ブロック定義の属性はINSERTごとに再利用されるため、コピーしてから書き換える
+                transformed_attrs = clean_attrs.copy()
+            
+            # スケールファクターを抽出（同じ変換行列のエンティティでは呼び出し側で一度だけ求める）
+            if scale_info is None:
+                scale_info = self.transformer.get_scale_info(transform_matrix)
+            (scale_x, scale_y, scale_z), is_scaled = scale_info
             
-            # スケールファクターを抽出
-            scale_x, scale_y, scale_z = self.transformer.extract_scale_factors(transform_matrix)
-            is_scaled = not all(math.isclose(s, 1.0, rel_tol=1e-6) for s in [scale_x, scale_y, scale_z])
+            # サイズ関連属性の変換元の値は、座標変換で書き換えられる前に取り出しておく
+            if is_scaled:
+                size_attrs = {name: clean_attrs[name] for name in ('radius', 'major_axis', 'height')
+                              if name in clean_attrs}
             
             # 座標属性を変換
-            self._transform_coordinate_attributes(clean_attrs, transformed_attrs, transform_matrix)
+            self._transform_coordinate_attributes(clean_attrs, transformed_attrs, transform_matrix,
+                                                  base_points)
             
             # サイズ関連属性の変換
             if is_scaled:
-                self._transform_size_attributes(entity_type, clean_attrs, transformed_attrs, 
+                self._transform_size_attributes(entity_type, size_attrs, transformed_attrs, 
                                               scale_x, scale_y, scale_z)
             
             # テキスト内容の取得
@@ -248,26 +307,80 @@ class EntityExpander:
             logger.warning(f"Error transforming entity {entity.dxftype()}: {e}")
             return None
     
-    def _transform_coordinate_attributes(self, clean_attrs: Dict, transformed_attrs: Dict, 
-                                       transform_matrix: np.ndarray):
-        """座標属性を変換"""
+    @staticmethod
+    def _as_point3(point) -> Optional[Tuple[float, float, float]]:
+        """座標値を3次元の浮動小数点タプルに変換（変換できない場合はNone）"""
+        try:
+            if hasattr(point, 'x'):
+                return (float(point.x), float(point.y), float(getattr(point, 'z', 0.0)))
+            coords = tuple(point)
+            if len(coords) == 2:
+                return (float(coords[0]), float(coords[1]), 0.0)
+            return (float(coords[0]), float(coords[1]), float(coords[2]))
+        except Exception:
+            return None
+    
+    def _collect_points(self, clean_attrs: Dict) -> Tuple[List[str], Optional[np.ndarray]]:
+        """
+        変換対象の点（座標属性とLWPOLYLINE頂点）を集める
+        
+        Args:
+            clean_attrs: エンティティの属性辞書
+            
+        Returns:
+            (座標属性名のリスト, 座標属性の点に続けて頂点を並べたN×3配列（点がなければNone）)
+        """
         coordinate_attrs = ['insert', 'center', 'start', 'end', 'location', 'base_point']
         
+        point_attr_names = []
+        points = []
         for attr_name in coordinate_attrs:
             if attr_name in clean_attrs:
-                original_point = clean_attrs[attr_name]
-                try:
-                    if hasattr(original_point, 'x'):
-                        point_tuple = (original_point.x, original_point.y, 
-                                     getattr(original_point, 'z', 0.0))
-                    else:
-                        point_tuple = tuple(original_point)
-                    
-                    transformed_point = self.transformer.transform_point(point_tuple, transform_matrix)
-                    transformed_attrs[attr_name] = transformed_point
-                    
-                except Exception:
-                    pass
+                point = self._as_point3(clean_attrs[attr_name])
+                if point is not None:
+                    point_attr_names.append(attr_name)
+                    points.append(point)
+        
+        # LWPOLYLINE頂点は (x, y) のタプルに揃えて抽出しているため、配列へまとめて詰める
+        # （形が揃っていない場合のみ1頂点ずつ変換する）
+        vertex_points = None
+        vertices = clean_attrs.get('vertices')
+        if vertices:
+            try:
+                vertex_points = np.zeros((len(vertices), 3), dtype=np.float64)
+                vertex_points[:, :2] = vertices
+            except (TypeError, ValueError):
+                vertex_points = [
+                    point for point in (self._as_point3(vertex) for vertex in vertices if len(vertex) >= 2)
+                    if point is not None
+                ]
+                vertex_points = np.array(vertex_points, dtype=np.float64).reshape(-1, 3)
+        
+        if vertex_points is not None and len(vertex_points):
+            if points:
+                return point_attr_names, np.vstack((np.array(points, dtype=np.float64), vertex_points))
+            return point_attr_names, vertex_points
+        return point_attr_names, (np.array(points, dtype=np.float64) if points else None)
+    
+    def _transform_coordinate_attributes(self, clean_attrs: Dict, transformed_attrs: Dict, 
+                                       transform_matrix: np.ndarray,
+                                       base_points: Optional[Tuple[List[str], Optional[np.ndarray]]] = None):
+        """座標属性を変換（base_pointsは_collect_pointsで集めた点）"""
+        # 変換対象の点を集め、1回の行列演算でまとめて変換する
+        point_attr_names, points = base_points if base_points is not None else self._collect_points(clean_attrs)
+        
+        if points is not None:
+            transformed_points = self.transformer.transform_points(points, transform_matrix)
+            point_count = len(point_attr_names)
+            
+            for attr_name, transformed_point in zip(point_attr_names, transformed_points[:point_count].tolist()):
+                transformed_attrs[attr_name] = tuple(transformed_point)
+            
+            # LWPOLYLINE頂点の変換結果（XY座標のみ）
+            if 'vertices' in clean_attrs:
+                transformed_attrs['vertices'] = list(map(tuple, transformed_points[point_count:, :2].tolist()))
+        elif 'vertices' in clean_attrs:
+            transformed_attrs['vertices'] = []
         
         # ELLIPSE major_axis ベクトルの変換（方向ベクトルなので原点からの変換）
         if 'major_axis' in clean_attrs:
@@ -288,19 +401,7 @@ class EntityExpander:
                 
             except Exception:
                 pass
-        
-        # LWPOLYLINE頂点の変換
-        if 'vertices' in clean_attrs:
-            original_vertices = clean_attrs['vertices']
-            transformed_vertices = []
-            
-            for vertex in original_vertices:
-                if len(vertex) >= 2:
-                    vertex_3d = (vertex[0], vertex[1], 0.0) if len(vertex) == 2 else vertex
-                    transformed_vertex = self.transformer.transform_point(vertex_3d, transform_matrix)
-                    transformed_vertices.append(transformed_vertex[:2])
-            
-            transformed_attrs['vertices'] = transformed_vertices
+
     
     def _transform_size_attributes(self, entity_type: str, clean_attrs: Dict, 
                                  transformed_attrs: Dict, scale_x: float, scale_y: float, scale_z: float):
@@ -327,61 +428,125 @@ class EntityExpander:
         if entity_type in ['TEXT', 'MTEXT', 'ATTRIB'] and 'height' in clean_attrs:
             transformed_attrs['height'] = clean_attrs['height'] * scale_y
     
+    def _get_block_entities(self, doc, block_name: str) -> List[Tuple[Any, Dict, Tuple]]:
+        """
+        ブロック定義内のエンティティ・属性・変換対象の点を取得（ブロック名ごとに一度だけ読み込む）
+        
+        INSERTごとに異なるのは変換行列だけなので、属性の取得と点の収集は
+        ブロック名ごとに一度だけ行い、各INSERTでは行列演算のみを行う。
+        """
+        cached = self._block_cache.get(block_name)
+        if cached is None:
+            cached = []
+            for block_entity in doc.blocks[block_name]:
+                if block_entity.dxftype() in ['ATTDEF']:
+                    continue
+                clean_attrs = self.safe_get_dxf_attributes(block_entity)
+                cached.append((block_entity, clean_attrs, self._collect_points(clean_attrs)))
+            self._block_cache[block_name] = cached
+        return cached
+    
+    @staticmethod
+    def _make_insert_info(insert_entity) -> Dict:
+        """ブロック内エンティティに付ける挿入情報（同じINSERTのエンティティで共有する読み取り専用の辞書）"""
+        insert_dxf = insert_entity.dxf
+        insert_point = insert_dxf.insert
+        return {
+            'block_name': insert_dxf.name,
+            'insert_point': (insert_point.x, insert_point.y, insert_point.z),
+            'rotation': getattr(insert_dxf, 'rotation', 0.0),
+            'scale': (
+                getattr(insert_dxf, 'xscale', 1.0),
+                getattr(insert_dxf, 'yscale', 1.0),
+                getattr(insert_dxf, 'zscale', 1.0)
+            )
+        }
+    
+    def _expand_insert(self, doc, insert_entity, expanded_entities: List[Dict]):
+        """
+        INSERTエンティティを展開（入れ子のINSERTも再帰を使わずスタックで展開）
+        
+        スタックの各要素は (INSERTエンティティ, 親の変換行列, 親のスケール情報,
+        このINSERTの変換行列, このINSERTのスケール情報, このINSERTの挿入情報,
+        ブロック内エンティティのイテレータ, 展開中のブロック名の並び) で、
+        ブロックの循環参照は展開中のブロック名で検出する。
+        スケール情報と挿入情報はINSERTごとに一度だけ求め、ブロック内の全エンティティで共有する。
+        """
+        root_name = insert_entity.dxf.name
+        root_matrix = self.transformer.create_transformation_matrix(insert_entity)
+        stack = [(insert_entity, _IDENTITY_MATRIX, _IDENTITY_SCALE_INFO,
+                  root_matrix, self.transformer.get_scale_info(root_matrix),
+                  self._make_insert_info(insert_entity), iter(self._get_block_entities(doc, root_name)), (root_name,))]
+        
+        while stack:
+            (current_insert, parent_matrix, parent_scale_info, transform_matrix, scale_info,
+             insert_info, block_entities, block_chain) = stack[-1]
+            next_item = next(block_entities, None)
+            
+            if next_item is None:
+                # ブロック内エンティティを処理し終えたらATTRIBを処理
+                # （ATTRIBは親の座標系に配置されているため親の変換行列で変換）
+                stack.pop()
+                attribs = getattr(current_insert, 'attribs', None)
+                if attribs:
+                    # 同じINSERTのATTRIBは挿入情報の辞書を共有する（読み取り専用）
+                    attrib_insert_info = {
+                        'block_name': insert_info['block_name'],
+                        'insert_point': insert_info['insert_point'],
+                        'is_insert_attrib': True
+                    }
+                    for attrib in attribs:
+                        absolute_attrib = self.transform_entity_to_absolute(
+                            attrib, parent_matrix, scale_info=parent_scale_info)
+                        if absolute_attrib:
+                            absolute_attrib['insert_info'] = attrib_insert_info
+                            expanded_entities.append(absolute_attrib)
+                continue
+            
+            block_entity, clean_attrs, base_points = next_item
+            
+            # 入れ子のINSERTはスタックに積んで展開（未定義ブロック・循環参照は通常のエンティティとして扱う）
+            if block_entity.dxftype() == 'INSERT':
+                child_name = block_entity.dxf.name
+                if child_name in doc.blocks and child_name not in block_chain:
+                    child_matrix = transform_matrix @ self.transformer.create_transformation_matrix(block_entity)
+                    stack.append((block_entity, transform_matrix, scale_info,
+                                  child_matrix, self.transformer.get_scale_info(child_matrix),
+                                  self._make_insert_info(block_entity), iter(self._get_block_entities(doc, child_name)),
+                                  block_chain + (child_name,)))
+                    continue
+            
+            absolute_entity = self.transform_entity_to_absolute(
+                block_entity, transform_matrix, clean_attrs, base_points, scale_info)
+            if absolute_entity:
+                absolute_entity['insert_info'] = insert_info
+                expanded_entities.append(absolute_entity)
+    
     def expand_insert_entities(self, doc, doc_label: str) -> List[Dict]:
         """INSERTエンティティを展開して絶対座標エンティティリストを作成"""
         expanded_entities = []
         
+        # ブロック定義のキャッシュはドキュメントごとに作り直す
+        self._block_cache = {}
+        
         msp = doc.modelspace()
         for entity in msp:
             entity_type = entity.dxftype()
             
             if entity_type == 'INSERT':
+                block_name = None
                 try:
-                    transform_matrix = self.transformer.create_transformation_matrix(entity)
                     block_name = entity.dxf.name
-                    
                     if block_name in doc.blocks:
-                        block = doc.blocks[block_name]
-                        
-                        # ブロック内エンティティを変換
-                        for block_entity in block:
-                            if block_entity.dxftype() not in ['ATTDEF']:
-                                absolute_entity = self.transform_entity_to_absolute(
-                                    block_entity, transform_matrix)
-                                if absolute_entity:
-                                    absolute_entity['insert_info'] = {
-                                        'block_name': block_name,
-                                        'insert_point': tuple(entity.dxf.insert),
-                                        'rotation': getattr(entity.dxf, 'rotation', 0.0),
-                                        'scale': (
-                                            getattr(entity.dxf, 'xscale', 1.0),
-                                            getattr(entity.dxf, 'yscale', 1.0),
-                                            getattr(entity.dxf, 'zscale', 1.0)
-                                        )
-                                    }
-                                    expanded_entities.append(absolute_entity)
-                        
-                        # ATTRIB処理
-                        if hasattr(entity, 'attribs'):
-                            for attrib in entity.attribs:
-                                identity_matrix = np.eye(4)
-                                absolute_attrib = self.transform_entity_to_absolute(
-                                    attrib, identity_matrix)
-                                if absolute_attrib:
-                                    absolute_attrib['insert_info'] = {
-                                        'block_name': block_name,
-                                        'insert_point': tuple(entity.dxf.insert),
-                                        'is_insert_attrib': True
-                                    }
-                                    expanded_entities.append(absolute_attrib)
+                        self._expand_insert(doc, entity, expanded_entities)
                                     
                 except Exception as e:
                     logger.warning(f"Error expanding INSERT {block_name}: {e}")
             
             elif entity_type != 'ATTDEF':
                 # 直接エンティティ
-                identity_matrix = np.eye(4)
-                absolute_entity = self.transform_entity_to_absolute(entity, identity_matrix)
+                absolute_entity = self.transform_entity_to_absolute(
+                    entity, _IDENTITY_MATRIX, scale_info=_IDENTITY_SCALE_INFO)
                 if absolute_entity:
                     absolute_entity['is_direct_modelspace'] = True
                     expanded_entities.append(absolute_entity)
@@ -392,12 +557,27 @@ class EntityExpander:
 class SignatureGenerator:
     """エンティティ署名生成専用クラス"""
     
+    __slots__ = ('transformer', 'debug', '_geometry_handlers')
+    
     def __init__(self, transformer: CoordinateTransformer, debug: bool = False):
         self.transformer = transformer
         self.debug = debug
+        # エンティティタイプ -> ジオメトリ詳細の追加処理
+        self._geometry_handlers = {
+            'LINE': self._add_line_details,
+            'CIRCLE': self._add_circle_details,
+            'ARC': self._add_arc_details,
+            'ELLIPSE': self._add_ellipse_details,
+            'LWPOLYLINE': self._add_lwpolyline_details,
+        }
     
-    def create_absolute_entity_signature(self, absolute_entity: Dict) -> str:
-        """絶対座標エンティティの署名生成"""
+    def create_absolute_entity_signature(self, absolute_entity: Dict) -> Any:
+        """
+        絶対座標エンティティの署名生成
+        
+        署名は (エンティティタイプ, (項目名, 値...), ...) のタプルで、そのまま辞書のキーとして使用できる。
+        ハッシュ化できない値を含む場合のみ、各項目を文字列化して連結した署名を返す。
+        """
         try:
             entity_type = absolute_entity['dxftype']
             attrs = absolute_entity['attributes']
@@ -413,7 +593,7 @@ class SignatureGenerator:
             
             if position:
                 normalized_pos = self.transformer.normalize_coordinate_with_context(position, entity_type)
-                signature_parts.append(f"pos_{normalized_pos}")
+                signature_parts.append(('pos', normalized_pos))
             
             # INSERT位置情報は除外（絶対座標変換済みのため不要）
             # 同じ最終座標・属性の entities は INSERT 元に関係なく同一として扱う
@@ -422,12 +602,12 @@ class SignatureGenerator:
             text_content = absolute_entity.get('text_content')
             if text_content and text_content.strip():
                 clean_text = text_content.strip().replace('\n', '').replace('\r', '')
-                signature_parts.append(f"text_{clean_text}")
+                signature_parts.append(('text', clean_text))
             
             # ATTRIB固有情報
             if entity_type == 'ATTRIB':
                 attrib_tag = absolute_entity.get('attrib_tag', '')
-                signature_parts.append(f"tag_{attrib_tag}")
+                signature_parts.append(('tag', attrib_tag))
             
             # 重要な属性
             self._add_important_attributes(signature_parts, attrs, entity_type, absolute_entity)
@@ -435,120 +615,118 @@ class SignatureGenerator:
             # ジオメトリ詳細
             self._add_geometry_details(signature_parts, entity_type, attrs)
             
-            return "_".join(str(p) for p in signature_parts)
+            signature = tuple(signature_parts)
+            try:
+                hash(signature)
+            except TypeError:
+                return "_".join(str(p) for p in signature_parts)
+            return signature
             
         except Exception as e:
             if self.debug:
                 logger.debug(f"Error creating signature: {e}")
-            return f"{entity_type}_error_{id(absolute_entity)}"
+            return (entity_type, 'error', id(absolute_entity))
     
     def _add_important_attributes(self, signature_parts: List, attrs: Dict, 
                                 entity_type: str, absolute_entity: Dict):
         """重要な属性を署名に追加"""
         important_attrs = ['color', 'height', 'radius', 'start_angle', 'end_angle']
+        transformer = self.transformer
+        tolerance_config = transformer.tolerance_config
         
         for attr_name in important_attrs:
             if attr_name in attrs:
                 value = attrs[attr_name]
                 if isinstance(value, (int, float)):
                     if attr_name in ['height', 'radius'] and absolute_entity.get('scale_factors'):
-                        tolerance = self.transformer.tolerance_config.get_tolerance_for_entity(
-                            entity_type, attr_name) * 2
+                        tolerance = tolerance_config.get_tolerance_for_entity(entity_type, attr_name) * 2
                     else:
-                        tolerance = self.transformer.tolerance_config.get_tolerance_for_entity(
-                            entity_type, attr_name)
-                    value = self.transformer.normalize_coordinate_precise(float(value), tolerance)
-                signature_parts.append(f"{attr_name}_{value}")
+                        tolerance = tolerance_config.get_tolerance_for_entity(entity_type, attr_name)
+                    value = transformer.normalize_coordinate_precise(float(value), tolerance)
+                signature_parts.append((attr_name, value))
         
         # 回転角度の特別処理
         if 'rotation' in attrs:
             rotation = attrs['rotation']
             if isinstance(rotation, (int, float)):
                 normalized_rotation = float(rotation) % (2 * math.pi)
-                angle_tolerance = self.transformer.tolerance_config.angle_tolerance
-                normalized_rotation = self.transformer.normalize_coordinate_precise(
-                    normalized_rotation, math.radians(angle_tolerance))
-                signature_parts.append(f"rotation_{normalized_rotation}")
+                normalized_rotation = transformer.normalize_coordinate_precise(
+                    normalized_rotation, tolerance_config.angle_tolerance_rad)
+                signature_parts.append(('rotation', normalized_rotation))
     
     def _add_geometry_details(self, signature_parts: List, entity_type: str, attrs: Dict):
-        """ジオメトリ詳細を署名に追加"""
-        if entity_type == 'LINE' and 'start' in attrs and 'end' in attrs:
-            start = self.transformer.normalize_coordinate_with_context(attrs['start'], entity_type)
-            end = self.transformer.normalize_coordinate_with_context(attrs['end'], entity_type)
-            signature_parts.append(f"line_{start}_{end}")
-        
-        elif entity_type == 'CIRCLE' and 'center' in attrs and 'radius' in attrs:
-            center = self.transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
+        """ジオメトリ詳細を署名に追加（エンティティタイプごとの処理を辞書で選択）"""
+        handler = self._geometry_handlers.get(entity_type)
+        if handler is not None:
+            handler(signature_parts, attrs)
+    
+    def _add_line_details(self, signature_parts: List, attrs: Dict):
+        """LINEの始点・終点を署名に追加"""
+        if 'start' in attrs and 'end' in attrs:
+            start = self.transformer.normalize_coordinate_with_context(attrs['start'], 'LINE')
+            end = self.transformer.normalize_coordinate_with_context(attrs['end'], 'LINE')
+            signature_parts.append(('line', start, end))
+    
+    def _add_circle_details(self, signature_parts: List, attrs: Dict):
+        """CIRCLEの中心・半径を署名に追加"""
+        if 'center' in attrs and 'radius' in attrs:
+            center = self.transformer.normalize_coordinate_with_context(attrs['center'], 'CIRCLE')
             radius = self.transformer.normalize_coordinate_precise(
                 attrs['radius'], self.transformer.tolerance_config.length_tolerance)
-            signature_parts.append(f"circle_{center}_{radius}")
-        
-        elif entity_type == 'ARC' and 'center' in attrs:
-            center = self.transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
-            radius = self.transformer.normalize_coordinate_precise(
-                attrs.get('radius', 0), self.transformer.tolerance_config.length_tolerance)
-            start_angle = self.transformer.normalize_coordinate_precise(
-                attrs.get('start_angle', 0), 
-                math.radians(self.transformer.tolerance_config.angle_tolerance))
-            end_angle = self.transformer.normalize_coordinate_precise(
-                attrs.get('end_angle', 0), 
-                math.radians(self.transformer.tolerance_config.angle_tolerance))
-            signature_parts.append(f"arc_{center}_{radius}_{start_angle}_{end_angle}")
-        
-        elif entity_type == 'ELLIPSE' and 'center' in attrs:
-            center = self.transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
-            major_axis = self.transformer.normalize_coordinate_with_context(
-                attrs.get('major_axis', (1, 0, 0)), entity_type)
-            ratio = self.transformer.normalize_coordinate_precise(
-                attrs.get('ratio', 1.0), self.transformer.tolerance_config.length_tolerance)
-            start_param = self.transformer.normalize_coordinate_precise(
-                attrs.get('start_param', 0.0), 
-                math.radians(self.transformer.tolerance_config.angle_tolerance))
-            end_param = self.transformer.normalize_coordinate_precise(
-                attrs.get('end_param', 2 * math.pi), 
-                math.radians(self.transformer.tolerance_config.angle_tolerance))
-            signature_parts.append(f"ellipse_{center}_{major_axis}_{ratio}_{start_param}_{end_param}")
-        
-        elif entity_type == 'LWPOLYLINE' and 'vertices' in attrs:
-            vertices = attrs['vertices']
-            if vertices:
-                normalized_vertices = []
-                for vertex in vertices[:5]:  # 最初の5頂点のみ
-                    if len(vertex) >= 2:
-                        norm_vertex = self.transformer.normalize_coordinate_with_context(
-                            (vertex[0], vertex[1]), entity_type)
-                        normalized_vertices.append(norm_vertex)
-                if normalized_vertices:
-                    signature_parts.append(f"lwpoly_vertices_{normalized_vertices}")
-
+            signature_parts.append(('circle', center, radius))
+    
+    def _add_arc_details(self, signature_parts: List, attrs: Dict):
+        """ARCの中心・半径・開始/終了角度を署名に追加"""
+        if 'center' in attrs:
+            transformer = self.transformer
+            tolerance_config = transformer.tolerance_config
+            center = transformer.normalize_coordinate_with_context(attrs['center'], 'ARC')
+            radius = transformer.normalize_coordinate_precise(
+                attrs.get('radius', 0), tolerance_config.length_tolerance)
+            start_angle = transformer.normalize_coordinate_precise(
+                attrs.get('start_angle', 0), tolerance_config.angle_tolerance_rad)
+            end_angle = transformer.normalize_coordinate_precise(
+                attrs.get('end_angle', 0), tolerance_config.angle_tolerance_rad)
+            signature_parts.append(('arc', center, radius, start_angle, end_angle))
+    
+    def _add_ellipse_details(self, signature_parts: List, attrs: Dict):
+        """ELLIPSEの中心・長軸・比率・パラメータ範囲を署名に追加"""
+        if 'center' in attrs:
+            transformer = self.transformer
+            tolerance_config = transformer.tolerance_config
+            center = transformer.normalize_coordinate_with_context(attrs['center'], 'ELLIPSE')
+            major_axis = transformer.normalize_coordinate_with_context(
+                attrs.get('major_axis', (1, 0, 0)), 'ELLIPSE')
+            ratio = transformer.normalize_coordinate_precise(
+                attrs.get('ratio', 1.0), tolerance_config.length_tolerance)
+            start_param = transformer.normalize_coordinate_precise(
+                attrs.get('start_param', 0.0), tolerance_config.angle_tolerance_rad)
+            end_param = transformer.normalize_coordinate_precise(
+                attrs.get('end_param', 2 * math.pi), tolerance_config.angle_tolerance_rad)
+            signature_parts.append(('ellipse', center, major_axis, ratio, start_param, end_param))
+    
+    def _add_lwpolyline_details(self, signature_parts: List, attrs: Dict):
+        """LWPOLYLINEの頂点（最初の5頂点のみ）を署名に追加"""
+        vertices = attrs.get('vertices')
+        if vertices:
+            normalized_vertices = []
+            for vertex in vertices[:5]:  # 最初の5頂点のみ
+                if len(vertex) >= 2:
+                    norm_vertex = self.transformer.normalize_coordinate_with_context(
+                        (vertex[0], vertex[1]), 'LWPOLYLINE')
+                    normalized_vertices.append(norm_vertex)
+            if normalized_vertices:
+                signature_parts.append(('lwpoly_vertices', tuple(normalized_vertices)))
 
 class DiffAnalyzer:
     """差分検出専用クラス"""
     
+    __slots__ = ('signature_generator', 'debug')
+    
     def __init__(self, signature_generator: SignatureGenerator, debug: bool = False):
         self.signature_generator = signature_generator
         self.debug = debug
     
-    def generate_enhanced_hash(self, entity_data: Dict) -> Optional[str]:
-        """改善されたハッシュ生成"""
-        if entity_data is None:
-            return None
-        
-        try:
-            signature = entity_data.get('absolute_signature', '')
-            if signature:
-                hash_value = hashlib.sha256(signature.encode('utf-8')).hexdigest()
-            else:
-                json_str = json.dumps(entity_data, sort_keys=True, ensure_ascii=False, 
-                                    separators=(',', ':'), default=str)
-                hash_value = hashlib.sha256(json_str.encode('utf-8')).hexdigest()
-            
-            return hash_value
-            
-        except Exception as e:
-            logger.warning(f"Failed to generate hash: {e}")
-            return None
-    
     def create_entity_data_from_absolute(self, absolute_entity: Dict) -> Optional[Dict]:
         """絶対座標エンティティからハッシュ用データ作成"""
         try:
@@ -582,22 +760,35 @@ class DiffAnalyzer:
         try:
             entity_type = absolute_entity['dxftype']
             attrs = absolute_entity['attributes']
+            transformer = self.signature_generator.transformer
+            
+            # 署名の末尾のジオメトリ項目（('line', 始点, 終点) など）には正規化済みの座標が入っているため、
+            # 署名がタプルの場合はそれを再利用して同じ座標の正規化を繰り返さない
+            signature = entity_data.get('absolute_signature')
+            geometry = signature[-1] if isinstance(signature, tuple) else None
+            if not isinstance(geometry, tuple):
+                geometry = (None,)
             
             if entity_type == 'LINE' and 'start' in attrs and 'end' in attrs:
-                start = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs['start'], entity_type)
-                end = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs['end'], entity_type)
+                if geometry[0] == 'line':
+                    _, start, end = geometry
+                else:
+                    start = transformer.normalize_coordinate_with_context(attrs['start'], entity_type)
+                    end = transformer.normalize_coordinate_with_context(attrs['end'], entity_type)
                 entity_data['line_geometry'] = {'start': start, 'end': end}
             
             elif entity_type == 'CIRCLE' and 'center' in attrs and 'radius' in attrs:
-                center = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs['center'], entity_type)
+                if geometry[0] == 'circle':
+                    center = geometry[1]
+                else:
+                    center = transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
                 entity_data['circle_geometry'] = {'center': center, 'radius': attrs['radius']}
             
             elif entity_type == 'ARC' and 'center' in attrs:
-                center = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs['center'], entity_type)
+                if geometry[0] == 'arc':
+                    center = geometry[1]
+                else:
+                    center = transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
                 entity_data['arc_geometry'] = {
                     'center': center, 
                     'radius': attrs.get('radius', 0),
@@ -606,10 +797,12 @@ class DiffAnalyzer:
                 }
             
             elif entity_type == 'ELLIPSE' and 'center' in attrs:
-                center = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs['center'], entity_type)
-                major_axis = self.signature_generator.transformer.normalize_coordinate_with_context(
-                    attrs.get('major_axis', (1, 0, 0)), entity_type)
+                if geometry[0] == 'ellipse':
+                    center, major_axis = geometry[1], geometry[2]
+                else:
+                    center = transformer.normalize_coordinate_with_context(attrs['center'], entity_type)
+                    major_axis = transformer.normalize_coordinate_with_context(
+                        attrs.get('major_axis', (1, 0, 0)), entity_type)
                 entity_data['ellipse_geometry'] = {
                     'center': center,
                     'major_axis': major_axis,
@@ -621,11 +814,31 @@ class DiffAnalyzer:
         except Exception:
             pass
     
-    def extract_entities_from_doc(self, doc, doc_label: str, expander: EntityExpander) -> Tuple[Dict[str, List], Dict[str, Dict], Dict[str, Set[str]]]:
-        """ドキュメントからエンティティを抽出"""
-        entities_by_hash = defaultdict(list)
-        hash_to_entity_data = {}
-        hash_to_locations = defaultdict(set)
+    @staticmethod
+    def iter_occurrences(entry) -> Iterable[Tuple[str, Dict]]:
+        """extract_entities_from_docの値（単独の出現またはそのリスト）から (出現位置, 仮想エンティティ) を順に取り出す"""
+        if isinstance(entry, tuple):
+            return (entry,)
+        return entry
+    
+    @staticmethod
+    def first_occurrence(entry) -> Tuple[str, Dict]:
+        """extract_entities_from_docの値から最初の (出現位置, 仮想エンティティ) を取り出す"""
+        if isinstance(entry, tuple):
+            return entry
+        return entry[0]
+    
+    def extract_entities_from_doc(self, doc, doc_label: str, expander: EntityExpander) -> Dict[Any, Any]:
+        """
+        ドキュメントからエンティティを抽出
+        
+        署名 -> (出現位置, 仮想エンティティ) の辞書を返す。大半の署名は一度しか現れないため、
+        同じ署名が複数回現れた場合のみ値を [(出現位置, 仮想エンティティ), ...] のリストにする
+        （値はiter_occurrencesで統一的に扱える）。
+        """
+        entities_by_hash = {}
+        # ブロック名 -> 出現位置の文字列（同じブロックから展開されたエンティティで文字列を共有する）
+        location_names = {}
         
         absolute_entities = expander.expand_insert_entities(doc, doc_label)
         
@@ -633,28 +846,36 @@ class DiffAnalyzer:
             try:
                 entity_data = self.create_entity_data_from_absolute(absolute_entity)
                 if entity_data:
-                    entity_hash = self.generate_enhanced_hash(entity_data)
-                    if entity_hash:
+                    # 署名（タプル）をそのまま辞書のキーとして使う（ハッシュ文字列への変換は不要）
+                    signature = entity_data['absolute_signature']
+                    if signature:
                         if absolute_entity.get('is_direct_modelspace'):
                             location = 'modelspace'
                         else:
                             insert_info = absolute_entity.get('insert_info', {})
                             block_name = insert_info.get('block_name', 'unknown')
-                            location = f"expanded_from_{block_name}"
+                            location = location_names.get(block_name)
+                            if location is None:
+                                location = location_names[block_name] = f"expanded_from_{block_name}"
                         
                         virtual_entity = {
                             'data': entity_data,
                             'absolute_entity': absolute_entity
                         }
                         
-                        entities_by_hash[entity_hash].append((location, virtual_entity))
-                        hash_to_entity_data[entity_hash] = entity_data
-                        hash_to_locations[entity_hash].add(location)
+                        occurrence = (location, virtual_entity)
+                        existing = entities_by_hash.get(signature)
+                        if existing is None:
+                            entities_by_hash[signature] = occurrence
+                        elif isinstance(existing, tuple):
+                            entities_by_hash[signature] = [existing, occurrence]
+                        else:
+                            existing.append(occurrence)
                         
             except Exception as e:
                 logger.warning(f"Error processing entity: {e}")
         
-        return entities_by_hash, hash_to_entity_data, hash_to_locations
+        return entities_by_hash
 
 
 class LayerConfig:
@@ -695,11 +916,28 @@ class OutputGenerator:
         self.transformer = transformer
         self.layer_config = layer_config
         self.debug = debug
+        # 差分タイプ -> (レイヤー名, レイヤー色)（設定は出力中に変わらないため一度だけ取得）
+        self._layer_cache = {
+            diff_type: (layer_config.get_layer_name(diff_type), layer_config.get_layer_color(diff_type))
+            for diff_type in ('DELETED', 'ADDED', 'UNCHANGED')
+        }
         self.excluded_attributes = {
             'handle', 'owner', 'reactors', 'dictionary', 'extension_dict',
             'objectid', 'uuid', 'app_data', 'doc', 'entitydb', 'is_alive', 
             'is_virtual', 'is_copy', 'soft_pointer_ids', 'hard_pointer_ids'
         }
+        # エンティティタイプ -> 差分DXFへのエンティティ作成処理
+        self._entity_creators = {
+            'LINE': self._create_line,
+            'CIRCLE': self._create_circle,
+            'ARC': self._create_arc,
+            'ELLIPSE': self._create_ellipse,
+            'TEXT': self._create_text,
+            'MTEXT': self._create_mtext,
+            'ATTRIB': self._create_attrib,
+            'POINT': self._create_point,
+            'LWPOLYLINE': self._create_lwpolyline,
+        }
     
     def create_entity_from_absolute(self, absolute_entity: Dict, target_space, layer_name: str, layer_color: int) -> bool:
         """絶対座標エンティティから実際のDXFエンティティを作成（レイヤー指定）"""
@@ -714,96 +952,9 @@ class OutputGenerator:
             dxfattribs['layer'] = layer_name
             dxfattribs['color'] = layer_color
             
-            if entity_type == 'LINE':
-                start = attrs.get('start', (0, 0, 0))
-                end = attrs.get('end', (1, 1, 0))
-                target_space.add_line(start=start, end=end, dxfattribs=dxfattribs)
-                
-            elif entity_type == 'CIRCLE':
-                center = attrs.get('center', (0, 0, 0))
-                radius = attrs.get('radius', 1.0)
-                target_space.add_circle(center=center, radius=radius, dxfattribs=dxfattribs)
-                
-            elif entity_type == 'ARC':
-                center = attrs.get('center', (0, 0, 0))
-                radius = attrs.get('radius', 1.0)
-                start_angle = attrs.get('start_angle', 0.0)
-                end_angle = attrs.get('end_angle', 90.0)
-                target_space.add_arc(center=center, radius=radius,
-                                   start_angle=start_angle, end_angle=end_angle,
-                                   dxfattribs=dxfattribs)
-                
-            elif entity_type == 'ELLIPSE':
-                center = attrs.get('center', (0, 0, 0))
-                major_axis = attrs.get('major_axis', (1, 0, 0))
-                ratio = attrs.get('ratio', 1.0)
-                start_param = attrs.get('start_param', 0.0)
-                end_param = attrs.get('end_param', 2 * math.pi)
-                target_space.add_ellipse(center=center, major_axis=major_axis,
-                                       ratio=ratio, start_param=start_param, 
-                                       end_param=end_param, dxfattribs=dxfattribs)
-                
-            elif entity_type == 'TEXT':
-                text_content = absolute_entity.get('text_content', '')
-                insert_pos = attrs.get('insert', (0, 0, 0))
-                text_attrs = dxfattribs.copy()
-                text_attrs['insert'] = insert_pos
-                target_space.add_text(text=text_content, dxfattribs=text_attrs)
-                
-            elif entity_type == 'MTEXT':
-                text_content = absolute_entity.get('text_content', '')
-                insert_pos = attrs.get('insert', (0, 0, 0))
-                text_attrs = dxfattribs.copy()
-                text_attrs['insert'] = insert_pos
-                target_space.add_mtext(text=text_content, dxfattribs=text_attrs)
-                
-            elif entity_type == 'ATTRIB':
-                text_content = absolute_entity.get('text_content', '')
-                attrib_tag = absolute_entity.get('attrib_tag', '')
-                insert_pos = attrs.get('insert', (0, 0, 0))
-                
-                display_text = text_content if text_content else f"[{attrib_tag}]"
-                text_height = dxfattribs.get('height', 2.5)
-                
-                target_space.add_text(
-                    text=display_text,
-                    dxfattribs={
-                        'layer': layer_name,
-                        'insert': insert_pos,
-                        'height': text_height,
-                        'rotation': dxfattribs.get('rotation', 0.0),
-                        'color': layer_color,
-                        'style': dxfattribs.get('style', 'Standard')
-                    }
-                )
-                
-            elif entity_type == 'POINT':
-                location = attrs.get('location', (0, 0, 0))
-                target_space.add_point(location=location, dxfattribs=dxfattribs)
-            
-            elif entity_type == 'LWPOLYLINE':
-                vertices = attrs.get('vertices', [])
-                if vertices:
-                    vertex_points = [(v[0], v[1]) for v in vertices if len(v) >= 2]
-                    if vertex_points:
-                        new_entity = target_space.add_lwpolyline(points=vertex_points)
-                        new_entity.dxf.layer = layer_name
-                        new_entity.dxf.color = layer_color
-                        if len(vertex_points) >= 3:
-                            new_entity.close()
-            
-            else:
-                # サポートされていないエンティティ
-                insert_pos = attrs.get('insert', attrs.get('center', (0, 0, 0)))
-                target_space.add_text(
-                    text=f"[{entity_type}]",
-                    dxfattribs={
-                        'layer': layer_name, 
-                        'insert': insert_pos,
-                        'height': 2.5,
-                        'color': layer_color
-                    }
-                )
+            # エンティティタイプごとの作成処理を辞書で選択（サポートされていないタイプはプレースホルダー）
+            creator = self._entity_creators.get(entity_type, self._create_unsupported)
+            creator(target_space, absolute_entity, attrs, dxfattribs, layer_name, layer_color)
             
             return True
                 
@@ -812,116 +963,189 @@ class OutputGenerator:
                 logger.debug(f"Error creating entity {entity_type}: {e}")
             return False
     
-    def _ensure_japanese_text_compatibility(self, output_file: str):
-        """日本語テキストの互換性を確保"""
-        try:
-            # DXF R2018+ はネイティブでUTF-8をサポートするため、
-            # ファイルがUTF-8で正しく保存されていることを確認
-            with open(output_file, 'rb') as f:
-                content = f.read()
-            
-            # UTF-8として読み込み、正常に読み込めることを確認
-            try:
-                text_content = content.decode('utf-8')
-                # UTF-8で正常に読み込める場合は何もしない
-                logger.info("DXF file successfully uses UTF-8 encoding for Japanese text")
-                return
-            except UnicodeDecodeError:
-                # UTF-8で読めない場合のみ修正を試行
-                logger.warning("DXF file encoding issue detected, attempting to fix")
-                
-                # エラー許容でUTF-8として読み込み
-                text_content = content.decode('utf-8', errors='replace')
-                
-                # UTF-8で再保存
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(text_content)
-                    
-        except Exception as e:
-            logger.warning(f"Error ensuring Japanese text compatibility: {e}")
-            # エラーの場合は元のファイルをそのまま使用
+    def _create_line(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                     layer_name: str, layer_color: int):
+        """LINEを作成"""
+        start = attrs.get('start', (0, 0, 0))
+        end = attrs.get('end', (1, 1, 0))
+        target_space.add_line(start=start, end=end, dxfattribs=dxfattribs)
+    
+    def _create_circle(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                       layer_name: str, layer_color: int):
+        """CIRCLEを作成"""
+        center = attrs.get('center', (0, 0, 0))
+        radius = attrs.get('radius', 1.0)
+        target_space.add_circle(center=center, radius=radius, dxfattribs=dxfattribs)
+    
+    def _create_arc(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                    layer_name: str, layer_color: int):
+        """ARCを作成"""
+        center = attrs.get('center', (0, 0, 0))
+        radius = attrs.get('radius', 1.0)
+        start_angle = attrs.get('start_angle', 0.0)
+        end_angle = attrs.get('end_angle', 90.0)
+        target_space.add_arc(center=center, radius=radius,
+                           start_angle=start_angle, end_angle=end_angle,
+                           dxfattribs=dxfattribs)
+    
+    def _create_ellipse(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                        layer_name: str, layer_color: int):
+        """ELLIPSEを作成"""
+        center = attrs.get('center', (0, 0, 0))
+        major_axis = attrs.get('major_axis', (1, 0, 0))
+        ratio = attrs.get('ratio', 1.0)
+        start_param = attrs.get('start_param', 0.0)
+        end_param = attrs.get('end_param', 2 * math.pi)
+        target_space.add_ellipse(center=center, major_axis=major_axis,
+                               ratio=ratio, start_param=start_param, 
+                               end_param=end_param, dxfattribs=dxfattribs)
+    
+    def _create_text(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                     layer_name: str, layer_color: int):
+        """TEXTを作成"""
+        text_content = absolute_entity.get('text_content', '')
+        text_attrs = dxfattribs.copy()
+        text_attrs['insert'] = attrs.get('insert', (0, 0, 0))
+        target_space.add_text(text=text_content, dxfattribs=text_attrs)
+    
+    def _create_mtext(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                      layer_name: str, layer_color: int):
+        """MTEXTを作成"""
+        text_content = absolute_entity.get('text_content', '')
+        text_attrs = dxfattribs.copy()
+        text_attrs['insert'] = attrs.get('insert', (0, 0, 0))
+        target_space.add_mtext(text=text_content, dxfattribs=text_attrs)
+    
+    def _create_attrib(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                       layer_name: str, layer_color: int):
+        """ATTRIBをTEXTとして作成（値が空の場合はタグを表示）"""
+        text_content = absolute_entity.get('text_content', '')
+        attrib_tag = absolute_entity.get('attrib_tag', '')
+        insert_pos = attrs.get('insert', (0, 0, 0))
+        
+        display_text = text_content if text_content else f"[{attrib_tag}]"
+        text_height = dxfattribs.get('height', 2.5)
+        
+        target_space.add_text(
+            text=display_text,
+            dxfattribs={
+                'layer': layer_name,
+                'insert': insert_pos,
+                'height': text_height,
+                'rotation': dxfattribs.get('rotation', 0.0),
+                'color': layer_color,
+                'style': dxfattribs.get('style', 'Standard')
+            }
+        )
     
-    def create_diff_dxf(self, entities_a: Dict, entities_b: Dict, 
-                        deleted_hashes: Set[str], added_hashes: Set[str], 
-                        common_hashes: Set[str], output_file: str):
-        """差分DXFファイルを作成"""
+    def _create_point(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                      layer_name: str, layer_color: int):
+        """POINTを作成"""
+        location = attrs.get('location', (0, 0, 0))
+        target_space.add_point(location=location, dxfattribs=dxfattribs)
+    
+    def _create_lwpolyline(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                           layer_name: str, layer_color: int):
+        """LWPOLYLINEを作成"""
+        vertices = attrs.get('vertices', [])
+        if vertices:
+            vertex_points = [(v[0], v[1]) for v in vertices if len(v) >= 2]
+            if vertex_points:
+                new_entity = target_space.add_lwpolyline(points=vertex_points)
+                new_entity.dxf.layer = layer_name
+                new_entity.dxf.color = layer_color
+                if len(vertex_points) >= 3:
+                    new_entity.close()
+    
+    def _create_unsupported(self, target_space, absolute_entity: Dict, attrs: Dict, dxfattribs: Dict,
+                            layer_name: str, layer_color: int):
+        """サポートされていないエンティティはタイプ名のTEXTで示す"""
+        insert_pos = attrs.get('insert', attrs.get('center', (0, 0, 0)))
+        target_space.add_text(
+            text=f"[{absolute_entity['dxftype']}]",
+            dxfattribs={
+                'layer': layer_name, 
+                'insert': insert_pos,
+                'height': 2.5,
+                'color': layer_color
+            }
+        )
+    
+    def _add_diff_entities(self, msp, diff_type: str, entities: Dict, hashes: Set):
+        """署名ごとに最初のインスタンスのエンティティを差分タイプのレイヤーに追加"""
+        layer_name, layer_color = self._layer_cache[diff_type]
+        
+        for entity_hash in hashes:
+            entry = entities.get(entity_hash)
+            if entry:
+                _, virtual_entity = DiffAnalyzer.first_occurrence(entry)
+                self.create_entity_from_absolute(
+                    virtual_entity['absolute_entity'], msp, layer_name, layer_color)
+    
+    def build_diff_document(self, entities_a: Dict, entities_b: Dict, 
+                            deleted_hashes: Set[str], added_hashes: Set[str], 
+                            common_hashes: Set[str]):
+        """差分DXFドキュメントを作成"""
+        # R2018以降でより良いUnicode対応
+        new_doc = ezdxf.new('R2018', setup=True)
+        msp = new_doc.modelspace()
+        
+        # レイヤーを作成
+        layers = new_doc.layers
+        for layer_name, layer_color in self._layer_cache.values():
+            layer = layers.new(layer_name)
+            layer.color = layer_color
+        
+        # DELETED・ADDED・UNCHANGED の各エンティティを追加（同じ署名のエンティティは最初のインスタンスのみ）
+        self._add_diff_entities(msp, 'DELETED', entities_a, deleted_hashes)
+        self._add_diff_entities(msp, 'ADDED', entities_b, added_hashes)
+        self._add_diff_entities(msp, 'UNCHANGED', entities_a, common_hashes)
+        
+        return new_doc
+    
+    def create_diff_dxf_bytes(self, entities_a: Dict, entities_b: Dict, 
+                              deleted_hashes: Set[str], added_hashes: Set[str], 
+                              common_hashes: Set[str], dxf_format: str = 'asc') -> Optional[bytes]:
+        """差分DXFをファイルを介さずにバイトデータとして作成（dxf_format: 'asc'=ASCII, 'bin'=バイナリ）"""
         try:
-            # R2018以降でより良いUnicode対応
-            new_doc = ezdxf.new('R2018', setup=True)
-            msp = new_doc.modelspace()
-            
-            # レイヤーを作成
-            layers = new_doc.layers
-            for diff_type in ['DELETED', 'ADDED', 'UNCHANGED']:
-                layer_name = self.layer_config.get_layer_name(diff_type)
-                layer_color = self.layer_config.get_layer_color(diff_type)
-                layer = layers.new(layer_name)
-                layer.color = layer_color
-            
-            # DELETED エンティティを追加
-            layer_name = self.layer_config.get_layer_name('DELETED')
-            layer_color = self.layer_config.get_layer_color('DELETED')
-            
-            for entity_hash in deleted_hashes:
-                if entity_hash in entities_a:
-                    for location, virtual_entity in entities_a[entity_hash]:
-                        absolute_entity = virtual_entity['absolute_entity']
-                        self.create_entity_from_absolute(absolute_entity, msp, layer_name, layer_color)
-                        break  # 最初のインスタンスのみ
-            
-            # ADDED エンティティを追加
-            layer_name = self.layer_config.get_layer_name('ADDED')
-            layer_color = self.layer_config.get_layer_color('ADDED')
-            
-            for entity_hash in added_hashes:
-                if entity_hash in entities_b:
-                    for location, virtual_entity in entities_b[entity_hash]:
-                        absolute_entity = virtual_entity['absolute_entity']
-                        self.create_entity_from_absolute(absolute_entity, msp, layer_name, layer_color)
-                        break  # 最初のインスタンスのみ
-            
-            # UNCHANGED エンティティを追加
-            layer_name = self.layer_config.get_layer_name('UNCHANGED')
-            layer_color = self.layer_config.get_layer_color('UNCHANGED')
-            
-            for entity_hash in common_hashes:
-                if entity_hash in entities_a:
-                    for location, virtual_entity in entities_a[entity_hash]:
-                        absolute_entity = virtual_entity['absolute_entity']
-                        self.create_entity_from_absolute(absolute_entity, msp, layer_name, layer_color)
-                        break  # 最初のインスタンスのみ
-            
-            # DXFファイルを保存（UTF-8エンコーディングで日本語テキストを保持）
-            new_doc.saveas(output_file)
-            
-            # 日本語テキストの互換性確保
-            self._ensure_japanese_text_compatibility(output_file)
-            return True
+            new_doc = self.build_diff_document(
+                entities_a, entities_b, deleted_hashes, added_hashes, common_hashes)
+            
+            if dxf_format == 'bin':
+                stream = io.BytesIO()
+                new_doc.write(stream, fmt='bin')
+                return stream.getvalue()
+            
+            # 出力エンコーディング（R2018はUTF-8）で符号化し、符号化できない文字はDXFのエスケープ表記に置換
+            stream = io.StringIO()
+            new_doc.write(stream)
+            return new_doc.encode(stream.getvalue())
             
         except Exception as e:
-            logger.error(f"Error creating diff DXF file {output_file}: {e}")
-            return False
+            logger.error(f"Error creating diff DXF data: {e}")
+            return None
 
 
-def compare_dxf_files_and_generate_dxf(file_a: str, file_b: str, output_file: str, 
-                                       tolerance: float = 0.01, 
-                                       deleted_color: int = 6, 
-                                       added_color: int = 4, 
-                                       unchanged_color: int = 7) -> bool:
+def compare_dxf_files_and_generate_dxf_bytes(file_a: Any, file_b: Any, 
+                                             tolerance: float = 0.01, 
+                                             deleted_color: int = 6, 
+                                             added_color: int = 4, 
+                                             unchanged_color: int = 7,
+                                             dxf_format: str = 'asc') -> Optional[bytes]:
     """
-    DXFファイル比較メイン処理（Streamlit用インターフェース）
+    DXFファイル比較メイン処理（差分DXFをファイルを介さずにバイトデータとして返す）
     
     Args:
-        file_a: 基準DXFファイルパス
-        file_b: 比較対象DXFファイルパス
-        output_file: 出力DXFファイルパス
+        file_a: 基準DXFファイルパスまたは読み込み済みのDrawing
+        file_b: 比較対象DXFファイルパスまたは読み込み済みのDrawing
         tolerance: 座標許容誤差
         deleted_color: 削除エンティティの色（デフォルト: 6=マゼンタ）
         added_color: 追加エンティティの色（デフォルト: 4=シアン）
         unchanged_color: 変更なしエンティティの色（デフォルト: 7=白/黒）
+        dxf_format: 出力形式（'asc'=ASCII DXF, 'bin'=バイナリDXF）
         
     Returns:
-        bool: 成功した場合True、失敗した場合False
+        bytes: 差分DXFのバイトデータ（失敗した場合None）
     """
     try:
         # 設定の初期化
@@ -934,14 +1158,12 @@ def compare_dxf_files_and_generate_dxf(file_a: str, file_b: str, output_file: st
         output_generator = OutputGenerator(transformer, layer_config, debug=False)
         
         # DXFファイル読み込み
-        doc_a = ezdxf.readfile(file_a)
-        doc_b = ezdxf.readfile(file_b)
+        doc_a = load_dxf_document(file_a)
+        doc_b = load_dxf_document(file_b)
         
         # エンティティ抽出
-        entities_a, data_a, locations_a = diff_analyzer.extract_entities_from_doc(
-            doc_a, "A", expander)
-        entities_b, data_b, locations_b = diff_analyzer.extract_entities_from_doc(
-            doc_b, "B", expander)
+        entities_a = diff_analyzer.extract_entities_from_doc(doc_a, "A", expander)
+        entities_b = diff_analyzer.extract_entities_from_doc(doc_b, "B", expander)
         
         # 差分計算
         hashes_a = set(entities_a.keys())
@@ -951,12 +1173,44 @@ def compare_dxf_files_and_generate_dxf(file_a: str, file_b: str, output_file: st
         added_hashes = hashes_b - hashes_a
         common_hashes = hashes_a & hashes_b
         
-        # 差分DXFファイル生成
-        success = output_generator.create_diff_dxf(
-            entities_a, entities_b, deleted_hashes, added_hashes, common_hashes, output_file)
-        
-        return success
+        # 差分DXFデータ生成
+        return output_generator.create_diff_dxf_bytes(
+            entities_a, entities_b, deleted_hashes, added_hashes, common_hashes, dxf_format)
         
     except Exception as e:
         logger.error(f"DXF comparison error: {e}")
-        return False
\ No newline at end of file
+        return None
+
+
+def compare_dxf_files_and_generate_dxf(file_a: Any, file_b: Any, output_file: str, 
+                                       tolerance: float = 0.01, 
+                                       deleted_color: int = 6, 
+                                       added_color: int = 4, 
+                                       unchanged_color: int = 7) -> bool:
+    """
+    DXFファイル比較メイン処理（差分DXFをファイルに出力する）
+    
+    Args:
+        file_a: 基準DXFファイルパスまたは読み込み済みのDrawing
+        file_b: 比較対象DXFファイルパスまたは読み込み済みのDrawing
+        output_file: 出力DXFファイルパス
+        tolerance: 座標許容誤差
+        deleted_color: 削除エンティティの色（デフォルト: 6=マゼンタ）
+        added_color: 追加エンティティの色（デフォルト: 4=シアン）
+        unchanged_color: 変更なしエンティティの色（デフォルト: 7=白/黒）
+        
+    Returns:
+        bool: 成功した場合True、失敗した場合False
+    """
+    dxf_data = compare_dxf_files_and_generate_dxf_bytes(
+        file_a, file_b, tolerance, deleted_color, added_color, unchanged_color)
+    if dxf_data is None:
+        return False
+    
+    try:
+        with open(output_file, 'wb') as f:
+            f.write(dxf_data)
+        return True
+    except Exception as e:
+        logger.error(f"Error writing diff DXF file {output_file}: {e}")
+        return False
@@ -1,6 +1,8 @@
-import pandas as pd
 import io
+import xlsxwriter
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import os
 import sys
 
@@ -14,48 +16,163 @@ except ImportError:
 
 from utils.extract_labels import extract_labels
 
-def compare_labels_multi(file_pairs, filter_non_parts=False, sort_order="asc", validate_ref_designators=False):
+def extract_file_labels(dxf_source, filter_non_parts=False, sort_order="asc", validate_ref_designators=False):
+    """
+    1つのDXFファイルからラベルを抽出する（プロセスプールのワーカーからも呼び出される）
+    
+    Args:
+        dxf_source: DXFファイルのパスまたはバイトデータ
+        filter_non_parts: 回路記号（候補）のみを抽出するかどうか
+        sort_order: ソート順（"asc"=昇順, "desc"=降順, "none"=ソートなし）
+        validate_ref_designators: 回路記号の妥当性をチェックするかどうか
+        
+    Returns:
+        tuple: (ラベルリスト, 情報辞書)
+    """
+    return extract_labels(
+        dxf_source, 
+        filter_non_parts=filter_non_parts, 
+        sort_order=sort_order,
+        validate_ref_designators=validate_ref_designators
+    )
+
+def extract_all_pair_labels(file_pairs, filter_non_parts=False, sort_order="asc", validate_ref_designators=False,
+                            progress_callback=None):
+    """
+    全ペアのラベル抽出を実行する（複数ファイルの場合はプロセスプールで並列実行）
+    
+    同じファイルパス（またはバイトデータ）が複数のペアに含まれる場合（同一内容のアップロードを共有している場合）、
+    そのファイルの抽出は1回だけ行い、結果を各ペアで共有する。
+    
+    Args:
+        file_pairs: ファイルペアのリスト[(file_a, file_b, source_a, source_b, pair_name), ...]
+        filter_non_parts: 回路記号（候補）のみを抽出するかどうか
+        sort_order: ソート順（"asc"=昇順, "desc"=降順, "none"=ソートなし）
+        validate_ref_designators: 回路記号の妥当性をチェックするかどうか
+        progress_callback: 進捗通知用のコールバック関数 callback(完了ファイル数, 総ファイル数)
+        
+    Returns:
+        list: ペアの順序に対応した(ラベルリストA, 情報辞書A, ラベルリストB, 情報辞書B)のリスト
+    """
+    # 抽出対象のファイルを重複なく列挙（出現順を保持）
+    unique_files = list(dict.fromkeys(
+        dxf_source
+        for _, _, source_a, source_b, _ in file_pairs
+        for dxf_source in (source_a, source_b)
+    ))
+    total = len(unique_files)
+    results_by_file = {}
+    max_workers = min(total, os.cpu_count() or 1)
+    
+    # 1ファイルのみ（または1コア）の場合はプロセス起動のオーバーヘッドを避けて直接実行
+    if max_workers <= 1:
+        for completed, dxf_source in enumerate(unique_files, start=1):
+            results_by_file[dxf_source] = extract_file_labels(
+                dxf_source, filter_non_parts, sort_order, validate_ref_designators)
+            if progress_callback:
+                progress_callback(completed, total)
+    else:
+        # Streamlitはマルチスレッドで動作するため、forkではなくspawnでワーカーを起動する
+        # （forkでは他スレッドが保持中のロックを引き継いだ状態の子プロセスが生成される恐れがある）
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {
+                executor.submit(extract_file_labels, dxf_source,
+                                filter_non_parts, sort_order, validate_ref_designators): dxf_source
+                for dxf_source in unique_files
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                results_by_file[futures[future]] = future.result()
+                if progress_callback:
+                    progress_callback(completed, total)
+    
+    return [
+        results_by_file[source_a] + results_by_file[source_b]
+        for _, _, source_a, source_b, _ in file_pairs
+    ]
+
+def compare_labels_multi(file_pairs, filter_non_parts=False, sort_order="asc", validate_ref_designators=False,
+                         progress_callback=None):
     """
     複数のDXFファイルペアのラベル比較結果をExcelとして出力する
     
     Args:
-        file_pairs: ファイルペアのリスト[(file_a, file_b, temp_file_a, temp_file_b, pair_name), ...]
+        file_pairs: ファイルペアのリスト[(file_a, file_b, source_a, source_b, pair_name), ...]
           - file_a, file_b: 元のアップロードファイルオブジェクト
-          - temp_file_a, temp_file_b: 一時ファイルのパス
+          - source_a, source_b: DXFファイルのパスまたはバイトデータ（同一内容のファイルは同じデータを共有可能）
           - pair_name: ペア名
         filter_non_parts: 回路記号（候補）のみを抽出するかどうか
         sort_order: ソート順（"asc"=昇順, "desc"=降順, "none"=ソートなし）
         validate_ref_designators: 回路記号の妥当性をチェックするかどうか
+        progress_callback: ラベル抽出の進捗通知用コールバック関数 callback(完了ファイル数, 総ファイル数)
         
     Returns:
         bytes: 生成されたExcelファイルのバイナリデータ
     """
-    # Excelファイルを作成するためのライターオブジェクト
+    # 各ファイルのラベルを抽出（ファイル間は独立しているため並列実行）
+    pair_labels = extract_all_pair_labels(
+        file_pairs,
+        filter_non_parts=filter_non_parts,
+        sort_order=sort_order,
+        validate_ref_designators=validate_ref_designators,
+        progress_callback=progress_callback
+    )
+    
+    # Excelファイルを作成するためのワークブック（constant_memoryモードで行単位に書き出す）
     output = io.BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    
+    # セルの書式設定（全シート共通）
+    format_header = workbook.add_format({
+        'bold': True, 
+        'text_wrap': True, 
+        'valign': 'top', 
+        'border': 1,
+        'bg_color': '#D9E1F2'
+    })
+    
+    format_a_only = workbook.add_format({'bg_color': '#FFC7CE'})  # 淡い赤
+    format_b_only = workbook.add_format({'bg_color': '#C6EFCE'})  # 淡い緑
+    format_different = workbook.add_format({'bg_color': '#FFEB9C'})  # 淡い黄
+    
+    title_format = workbook.add_format({
+        'bold': True,
+        'font_size': 14,
+        'align': 'center',
+        'valign': 'vcenter'
+    })
+    pair_header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#4472C4',
+        'font_color': 'white'
+    })
+    
+    # 使用済みのシート名（Excelのシート名は大文字小文字を区別しない）
+    used_sheet_names = {"summary"}
+    
+    def add_unique_worksheet(name):
+        # constant_memoryモードでは書き出し済みの行に戻れないため、同名のシートは再利用せず
+        # 末尾に連番を付けた別シートを追加する（最大31文字）
+        unique_name = name
+        suffix = 2
+        while unique_name.lower() in used_sheet_names:
+            tag = f"_{suffix}"
+            unique_name = f"{name[:31 - len(tag)]}{tag}"
+            suffix += 1
+        used_sheet_names.add(unique_name.lower())
+        return workbook.add_worksheet(unique_name)
     
     # 各ペアを処理
-    for idx, (file_a, file_b, temp_file_a, temp_file_b, pair_name) in enumerate(file_pairs):
-        # ラベルを抽出（extract_labelsを再利用）- 一時ファイルパスを使用
-        labels_a, info_a = extract_labels(
-            temp_file_a, 
-            filter_non_parts=filter_non_parts, 
-            sort_order=sort_order,
-            validate_ref_designators=validate_ref_designators
-        )
-        labels_b, info_b = extract_labels(
-            temp_file_b, 
-            filter_non_parts=filter_non_parts, 
-            sort_order=sort_order,
-            validate_ref_designators=validate_ref_designators
-        )
+    for idx, (file_a, file_b, source_a, source_b, pair_name) in enumerate(file_pairs):
+        # 抽出済みのラベルを取得
+        labels_a, info_a, labels_b, info_b = pair_labels[idx]
         
         # ラベルの出現回数をカウント
         counter_a = Counter(labels_a)
         counter_b = Counter(labels_b)
         
         # すべてのユニークなラベルを取得
-        all_labels = sorted(set(list(counter_a.keys()) + list(counter_b.keys())))
+        all_labels = sorted(counter_a.keys() | counter_b.keys())
         
         # 元のアップロードファイル名を使用（UploadedFileオブジェクトから）
         file_a_base = os.path.splitext(file_a.name)[0]
@@ -70,44 +187,10 @@ def compare_labels_multi(file_pairs, filter_non_parts=False, sort_order="asc", v
         else:
             # ファイル名からシート名を生成
             sheet_name = f"Pair{idx+1}"[:31]
-            
-        # データフレームの作成
-        df = pd.DataFrame({
-            'Label': all_labels,
-            file_a_name: [counter_a.get(label, 0) for label in all_labels],
-            file_b_name: [counter_b.get(label, 0) for label in all_labels]
-        })
-        
-        # ラベルがファイルAにのみ存在する（Aのみ）、ファイルBにのみ存在する（Bのみ）、
-        # または両方に存在するが異なる回数（差異あり）、完全に一致（完全一致）を示す列を追加
-        df['Status'] = df.apply(lambda row: 
-            'A Only' if row[file_a_name] > 0 and row[file_b_name] == 0 else
-            'B Only' if row[file_a_name] == 0 and row[file_b_name] > 0 else
-            'Different' if row[file_a_name] != row[file_b_name] else
-            'Same', axis=1)
-        
-        # 差分情報の列を追加（B - A）
-        df['Diff (B-A)'] = df[file_b_name] - df[file_a_name]
-        
-        # データフレームをExcelシートに出力
-        df.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        # ワークシートとワークブックのオブジェクトを取得
-        worksheet = writer.sheets[sheet_name]
-        workbook = writer.book
-        
-        # セルの書式設定
-        format_header = workbook.add_format({
-            'bold': True, 
-            'text_wrap': True, 
-            'valign': 'top', 
-            'border': 1,
-            'bg_color': '#D9E1F2'
-        })
         
-        format_a_only = workbook.add_format({'bg_color': '#FFC7CE'})  # 淡い赤
-        format_b_only = workbook.add_format({'bg_color': '#C6EFCE'})  # 淡い緑
-        format_different = workbook.add_format({'bg_color': '#FFEB9C'})  # 淡い黄
+        # ワークシートに出力（constant_memoryモードのため行の順に書き込む）
+        worksheet = add_unique_worksheet(sheet_name)
+        sheet_name = worksheet.name
         
         # 列の幅を調整
         worksheet.set_column('A:A', 25)  # ラベル列
@@ -115,27 +198,43 @@ def compare_labels_multi(file_pairs, filter_non_parts=False, sort_order="asc", v
         worksheet.set_column('D:D', 15)  # ステータス列
         worksheet.set_column('E:E', 10)  # 差分列
         
-        # ヘッダー行の書式を設定
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, format_header)
+        # ヘッダー行（書式付き）
+        columns = ['Label', file_a_name, file_b_name, 'Status', 'Diff (B-A)']
+        worksheet.write_row(0, 0, columns, format_header)
+        
+        # 各ラベルの行を作成しながらそのまま書き出す（行データのリストは保持しない）
+        # ラベルがファイルAにのみ存在する（Aのみ）、ファイルBにのみ存在する（Bのみ）、
+        # または両方に存在するが異なる回数（差異あり）、完全に一致（完全一致）を示す列と
+        # 差分情報の列（B - A）を含む
+        status_counts = Counter()  # ステータスごとのラベル数（サマリー用）
+        for row_idx, label in enumerate(all_labels, start=1):
+            count_a = counter_a[label]
+            count_b = counter_b[label]
+            # 出現回数から直接ステータスを判定（ラベル集合の差分演算は不要）
+            status = ('A Only' if count_b == 0 else
+                      'B Only' if count_a == 0 else
+                      'Different' if count_a != count_b else
+                      'Same')
+            status_counts[status] += 1
+            worksheet.write_row(row_idx, 0, (label, count_a, count_b, status, count_b - count_a))
         
         # 条件付き書式の適用
         # 'Status'列が'A Only'の場合、行全体を淡い赤で表示
         # 'Status'列が'B Only'の場合、行全体を淡い緑で表示
         # 'Status'列が'Different'の場合、行全体を淡い黄で表示
-        worksheet.conditional_format(1, 0, len(df), len(df.columns)-1, {
+        worksheet.conditional_format(1, 0, len(all_labels), len(columns)-1, {
             'type': 'formula',
             'criteria': '=$D2="A Only"',
             'format': format_a_only
         })
         
-        worksheet.conditional_format(1, 0, len(df), len(df.columns)-1, {
+        worksheet.conditional_format(1, 0, len(all_labels), len(columns)-1, {
             'type': 'formula',
             'criteria': '=$D2="B Only"',
             'format': format_b_only
         })
         
-        worksheet.conditional_format(1, 0, len(df), len(df.columns)-1, {
+        worksheet.conditional_format(1, 0, len(all_labels), len(columns)-1, {
             'type': 'formula',
             'criteria': '=$D2="Different"',
             'format': format_different
@@ -150,102 +249,61 @@ def compare_labels_multi(file_pairs, filter_non_parts=False, sort_order="asc", v
             invalid_b = info_b.get('invalid_ref_designators', [])
             
             if invalid_a or invalid_b:
-                # 妥当性チェック結果シート名
-                validation_sheet_name = f"{sheet_name}_Invalid"[:31]
-                
-                # 適合しない回路記号をまとめる
-                max_len = max(len(invalid_a), len(invalid_b))
-                invalid_a_padded = invalid_a + [''] * (max_len - len(invalid_a))
-                invalid_b_padded = invalid_b + [''] * (max_len - len(invalid_b))
-                
-                validation_df = pd.DataFrame({
-                    f'Invalid in {file_a_base}': invalid_a_padded,
-                    f'Invalid in {file_b_base}': invalid_b_padded
-                })
-                
-                validation_df.to_excel(writer, sheet_name=validation_sheet_name, index=False)
-                
-                # 妥当性チェック結果シートのフォーマット
-                validation_worksheet = writer.sheets[validation_sheet_name]
+                # 妥当性チェック結果シート名（どのペアのシートか分かるよう接尾辞を残して最大31文字）
+                validation_sheet_name = f"{sheet_name[:31 - len('_Invalid')]}_Invalid"
+                validation_worksheet = add_unique_worksheet(validation_sheet_name)
                 validation_worksheet.set_column('A:B', 30)
                 
-                # ヘッダー行の書式を設定
-                for col_num, value in enumerate(validation_df.columns.values):
-                    validation_worksheet.write(0, col_num, value, format_header)
-        
-        # サマリー情報をシートの上部に追加
-        summary_data = [
-            [f"ファイルA: {file_a_name}", f"ラベル総数: {len(labels_a)}", f"ユニークラベル数: {len(counter_a)}"],
-            [f"ファイルB: {file_b_name}", f"ラベル総数: {len(labels_b)}", f"ユニークラベル数: {len(counter_b)}"],
-            ["", "", ""],
-            ["差分サマリー:", "", ""],
-            [f"Aのみのラベル: {sum(1 for s in df['Status'] if s == 'A Only')}", 
-             f"Bのみのラベル: {sum(1 for s in df['Status'] if s == 'B Only')}", 
-             f"異なる個数のラベル: {sum(1 for s in df['Status'] if s == 'Different')}"]
-        ]
-        
-        # 回路記号妥当性チェックの情報を追加
-        if validate_ref_designators and filter_non_parts:
-            invalid_a_count = len(info_a.get('invalid_ref_designators', []))
-            invalid_b_count = len(info_b.get('invalid_ref_designators', []))
-            summary_data.append([f"適合しない回路記号 A: {invalid_a_count}", 
-                                f"適合しない回路記号 B: {invalid_b_count}", ""])
+                # ヘッダー行（書式付き）と適合しない回路記号を並べて出力
+                validation_worksheet.write_row(
+                    0, 0, [f'Invalid in {file_a_base}', f'Invalid in {file_b_base}'], format_header)
+                max_len = max(len(invalid_a), len(invalid_b))
+                for row_idx in range(max_len):
+                    if row_idx < len(invalid_a):
+                        validation_worksheet.write(row_idx + 1, 0, invalid_a[row_idx])
+                    if row_idx < len(invalid_b):
+                        validation_worksheet.write(row_idx + 1, 1, invalid_b[row_idx])
         
         # サマリーシートを追加
         if idx == 0:
             summary_sheet = workbook.add_worksheet("Summary")
-            writer.sheets["Summary"] = summary_sheet
             
             # サマリーシートのタイトル
-            title_format = workbook.add_format({
-                'bold': True,
-                'font_size': 14,
-                'align': 'center',
-                'valign': 'vcenter'
-            })
             summary_sheet.merge_range('A1:C1', 'ラベル差分比較サマリー', title_format)
             
             # 各ペアの情報を追加
             summary_row = 2
-            pair_header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#4472C4',
-                'font_color': 'white'
-            })
-            summary_sheet.write(summary_row, 0, "シート名", pair_header_format)
-            summary_sheet.write(summary_row, 1, "ファイルA", pair_header_format)
-            summary_sheet.write(summary_row, 2, "ファイルB", pair_header_format)
-            summary_sheet.write(summary_row, 3, "Aのみ", pair_header_format)
-            summary_sheet.write(summary_row, 4, "Bのみ", pair_header_format)
-            summary_sheet.write(summary_row, 5, "異なる個数", pair_header_format)
-            summary_sheet.write(summary_row, 6, "ラベル総数", pair_header_format)
+            summary_headers = ["シート名", "ファイルA", "ファイルB", "Aのみ", "Bのみ", "異なる個数", "ラベル総数"]
             
             # 妥当性チェックが有効な場合は追加の列
             if validate_ref_designators and filter_non_parts:
-                summary_sheet.write(summary_row, 7, "適合しないA", pair_header_format)
-                summary_sheet.write(summary_row, 8, "適合しないB", pair_header_format)
+                summary_headers += ["適合しないA", "適合しないB"]
             
+            summary_sheet.write_row(summary_row, 0, summary_headers, pair_header_format)
             summary_row += 1
             
         # サマリーシートにこのペアの情報を追加
-        summary_sheet = writer.sheets["Summary"]
-        summary_sheet.write(idx+3, 0, sheet_name)
-        summary_sheet.write(idx+3, 1, file_a_base)  # 元のファイル名を表示
-        summary_sheet.write(idx+3, 2, file_b_base)  # 元のファイル名を表示
-        summary_sheet.write(idx+3, 3, sum(1 for s in df['Status'] if s == 'A Only'))
-        summary_sheet.write(idx+3, 4, sum(1 for s in df['Status'] if s == 'B Only'))
-        summary_sheet.write(idx+3, 5, sum(1 for s in df['Status'] if s == 'Different'))
-        summary_sheet.write(idx+3, 6, len(all_labels))
+        summary_values = [
+            sheet_name,
+            file_a_base,  # 元のファイル名を表示
+            file_b_base,  # 元のファイル名を表示
+            status_counts['A Only'],
+            status_counts['B Only'],
+            status_counts['Different'],
+            len(all_labels)
+        ]
         
         # 妥当性チェック結果をサマリーに追加
         if validate_ref_designators and filter_non_parts:
-            invalid_a_count = len(info_a.get('invalid_ref_designators', []))
-            invalid_b_count = len(info_b.get('invalid_ref_designators', []))
-            summary_sheet.write(idx+3, 7, invalid_a_count)
-            summary_sheet.write(idx+3, 8, invalid_b_count)
+            summary_values += [
+                len(info_a.get('invalid_ref_designators', [])),
+                len(info_b.get('invalid_ref_designators', []))
+            ]
+        
+        summary_sheet.write_row(idx+3, 0, summary_values)
     
     # Excelファイルを保存
-    writer.close()
+    workbook.close()
     output.seek(0)
     
     return output.getvalue()
\ No newline at end of file
@@ -1,5 +1,5 @@
-import pandas as pd
 import io
+import xlsxwriter
 from collections import Counter
 import os
 import csv
@@ -67,201 +67,200 @@ def compare_parts_list_multi(file_pairs):
     複数のラベルファイルペアの比較結果をExcelとして出力する
     
     Args:
-        file_pairs: ファイルペアのリスト[(fileA_path, fileB_path, pair_name), ...]
+        file_pairs: ファイルペアのリスト。以下のいずれかの形式
+          - [(fileA_path, fileB_path, pair_name), ...]（表示名はパスのファイル名部分）
+          - [(fileA_path, fileA_name, fileB_path, fileB_name, pair_name), ...]（表示名を別途指定）
         
     Returns:
         bytes: 生成されたExcelファイルのバイナリデータ
     """
     try:
-        # Excelファイルを作成するためのライターオブジェクト
+        # Excelファイルを作成するためのワークブック（データフレームを介さず行単位で直接書き込む）
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        workbook = xlsxwriter.Workbook(output)
+        
+        # セルの書式設定（全シート共通）
+        format_header = workbook.add_format({
+            'bold': True, 
+            'text_wrap': True, 
+            'valign': 'top', 
+            'border': 1,
+            'bg_color': '#D9E1F2'
+        })
+        
+        format_a_only = workbook.add_format({'bg_color': '#FFC7CE'})  # 淡い赤
+        format_b_only = workbook.add_format({'bg_color': '#C6EFCE'})  # 淡い緑
+        format_different = workbook.add_format({'bg_color': '#FFEB9C'})  # 淡い黄
+        
+        def get_or_add_worksheet(name):
+            # 同名のシートが既に存在する場合はそのシートに書き込む
+            return workbook.get_worksheet_by_name(name) or workbook.add_worksheet(name)
+        
+        # 各ペアを処理
+        for idx, pair in enumerate(file_pairs):
+            if len(pair) == 5:
+                file_a, file_a_display, file_b, file_b_display, pair_name = pair
+            else:
+                # 表示名の指定がない場合はパスからファイル名を取得
+                file_a, file_b, pair_name = pair
+                file_a_display = os.path.basename(file_a)
+                file_b_display = os.path.basename(file_b)
             
-            # 各ペアを処理
-            for idx, (file_a, file_b, pair_name) in enumerate(file_pairs):
-                
-                # ラベルを読み込み
-                labels_a, manufacturers_a, product_names_a = load_labels_from_file(file_a)
-                labels_b, manufacturers_b, product_names_b = load_labels_from_file(file_b)
-                                
-                # ラベルの出現回数をカウント
-                counter_a = Counter(labels_a)
-                counter_b = Counter(labels_b)
-                
-                # すべてのユニークなラベルを取得
-                all_labels = sorted(set(list(counter_a.keys()) + list(counter_b.keys())))
-                
-                # ファイルのファイル名を取得（パスから）
-                file_a_name = f"A: {os.path.basename(file_a)}"
-                file_b_name = f"B: {os.path.basename(file_b)}"
-                
-                # メーカー情報とモデル情報をラベルごとに辞書化
-                manufacturer_a_dict = {}
-                product_name_a_dict = {}
-                manufacturer_b_dict = {}
-                product_name_b_dict = {}
-                
-                # ファイルAのメーカー情報とモデル情報をラベルごとに整理
-                for i, label in enumerate(labels_a):
-                    if i < len(manufacturers_a) and label not in manufacturer_a_dict and manufacturers_a[i]:
-                        manufacturer_a_dict[label] = manufacturers_a[i]
-                    if i < len(product_names_a) and label not in product_name_a_dict and product_names_a[i]:
-                        product_name_a_dict[label] = product_names_a[i]
-                
-                # ファイルBのメーカー情報とモデル情報をラベルごとに整理
-                for i, label in enumerate(labels_b):
-                    if i < len(manufacturers_b) and label not in manufacturer_b_dict and manufacturers_b[i]:
-                        manufacturer_b_dict[label] = manufacturers_b[i]
-                    if i < len(product_names_b) and label not in product_name_b_dict and product_names_b[i]:
-                        product_name_b_dict[label] = product_names_b[i]
-                
-                # シート名を決定（最大31文字）
-                if pair_name:
-                    # カスタム名がある場合
-                    sheet_name = f"{pair_name}"[:31]
-                else:
-                    # ファイル名からシート名を生成
-                    sheet_name = f"Pair{idx+1}"[:31]
-                
-                # 安全なシート名にする (Excelのシート名に使えない文字を置換)
-                sheet_name = sheet_name.replace('/', '_').replace('\\', '_').replace('*', '_').replace('?', '_').replace('[', '_').replace(']', '_')
-                
-                # データフレームの作成
-                data = {
-                    'Label': all_labels,
-                    file_a_name: [counter_a.get(label, 0) for label in all_labels],
-                    file_b_name: [counter_b.get(label, 0) for label in all_labels]
-                }
-                
-                # データフレーム作成
-                df = pd.DataFrame(data)
-                
-                # ステータス列を追加
-                df['Status'] = df.apply(lambda row: 
-                    'A Only' if row[file_a_name] > 0 and row[file_b_name] == 0 else
-                    'B Only' if row[file_a_name] == 0 and row[file_b_name] > 0 else
-                    'Different' if row[file_a_name] != row[file_b_name] else
-                    'Same', axis=1)
-                
-                # 差分情報の列を追加（B - A）
-                df['Diff (B-A)'] = df[file_b_name] - df[file_a_name]
-                
-                # メーカー情報と製品名情報の列を追加
-                df['Manufacturer A'] = [manufacturer_a_dict.get(label, None) for label in all_labels]
-                df['Product Name A'] = [product_name_a_dict.get(label, None) for label in all_labels]
-                df['Manufacturer B'] = [manufacturer_b_dict.get(label, None) for label in all_labels]
-                df['Product Name B'] = [product_name_b_dict.get(label, None) for label in all_labels]
-                
-                # データフレームをExcelシートに出力
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-                
-                # ワークシートとワークブックのオブジェクトを取得
-                worksheet = writer.sheets[sheet_name]
-                workbook = writer.book
-                
-                # セルの書式設定
-                format_header = workbook.add_format({
-                    'bold': True, 
-                    'text_wrap': True, 
-                    'valign': 'top', 
-                    'border': 1,
-                    'bg_color': '#D9E1F2'
-                })
-                
-                format_a_only = workbook.add_format({'bg_color': '#FFC7CE'})  # 淡い赤
-                format_b_only = workbook.add_format({'bg_color': '#C6EFCE'})  # 淡い緑
-                format_different = workbook.add_format({'bg_color': '#FFEB9C'})  # 淡い黄
-                
-                # 列の幅を調整
-                worksheet.set_column('A:A', 25)  # ラベル列
-                worksheet.set_column('B:C', 15)  # ファイル列
-                worksheet.set_column('D:D', 15)  # ステータス列
-                worksheet.set_column('E:E', 10)  # 差分列
-                worksheet.set_column('F:I', 20)  # メーカー情報と製品名情報
-                
-                # ヘッダー行の書式を設定
-                for col_num, value in enumerate(df.columns.values):
-                    worksheet.write(0, col_num, value, format_header)
-                
-                # 条件付き書式の適用
-                worksheet.conditional_format(1, 0, len(df) + 1, len(df.columns) - 1, {
-                    'type': 'formula',
-                    'criteria': '=$D2="A Only"',
-                    'format': format_a_only
-                })
+            # ラベルを読み込み
+            labels_a, manufacturers_a, product_names_a = load_labels_from_file(file_a)
+            labels_b, manufacturers_b, product_names_b = load_labels_from_file(file_b)
+                            
+            # ラベルの出現回数をカウント
+            counter_a = Counter(labels_a)
+            counter_b = Counter(labels_b)
+            
+            # すべてのユニークなラベルを取得
+            all_labels = sorted(set(list(counter_a.keys()) + list(counter_b.keys())))
+            
+            # 列見出し用のファイル名
+            file_a_name = f"A: {file_a_display}"
+            file_b_name = f"B: {file_b_display}"
+            
+            # メーカー情報とモデル情報をラベルごとに辞書化
+            manufacturer_a_dict = {}
+            product_name_a_dict = {}
+            manufacturer_b_dict = {}
+            product_name_b_dict = {}
+            
+            # ファイルAのメーカー情報とモデル情報をラベルごとに整理
+            for i, label in enumerate(labels_a):
+                if i < len(manufacturers_a) and label not in manufacturer_a_dict and manufacturers_a[i]:
+                    manufacturer_a_dict[label] = manufacturers_a[i]
+                if i < len(product_names_a) and label not in product_name_a_dict and product_names_a[i]:
+                    product_name_a_dict[label] = product_names_a[i]
+            
+            # ファイルBのメーカー情報とモデル情報をラベルごとに整理
+            for i, label in enumerate(labels_b):
+                if i < len(manufacturers_b) and label not in manufacturer_b_dict and manufacturers_b[i]:
+                    manufacturer_b_dict[label] = manufacturers_b[i]
+                if i < len(product_names_b) and label not in product_name_b_dict and product_names_b[i]:
+                    product_name_b_dict[label] = product_names_b[i]
+            
+            # シート名を決定（最大31文字）
+            if pair_name:
+                # カスタム名がある場合
+                sheet_name = f"{pair_name}"[:31]
+            else:
+                # ファイル名からシート名を生成
+                sheet_name = f"Pair{idx+1}"[:31]
+            
+            # 安全なシート名にする (Excelのシート名に使えない文字を置換)
+            sheet_name = sheet_name.replace('/', '_').replace('\\', '_').replace('*', '_').replace('?', '_').replace('[', '_').replace(']', '_')
+            
+            # 列見出し（メーカー情報と製品名情報の列を含む）
+            columns = ['Label', file_a_name, file_b_name, 'Status', 'Diff (B-A)',
+                       'Manufacturer A', 'Product Name A', 'Manufacturer B', 'Product Name B']
+            
+            # ワークシートに出力
+            worksheet = get_or_add_worksheet(sheet_name)
+            
+            # 列の幅を調整
+            worksheet.set_column('A:A', 25)  # ラベル列
+            worksheet.set_column('B:C', 15)  # ファイル列
+            worksheet.set_column('D:D', 15)  # ステータス列
+            worksheet.set_column('E:E', 10)  # 差分列
+            worksheet.set_column('F:I', 20)  # メーカー情報と製品名情報
+            
+            # ヘッダー行（書式付き）とデータ行
+            worksheet.write_row(0, 0, columns, format_header)
+            status_counts = Counter()  # ステータスごとのラベル数（サマリー用）
+            for row_idx, label in enumerate(all_labels, start=1):
+                count_a = counter_a[label]
+                count_b = counter_b[label]
+                # 出現回数から直接ステータスを判定
+                status = ('A Only' if count_b == 0 else
+                          'B Only' if count_a == 0 else
+                          'Different' if count_a != count_b else
+                          'Same')
+                status_counts[status] += 1
+                worksheet.write_row(row_idx, 0, (
+                    label, count_a, count_b, status, count_b - count_a,
+                    manufacturer_a_dict.get(label), product_name_a_dict.get(label),
+                    manufacturer_b_dict.get(label), product_name_b_dict.get(label)
+                ))
+            
+            # 条件付き書式の適用
+            worksheet.conditional_format(1, 0, len(all_labels) + 1, len(columns) - 1, {
+                'type': 'formula',
+                'criteria': '=$D2="A Only"',
+                'format': format_a_only
+            })
+            
+            worksheet.conditional_format(1, 0, len(all_labels) + 1, len(columns) - 1, {
+                'type': 'formula',
+                'criteria': '=$D2="B Only"',
+                'format': format_b_only
+            })
+            
+            worksheet.conditional_format(1, 0, len(all_labels) + 1, len(columns) - 1, {
+                'type': 'formula',
+                'criteria': '=$D2="Different"',
+                'format': format_different
+            })
+            
+            # ヘッダー行を固定
+            worksheet.freeze_panes(1, 0)
+            
+            # サマリー情報を用意
+            a_only_count = status_counts['A Only']
+            b_only_count = status_counts['B Only']
+            different_count = status_counts['Different']
+            
+            # サマリーシートを追加・更新
+            if idx == 0:
+                summary_sheet = workbook.add_worksheet("Summary")
                 
-                worksheet.conditional_format(1, 0, len(df) + 1, len(df.columns) - 1, {
-                    'type': 'formula',
-                    'criteria': '=$D2="B Only"',
-                    'format': format_b_only
+                # サマリーシートのタイトル
+                title_format = workbook.add_format({
+                    'bold': True,
+                    'font_size': 14,
+                    'align': 'center',
+                    'valign': 'vcenter'
                 })
+                summary_sheet.merge_range('A1:I1', '回路記号リスト差分比較サマリー', title_format)
                 
-                worksheet.conditional_format(1, 0, len(df) + 1, len(df.columns) - 1, {
-                    'type': 'formula',
-                    'criteria': '=$D2="Different"',
-                    'format': format_different
+                # 各ペアの情報を追加 - ヘッダー行
+                summary_row = 2
+                pair_header_format = workbook.add_format({
+                    'bold': True,
+                    'bg_color': '#4472C4',
+                    'font_color': 'white'
                 })
+                summary_sheet.write(summary_row, 0, "ペア番号", pair_header_format)
+                summary_sheet.write(summary_row, 1, "シート名", pair_header_format)
+                summary_sheet.write(summary_row, 2, "ファイルA", pair_header_format)
+                summary_sheet.write(summary_row, 3, "ファイルB", pair_header_format)
+                summary_sheet.write(summary_row, 4, "Aのみ", pair_header_format)
+                summary_sheet.write(summary_row, 5, "Bのみ", pair_header_format)
+                summary_sheet.write(summary_row, 6, "異なる個数", pair_header_format)
+                summary_sheet.write(summary_row, 7, "共通", pair_header_format)
+                summary_sheet.write(summary_row, 8, "ラベル総数", pair_header_format)
                 
-                # ヘッダー行を固定
-                worksheet.freeze_panes(1, 0)
-                
-                # サマリー情報を用意
-                a_only_count = sum(1 for s in df['Status'] if s == 'A Only')
-                b_only_count = sum(1 for s in df['Status'] if s == 'B Only')
-                different_count = sum(1 for s in df['Status'] if s == 'Different')
-                
-                # サマリーシートを追加・更新
-                if idx == 0:
-                    summary_sheet = workbook.add_worksheet("Summary")
-                    
-                    # サマリーシートのタイトル
-                    title_format = workbook.add_format({
-                        'bold': True,
-                        'font_size': 14,
-                        'align': 'center',
-                        'valign': 'vcenter'
-                    })
-                    summary_sheet.merge_range('A1:I1', '回路記号リスト差分比較サマリー', title_format)
-                    
-                    # 各ペアの情報を追加 - ヘッダー行
-                    summary_row = 2
-                    pair_header_format = workbook.add_format({
-                        'bold': True,
-                        'bg_color': '#4472C4',
-                        'font_color': 'white'
-                    })
-                    summary_sheet.write(summary_row, 0, "ペア番号", pair_header_format)
-                    summary_sheet.write(summary_row, 1, "シート名", pair_header_format)
-                    summary_sheet.write(summary_row, 2, "ファイルA", pair_header_format)
-                    summary_sheet.write(summary_row, 3, "ファイルB", pair_header_format)
-                    summary_sheet.write(summary_row, 4, "Aのみ", pair_header_format)
-                    summary_sheet.write(summary_row, 5, "Bのみ", pair_header_format)
-                    summary_sheet.write(summary_row, 6, "異なる個数", pair_header_format)
-                    summary_sheet.write(summary_row, 7, "共通", pair_header_format)
-                    summary_sheet.write(summary_row, 8, "ラベル総数", pair_header_format)
-                    
-                    summary_sheet.set_column('A:A', 10)
-                    summary_sheet.set_column('B:B', 15)
-                    summary_sheet.set_column('C:D', 30)
-                    summary_sheet.set_column('E:I', 15)
-                
-                # サマリーシートにこのペアの情報を追加
-                summary_sheet = writer.sheets["Summary"]
-                same_count = sum(1 for s in df['Status'] if s == 'Same')
-                
-                # ファイル名からパスを除去して表示用の名前を取得
-                file_a_display = os.path.basename(file_a)
-                file_b_display = os.path.basename(file_b)
-                
-                summary_sheet.write(idx+3, 0, f"ペア{idx+1}")
-                summary_sheet.write(idx+3, 1, sheet_name)
-                summary_sheet.write(idx+3, 2, file_a_display)  # 元のファイル名を表示
-                summary_sheet.write(idx+3, 3, file_b_display)  # 元のファイル名を表示
-                summary_sheet.write(idx+3, 4, a_only_count)
-                summary_sheet.write(idx+3, 5, b_only_count)
-                summary_sheet.write(idx+3, 6, different_count)
-                summary_sheet.write(idx+3, 7, same_count)
-                summary_sheet.write(idx+3, 8, len(all_labels))
+                summary_sheet.set_column('A:A', 10)
+                summary_sheet.set_column('B:B', 15)
+                summary_sheet.set_column('C:D', 30)
+                summary_sheet.set_column('E:I', 15)
+            
+            # サマリーシートにこのペアの情報を追加
+            summary_sheet = workbook.get_worksheet_by_name("Summary")
+            same_count = status_counts['Same']
+            
+            summary_sheet.write(idx+3, 0, f"ペア{idx+1}")
+            summary_sheet.write(idx+3, 1, sheet_name)
+            summary_sheet.write(idx+3, 2, file_a_display)  # 元のファイル名を表示
+            summary_sheet.write(idx+3, 3, file_b_display)  # 元のファイル名を表示
+            summary_sheet.write(idx+3, 4, a_only_count)
+            summary_sheet.write(idx+3, 5, b_only_count)
+            summary_sheet.write(idx+3, 6, different_count)
+            summary_sheet.write(idx+3, 7, same_count)
+            summary_sheet.write(idx+3, 8, len(all_labels))
+    
+        workbook.close()
         
         # Excelファイルのバイナリデータを返す
         output.seek(0)
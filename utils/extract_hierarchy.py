@@ -1,11 +1,77 @@
-import ezdxf
-from io import StringIO
+import os
+import sys
+from functools import lru_cache
+from operator import itemgetter
 
-# バージョンに応じた TagWriter のインポート
+# 共通ユーティリティをインポート
 try:
-    from ezdxf.lldxf.writer import TagWriter  # ezdxf >= 0.19
+    from common_utils import load_dxf_document
 except ImportError:
-    from ezdxf.lldxf.tagwriter import TagWriter  # ezdxf < 0.19
+    # common_utils.pyが見つからない場合のフォールバック
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from common_utils import load_dxf_document
+
+@lru_cache(maxsize=None)
+def _get_tag_value_collector_class():
+    """
+    TagValueCollectorクラスを初回使用時に作成する
+    
+    ezdxfのタグライター基底クラスを継承するため、モジュールのインポート時に
+    ezdxfを読み込まないよう、クラス定義を関数内で遅延させる。
+    
+    Returns:
+        type: TagValueCollectorクラス
+    """
+    from ezdxf.lldxf.tagwriter import AbstractTagWriter
+    from ezdxf.lldxf.types import DXFVertex, DXFBinaryTag
+    
+    class TagValueCollector(AbstractTagWriter):
+        """
+        エンティティのDXF出力を、テキストへの書き出し・再解析を経由せずに
+        (グループコード, 値の文字列)のリストとして収集するタグライター
+        
+        値の文字列はTagWriterがDXFテキストに書き出す表記と同じになる。
+        """
+        
+        def __init__(self):
+            self.tags = []
+        
+        def write_tag(self, tag):
+            if isinstance(tag, DXFVertex):
+                self.tags.extend((code, str(value)) for code, value in tag.dxftags())
+            elif isinstance(tag, DXFBinaryTag):
+                self.tags.append((tag.code, tag.tostring()))
+            else:
+                self.tags.append((tag.code, str(tag.value)))
+        
+        def write_tag2(self, code, value):
+            self.tags.append((code, str(value)))
+        
+        def write_str(self, s):
+            # 書き出し済みのDXFテキスト（グループコードと値の行の組）をそのまま解析する
+            # 同じイテレータを2つ渡して行を2行ずつ組にする（スライスによる中間リストを作らない）
+            lines = iter(s.split("\n"))
+            self.tags.extend(
+                (int(code), value)
+                for code, value in zip(lines, lines)
+                if code.strip().isdigit()
+            )
+    
+    return TagValueCollector
+
+# DXFのグループコードとその意味
+GROUP_CODE_MEANINGS = {
+    0: "Entity Type", 1: "Primary Text String", 2: "Name", 3: "Additional Text",
+    5: "Handle", 6: "Linetype", 7: "Text Style Name", 8: "Layer Name", 9: "Variable Name",
+    10: "X Coordinate (Main)", 20: "Y Coordinate (Main)", 30: "Z Coordinate (Main)",
+    40: "Double Precision Value", 50: "Angle", 62: "Color Number", 70: "Integer Value",
+    210: "X Direction Vector", 220: "Y Direction Vector", 230: "Z Direction Vector", 999: "Comment"
+}
+
+# グループコードをインデックスとする意味の参照表（タグごとの辞書検索を避ける）
+_GROUP_CODE_MEANING_TABLE = tuple(
+    GROUP_CODE_MEANINGS.get(code, "Other") for code in range(max(GROUP_CODE_MEANINGS) + 1)
+)
 
 def get_group_code_meaning(code):
     """
@@ -17,100 +83,114 @@ def get_group_code_meaning(code):
     Returns:
         str: グループコードの意味
     """
-    code_meanings = {
-        0: "Entity Type", 1: "Primary Text String", 2: "Name", 3: "Additional Text",
-        5: "Handle", 6: "Linetype", 7: "Text Style Name", 8: "Layer Name", 9: "Variable Name",
-        10: "X Coordinate (Main)", 20: "Y Coordinate (Main)", 30: "Z Coordinate (Main)",
-        40: "Double Precision Value", 50: "Angle", 62: "Color Number", 70: "Integer Value",
-        210: "X Direction Vector", 220: "Y Direction Vector", 230: "Z Direction Vector", 999: "Comment"
-    }
-    return code_meanings.get(code, "Other")
+    if 0 <= code < len(_GROUP_CODE_MEANING_TABLE):
+        return _GROUP_CODE_MEANING_TABLE[code]
+    return "Other"
 
-def get_sorted_entity_tags(entity):
+def iter_sorted_entity_tags(entity):
     """
-    エンティティのタグをソートして取得する
+    エンティティのタグをソートし、整形した行を順に返す
     
     Args:
         entity: DXFエンティティ
         
     Returns:
-        list: 整形されたタグリスト
+        generator: 整形されたタグ行
     """
-    buffer = StringIO()
-    tagwriter = TagWriter(buffer)
-    entity.export_dxf(tagwriter)
-    buffer.seek(0)
-    lines = buffer.readlines()
-
-    tags = []
-    for i in range(0, len(lines)-1, 2):
-        code = lines[i].strip()
-        value = lines[i+1].strip()
-        if code.isdigit():
-            code_int = int(code)
-            meaning = get_group_code_meaning(code_int)
-            tags.append((code_int, meaning, value))
+    collector = _get_tag_value_collector_class()()
+    entity.export_dxf(collector)
 
-    tags.sort(key=lambda x: x[0])
+    # 収集した(グループコード, 値)をグループコード順に並べ替え（同一コード内は出現順を保持）、
+    # 中間のタプルを作らずに直接整形する
+    tags = collector.tags
+    tags.sort(key=itemgetter(0))
 
-    return [f"- {code} ({meaning}): {value}" for code, meaning, value in tags]
+    meaning_table = _GROUP_CODE_MEANING_TABLE
+    table_size = len(meaning_table)
+    for code, value in tags:
+        if code >= 0:
+            yield f"- {code} ({meaning_table[code] if code < table_size else 'Other'}): {value.strip()}"
 
-def extract_hierarchy(dxf_file):
+def get_sorted_entity_tags(entity):
     """
-    DXFファイルの階層構造を抽出する
+    エンティティのタグをソートして取得する
     
     Args:
-        dxf_file: DXFファイルパス
+        entity: DXFエンティティ
         
     Returns:
-        list: 階層構造の行リスト
+        list: 整形されたタグリスト
     """
-    doc = ezdxf.readfile(dxf_file)
-    hierarchy = []
+    return list(iter_sorted_entity_tags(entity))
 
+def iter_hierarchy_lines(doc):
+    """
+    DXFドキュメントの階層構造を1行ずつ返す
+    
+    セクションごとに中間リストを作らず、各行をそのまま呼び出し側へ渡す。
+    
+    Args:
+        doc: ezdxfのDrawingオブジェクト
+        
+    Returns:
+        generator: 階層構造の行
+    """
     # HEADER
-    hierarchy.append("## SECTION: HEADER")
-    for varname in doc.header.varnames():
-        value = doc.header.get(varname)
-        hierarchy.append(f"- {varname}: {value}")
+    yield "## SECTION: HEADER"
+    header = doc.header
+    for varname in header.varnames():
+        yield f"- {varname}: {header.get(varname)}"
 
     # TABLES
-    hierarchy.append("## SECTION: TABLES")
-    for table_name, table in {
-        'LAYERS': doc.layers,
-        'LTYPE': doc.linetypes,
-        'STYLES': doc.styles,
-        'DIMSTYLES': doc.dimstyles,
-        'UCS': doc.ucs
-    }.items():
-        hierarchy.append(f"### TABLE: {table_name}")
+    yield "## SECTION: TABLES"
+    for table_name, table in (
+        ('LAYERS', doc.layers),
+        ('LTYPE', doc.linetypes),
+        ('STYLES', doc.styles),
+        ('DIMSTYLES', doc.dimstyles),
+        ('UCS', doc.ucs),
+    ):
+        yield f"### TABLE: {table_name}"
         for entry in table:
-            hierarchy.append(f"#### ENTRY: {entry.dxf.name}")
-            for key, value in entry.dxf.all_existing_dxf_attribs().items():
-                hierarchy.append(f"- {key}: {value}")
+            yield f"#### ENTRY: {entry.dxf.name}"
+            # all_existing_dxf_attribs()は属性辞書のコピーを作るため、名前空間の辞書を直接走査する
+            # （エンティティへの逆参照 _entity などの内部属性は除外）
+            for key, value in vars(entry.dxf).items():
+                if not key.startswith('_'):
+                    yield f"- {key}: {value}"
 
     # BLOCKS
-    hierarchy.append("## SECTION: BLOCKS")
+    yield "## SECTION: BLOCKS"
     for block in doc.blocks:
-        hierarchy.append(f"### BLOCK: {block.name}")
+        yield f"### BLOCK: {block.name}"
         for entity in block:
-            hierarchy.append(f"#### ENTITY: {entity.dxftype()}")
-            hierarchy.extend(get_sorted_entity_tags(entity))
+            yield f"#### ENTITY: {entity.dxftype()}"
+            yield from iter_sorted_entity_tags(entity)
 
     # ENTITIES
-    hierarchy.append("## SECTION: ENTITIES")
-    msp = doc.modelspace()
-    for entity in msp:
-        hierarchy.append(f"### ENTITY: {entity.dxftype()}")
-        hierarchy.extend(get_sorted_entity_tags(entity))
+    yield "## SECTION: ENTITIES"
+    for entity in doc.modelspace():
+        yield f"### ENTITY: {entity.dxftype()}"
+        yield from iter_sorted_entity_tags(entity)
 
     # OBJECTS
-    hierarchy.append("## SECTION: OBJECTS")
+    yield "## SECTION: OBJECTS"
     for obj in doc.objects:
-        hierarchy.append(f"### OBJECT: {obj.dxftype()}")
-        hierarchy.extend(get_sorted_entity_tags(obj))
+        yield f"### OBJECT: {obj.dxftype()}"
+        yield from iter_sorted_entity_tags(obj)
 
     # CLASSES
-    hierarchy.append("## SECTION: CLASSES (if present)")
+    yield "## SECTION: CLASSES (if present)"
 
-    return hierarchy
\ No newline at end of file
+def extract_hierarchy(dxf_file):
+    """
+    DXFファイルの階層構造を抽出する
+    
+    Args:
+        dxf_file: DXFファイルパス
+        
+    Returns:
+        list: 階層構造の行リスト
+    """
+    doc = load_dxf_document(dxf_file)
+    return list(iter_hierarchy_lines(doc))
@@ -1,4 +1,3 @@
-import ezdxf
 import re
 import os
 import sys
@@ -6,11 +5,30 @@ from typing import List, Tuple, Dict, Optional
 
 # 共通ユーティリティをインポート
 try:
-    from common_utils import process_circuit_symbol_labels
+    from common_utils import process_circuit_symbol_labels, load_dxf_document
 except ImportError:
     # common_utils.pyが見つからない場合のフォールバック
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from common_utils import process_circuit_symbol_labels
+    from common_utils import process_circuit_symbol_labels, load_dxf_document
+
+# MTEXTフォーマットコード除去用の正規表現（適用順に並べる）
+_MTEXT_FORMAT_CODE_PATTERNS = [
+    re.compile(r'\\f[^;]*;'),  # フォント制御コード \f...;
+    re.compile(r'\\H[^;]*;'),  # 高さ制御コード \H...;
+    re.compile(r'\\W[^;]*;'),  # 幅制御コード \W...;
+    re.compile(r'\\C[^;]*;'),  # カラー制御コード \C...;
+    re.compile(r'\\A[^;]*;'),  # 配置制御コード \A...;
+    re.compile(r'\\T[^;]*;'),  # 追跡制御コード \T...;
+    # その他の制御コード（文字;形式）。ただし、\Pは保持する（テキスト構造として重要）
+    re.compile(r'\\(?!P)[^\\;]*;'),
+]
+_MULTIPLE_SPACES_PATTERN = re.compile(r' +')
+
+# 図面番号のパターン
+# 例: DE5313-008-02B（英大文字x2+数字x4+"-"+数字x3+"-"+数字x2+英大文字）
+_DRAWING_NUMBER_PATTERNS = [
+    re.compile(r'[A-Z]{2}\d{4}-\d{3}-\d{2}[A-Z]', re.IGNORECASE),  # DE5313-008-02B 型（正確なフォーマット）
+]
 
 
 def get_layers_from_dxf(dxf_file):
@@ -18,13 +36,13 @@ def get_layers_from_dxf(dxf_file):
     DXFファイルからレイヤー一覧を取得する
     
     Args:
-        dxf_file: DXFファイルパス
+        dxf_file: DXFファイルパス、バイトデータまたは読み込み済みのDrawing
         
     Returns:
         list: レイヤー名のリスト
     """
     try:
-        doc = ezdxf.readfile(dxf_file)
+        doc = load_dxf_document(dxf_file)
         # レイヤーテーブルからすべてのレイヤー名を取得
         layer_names = [layer.dxf.name for layer in doc.layers]
         return sorted(layer_names)  # アルファベット順にソート
@@ -55,29 +73,10 @@ def clean_mtext_format_codes(text: str, debug=False) -> str:
     normalized_text = text.replace('¥', '\\')
     
     # フォーマット制御コードのみを除去し、テキスト構造（\Pなど）は保持
+    # （コンパイル済みのパターンを順に適用する）
     cleaned = normalized_text
-    
-    # フォント制御コード \f...;を除去
-    cleaned = re.sub(r'\\f[^;]*;', '', cleaned)
-    
-    # 高さ制御コード \H...;を除去  
-    cleaned = re.sub(r'\\H[^;]*;', '', cleaned)
-    
-    # 幅制御コード \W...;を除去
-    cleaned = re.sub(r'\\W[^;]*;', '', cleaned)
-    
-    # カラー制御コード \C...;を除去
-    cleaned = re.sub(r'\\C[^;]*;', '', cleaned)
-    
-    # 配置制御コード \A...;を除去
-    cleaned = re.sub(r'\\A[^;]*;', '', cleaned)
-    
-    # 追跡制御コード \T...;を除去
-    cleaned = re.sub(r'\\T[^;]*;', '', cleaned)
-    
-    # その他の制御コード（文字;形式）を除去
-    # ただし、\Pは保持する（テキスト構造として重要）
-    cleaned = re.sub(r'\\(?!P)[^\\;]*;', '', cleaned)
+    for pattern in _MTEXT_FORMAT_CODE_PATTERNS:
+        cleaned = pattern.sub('', cleaned)
     
     # スペース制御 \~ を通常のスペースに変換
     cleaned = cleaned.replace('\\~', ' ')
@@ -88,7 +87,7 @@ def clean_mtext_format_codes(text: str, debug=False) -> str:
     cleaned = cleaned.replace('\\}', '}')
     
     # 複数の空白を単一の空白に変換
-    cleaned = re.sub(r' +', ' ', cleaned)
+    cleaned = _MULTIPLE_SPACES_PATTERN.sub(' ', cleaned)
     
     result = cleaned.strip()
     
@@ -110,42 +109,49 @@ def extract_text_from_entity(entity, debug=False) -> Tuple[str, str, Tuple[float
         tuple: (生テキスト, クリーンテキスト, (X座標, Y座標))
     """
     try:
+        # エンティティタイプとDXF属性の名前空間は一度だけ取得する
+        entity_type = entity.dxftype()
+        dxf = entity.dxf
+        
         # 座標を取得 - MTEXTとTEXTで異なる属性を使用
         x, y = 0.0, 0.0
         
-        if entity.dxftype() == 'MTEXT':
+        if entity_type == 'MTEXT':
             # MTEXTの場合、グループコード10,20を確認
-            if hasattr(entity.dxf, 'insert'):
-                x, y = entity.dxf.insert[0], entity.dxf.insert[1]
-            elif hasattr(entity, 'dxf') and hasattr(entity.dxf, 'x') and hasattr(entity.dxf, 'y'):
-                x, y = entity.dxf.x, entity.dxf.y
+            if hasattr(dxf, 'insert'):
+                insert = dxf.insert
+                x, y = insert[0], insert[1]
+            elif hasattr(dxf, 'x') and hasattr(dxf, 'y'):
+                x, y = dxf.x, dxf.y
             else:
                 # 直接属性を確認
                 try:
-                    x = getattr(entity.dxf, 'x', 0.0)
-                    y = getattr(entity.dxf, 'y', 0.0)
+                    x = getattr(dxf, 'x', 0.0)
+                    y = getattr(dxf, 'y', 0.0)
                 except:
                     x, y = 0.0, 0.0
-        elif entity.dxftype() == 'TEXT':
+        elif entity_type == 'TEXT':
             # TEXTの場合
-            if hasattr(entity.dxf, 'insert'):
-                x, y = entity.dxf.insert[0], entity.dxf.insert[1]
-            elif hasattr(entity.dxf, 'location'):
-                x, y = entity.dxf.location[0], entity.dxf.location[1]
+            if hasattr(dxf, 'insert'):
+                insert = dxf.insert
+                x, y = insert[0], insert[1]
+            elif hasattr(dxf, 'location'):
+                location = dxf.location
+                x, y = location[0], location[1]
         
         # 生テキストを取得
         raw_text = ""
         
-        if entity.dxftype() == 'TEXT':
+        if entity_type == 'TEXT':
             # TEXTエンティティの場合
-            if hasattr(entity.dxf, 'text'):
-                raw_text = entity.dxf.text
-        elif entity.dxftype() == 'MTEXT':
+            if hasattr(dxf, 'text'):
+                raw_text = dxf.text
+        elif entity_type == 'MTEXT':
             # MTEXTエンティティの場合、複数の方法でテキストを取得
             
             # 方法1: entity.dxf.text
-            if hasattr(entity.dxf, 'text'):
-                raw_text = entity.dxf.text
+            if hasattr(dxf, 'text'):
+                raw_text = dxf.text
             
             # 方法2: entity.text (ezdxfのプロパティ)
             if not raw_text and hasattr(entity, 'text'):
@@ -163,7 +169,7 @@ def extract_text_from_entity(entity, debug=False) -> Tuple[str, str, Tuple[float
         
         # フォーマットコードをクリーンアップ（エンティティタイプに応じて）
         if raw_text:
-            if entity.dxftype() == 'MTEXT':
+            if entity_type == 'MTEXT':
                 # MTEXT の場合はフォーマットコードを除去
                 clean_text = clean_mtext_format_codes(raw_text, debug)
             else:
@@ -190,17 +196,12 @@ def extract_drawing_numbers(text: str, debug=False) -> List[str]:
     Returns:
         list: 図面番号のリスト
     """
-    # 図面番号の正確なパターンを定義
-    # 例: DE5313-008-02B（英大文字x2+数字x4+"-"+数字x3+"-"+数字x2+英大文字）
-    patterns = [
-        r'[A-Z]{2}\d{4}-\d{3}-\d{2}[A-Z]',  # DE5313-008-02B 型（正確なフォーマット）
-    ]
-    
+    # 図面番号の正確なパターン（_DRAWING_NUMBER_PATTERNS）で検索
     drawing_numbers = []
     
     
-    for i, pattern in enumerate(patterns):
-        matches = re.findall(pattern, text, re.IGNORECASE)
+    for pattern in _DRAWING_NUMBER_PATTERNS:
+        matches = pattern.findall(text)
         
         for match in matches:
             # 重複を避けて追加
@@ -251,11 +252,11 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
     DXFファイルからテキストラベルを抽出する
     
     Args:
-        dxf_file: DXFファイルパス
+        dxf_file: DXFファイルパス、バイトデータまたは読み込み済みのDrawing
         filter_non_parts: 回路記号以外のラベルをフィルタリングするかどうか
         sort_order: ソート順 ("asc"=昇順, "desc"=降順, "none"=ソートなし)
         debug: デバッグ情報を表示するかどうか
-        selected_layers: 処理対象とするレイヤー名のリスト。Noneの場合は全レイヤーを対象とする
+        selected_layers: 処理対象とするレイヤー名のリストまたは集合。Noneの場合は全レイヤーを対象とする
         validate_ref_designators: 回路記号の妥当性をチェックするかどうか
         extract_drawing_numbers_option: 図面番号を抽出するかどうか
         
@@ -269,7 +270,6 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
         "final_count": 0,
         "processed_layers": 0,
         "total_layers": 0,
-        "filename": os.path.basename(dxf_file),
         "invalid_ref_designators": [],  # 妥当性チェック用
         "main_drawing_number": None,     # 図番
         "source_drawing_number": None,   # 流用元図番
@@ -278,7 +278,7 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
     
     try:
         # DXFファイルを読み込む
-        doc = ezdxf.readfile(dxf_file)
+        doc = load_dxf_document(dxf_file)
         msp = doc.modelspace()
         
         # 全レイヤー数を記録
@@ -290,6 +290,9 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
             # 選択されたレイヤーが指定されていない場合は全レイヤーを対象とする
             selected_layers = all_layers
         
+        # エンティティごとのレイヤー判定をO(1)で行うため集合に変換
+        selected_layers = frozenset(selected_layers)
+        
         # 処理対象のレイヤー数を記録
         info["processed_layers"] = len(selected_layers)
         
@@ -302,10 +305,9 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
         all_entities_to_process = []
         
         # 1. MODEL_SPACEからエンティティを収集
+        # （エンティティタイプの絞り込みはezdxfのクエリで行う）
         msp = doc.modelspace()
-        for e in msp:
-            if e.dxftype() in ['TEXT', 'MTEXT']:
-                all_entities_to_process.append(e)
+        all_entities_to_process.extend(msp.query('TEXT MTEXT'))
         
         # 2. BLOCKSから直接は収集しない - INSERT経由でのみ処理する
         
@@ -313,9 +315,7 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
         try:
             for layout in doc.layouts:
                 if layout.name != 'Model':  # Model space以外のレイアウト
-                    for e in layout:
-                        if e.dxftype() in ['TEXT', 'MTEXT']:
-                            all_entities_to_process.append(e)
+                    all_entities_to_process.extend(layout.query('TEXT MTEXT'))
         except Exception as e:
             pass
         
@@ -324,36 +324,29 @@ def extract_labels(dxf_file, filter_non_parts=False, sort_order="asc", debug=Fal
             # ブロック定義内のテキストエンティティをキャッシュ
             block_text_cache = {}
             for block in doc.blocks:
-                block_texts = []
-                for entity in block:
-                    if entity.dxftype() in ['TEXT', 'MTEXT']:
-                        block_texts.append(entity)
+                block_texts = list(block.query('TEXT MTEXT'))
                 if block_texts:
                     block_text_cache[block.name] = block_texts
             
             # INSERT エンティティを処理
-            for e in msp:
-                if e.dxftype() == 'INSERT':
-                    # INSERT エンティティのブロック名を取得
-                    block_name = e.dxf.name
-                    
-                    # そのブロック内のテキストエンティティを取得
-                    if block_name in block_text_cache:
-                        for text_entity in block_text_cache[block_name]:
-                            # INSERT エンティティのレイヤーをチェック
-                            if e.dxf.layer in selected_layers:
-                                all_entities_to_process.append(text_entity)
-                    
+            for e in msp.query('INSERT'):
+                # INSERT エンティティのブロック名を取得
+                insert_dxf = e.dxf
+                block_name = insert_dxf.name
+                
+                # そのブロック内のテキストエンティティを取得
+                # （INSERT エンティティのレイヤーはブロック内のエンティティごとではなく一度だけチェック）
+                if block_name in block_text_cache and insert_dxf.layer in selected_layers:
+                    all_entities_to_process.extend(block_text_cache[block_name])
+                
             # ペーパースペースの INSERT エンティティも処理
             for layout in doc.layouts:
                 if layout.name != 'Model':
-                    for e in layout:
-                        if e.dxftype() == 'INSERT':
-                            block_name = e.dxf.name
-                            if block_name in block_text_cache:
-                                for text_entity in block_text_cache[block_name]:
-                                    if e.dxf.layer in selected_layers:
-                                        all_entities_to_process.append(text_entity)
+                    for e in layout.query('INSERT'):
+                        insert_dxf = e.dxf
+                        block_name = insert_dxf.name
+                        if block_name in block_text_cache and insert_dxf.layer in selected_layers:
+                            all_entities_to_process.extend(block_text_cache[block_name])
                         
         except Exception as e:
             pass  # INSERT処理エラーは無視して続行
@@ -439,7 +432,7 @@ def process_multiple_dxf_files(dxf_files, filter_non_parts=False, sort_order="as
         filter_non_parts: 回路記号以外のラベルをフィルタリングするかどうか
         sort_order: ソート順 ("asc"=昇順, "desc"=降順, "none"=ソートなし)
         debug: デバッグ情報を表示するかどうか
-        selected_layers: 処理対象とするレイヤー名のリスト。Noneの場合は全レイヤーを対象とする
+        selected_layers: 処理対象とするレイヤー名のリストまたは集合。Noneの場合は全レイヤーを対象とする
         validate_ref_designators: 回路記号の妥当性をチェックするかどうか
         extract_drawing_numbers_option: 図面番号を抽出するかどうか
         
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import os
 import re
 import traceback
@@ -19,6 +20,21 @@ def extract_alphabetic_part(symbol):
         return match.group(1)
     return ""
 
+def build_lower_column_map(columns):
+    """
+    小文字化した列名から元の列名を引く辞書を作成する
+    
+    Args:
+        columns: 列名のリスト
+        
+    Returns:
+        dict: 小文字化した列名 -> 元の列名（同じ名前になる列は先頭の列を優先）
+    """
+    column_map = {}
+    for col in columns:
+        column_map.setdefault(col.lower(), col)
+    return column_map
+
 def extract_assembly_number_from_filename(filename):
     """
     ファイル名からアセンブリ番号を抽出する
@@ -53,6 +69,36 @@ def extract_assembly_number_from_filename(filename):
         print(f"ファイル名からのアセンブリ番号抽出でエラー: {str(e)}")
         return os.path.splitext(os.path.basename(filename))[0]
 
+# 機器符号抽出で参照するULKES Excelの列（照合は前後の空白・大文字小文字を無視して行う）
+SYMBOL_SOURCE_COLUMNS = ("符号", "構成コメント", "構成数", "図面番号", "メーカ名", "メーカ型式")
+_SYMBOL_SOURCE_COLUMNS_LOWER = frozenset(col.lower() for col in SYMBOL_SOURCE_COLUMNS)
+
+def is_symbol_source_column(column):
+    """
+    列が機器符号抽出で参照する列かどうかを判定する（read_excelのusecolsに指定して不要な列を読み込まない）
+    
+    Args:
+        column: 列名
+        
+    Returns:
+        bool: 参照する列の場合True
+    """
+    return str(column).strip().lower() in _SYMBOL_SOURCE_COLUMNS_LOWER
+
+def get_figure_number_status(figure_series):
+    """
+    図面番号列の各行について、値の有無と前後の空白を除いた文字列をまとめて求める
+    
+    Args:
+        figure_series (pandas.Series): 図面番号列
+        
+    Returns:
+        tuple: (値があるかどうかのbool Series, 前後の空白を除いた図面番号のSeries（値がない行は空文字列）)
+    """
+    present = figure_series.notna()
+    stripped = figure_series.astype(str).str.strip().where(present, "")
+    return present, stripped
+
 def find_all_possible_assembly_numbers(df):
     """
     Excelファイル内の全ての可能なアセンブリ番号（図面番号）を抽出する
@@ -70,47 +116,65 @@ def find_all_possible_assembly_numbers(df):
         # 図面番号列が存在するか確認
         if "図面番号" not in df.columns:
             # 大文字小文字の違いを無視して検索
-            for col in df.columns:
-                if col.lower() == "図面番号".lower():
-                    df = df.rename(columns={col: "図面番号"})
-                    break
+            original_col = build_lower_column_map(df.columns).get("図面番号".lower())
             
             # それでも見つからない場合
-            if "図面番号" not in df.columns:
+            if original_col is None:
                 return []
+            df = df.rename(columns={original_col: "図面番号"})
                 
-        for i in range(len(df) - 1):  # 最後の行は次の行がないので対象外
-            current_row = df.iloc[i]
-            next_row = df.iloc[i + 1]
-            
-            # 現在の行に図面番号があり、次の行の図面番号が空白の場合
-            if (pd.notna(current_row["図面番号"]) and 
-                (pd.isna(next_row["図面番号"]) or str(next_row["図面番号"]).strip() == "")):
-                # 有効な図面番号のみを追加（空白や特殊文字のみではないもの）
-                assembly_no = str(current_row["図面番号"]).strip()
-                if assembly_no and assembly_no not in possible_assemblies:
-                    possible_assemblies.append(assembly_no)
+        present, stripped = get_figure_number_status(df["図面番号"])
+        
+        # 現在の行に図面番号があり、次の行の図面番号が空白の行を列単位で判定
+        # （最後の行は次の行がないので対象外）
+        next_is_blank = (stripped == "").shift(-1, fill_value=False)
+        candidates = stripped[present & next_is_blank]
+        
+        # 有効な図面番号のみを出現順に重複なく追加（空白のみではないもの）
+        possible_assemblies = candidates[candidates != ""].unique().tolist()
     except Exception as e:
         print(f"図面番号抽出中にエラー: {str(e)}")
     
     return possible_assemblies
 
+def rewind_excel_source(excel_source):
+    """
+    ファイルオブジェクトの読み込み位置を先頭に戻す（読み込みエンジンを切り替えて再試行する場合に使用）
+    
+    Args:
+        excel_source: Excelファイルのパスまたはファイルオブジェクト
+    """
+    if hasattr(excel_source, "seek"):
+        excel_source.seek(0)
+
 def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblies=False, include_maker_info=False):
     """
     Excelファイルから回路記号リストを抽出する。
     
     Args:
-        input_excel (str): 入力Excelファイルのパス
-        assembly_number (str, optional): 図面番号（指定しない場合はファイル名から抽出）
+        input_excel (str, file-like or pandas.DataFrame): 入力Excelファイルのパス、ファイルオブジェクト
+            （BytesIOやアップロードされたファイル）、または読み込み済みのデータフレーム
+            （データフレームを渡すと、複数の図面番号を処理する際にExcelの解析を1回で済ませられる）
+        assembly_number (str, optional): 図面番号（指定しない場合はファイル名から抽出。データフレーム指定時は
+            ファイル名がないため、見つかった全ての図面番号を使用）
         use_all_assemblies (bool): 全ての可能なアセンブリ番号を使用するかどうか
         include_maker_info (bool): メーカー名とメーカー型式を出力に含めるかどうか
         
     Returns:
         tuple: (回路記号リスト, 処理情報)
     """
+    # 入力ファイル名（データフレームや名前のないファイルオブジェクトが渡された場合はファイル名なし）
+    # （データフレームのnameは属性ではなく列を指す場合があるため参照しない）
+    if isinstance(input_excel, (str, os.PathLike)):
+        filename = os.path.basename(input_excel)
+    elif isinstance(input_excel, pd.DataFrame):
+        filename = ""
+    else:
+        filename = os.path.basename(getattr(input_excel, "name", None) or "")
+    
     # 情報を格納する辞書を先に初期化
     info = {
-        "assembly_number": assembly_number if assembly_number else os.path.splitext(os.path.basename(input_excel))[0],
+        "assembly_number": assembly_number if assembly_number else os.path.splitext(filename)[0],
         "total_rows": 0,
         "processed_rows": 0,
         "total_symbols": 0,
@@ -121,33 +185,26 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
     try:
         # アセンブリ番号がない場合は入力ファイル名から抽出
         if not assembly_number:
-            filename = os.path.basename(input_excel)
             suggested_assembly_number = extract_assembly_number_from_filename(filename)
             info["assembly_number"] = suggested_assembly_number
         else:
             suggested_assembly_number = assembly_number
         
-        try:
-            # Excelファイルを読み込む（1行目をヘッダーとして）
+        if isinstance(input_excel, pd.DataFrame):
+            # 読み込み済みのデータフレームを使用
+            df = input_excel
+        else:
             try:
-                df = pd.read_excel(input_excel, engine='openpyxl')
-            except ImportError:
-                # openpyxlがインストールされていない場合は代替エンジンを試す
-                df = pd.read_excel(input_excel)
-            except Exception as e:
-                # もし openpyxl で失敗したら他のエンジンを試す
+                # Excelファイルを読み込む（1行目をヘッダーとして）
                 try:
-                    df = pd.read_excel(input_excel, engine='xlrd')
+                    df = pd.read_excel(input_excel, engine='openpyxl')
                 except Exception:
-                    try:
-                        # 最後の手段として pandas のデフォルトエンジンを使用
-                        df = pd.read_excel(input_excel, engine=None)
-                    except Exception as final_e:
-                        info["error"] = f"Excelファイルの読み込みに失敗しました: {str(final_e)}。ファイル形式やサイズ、内容を確認してください。"
-                        return [], info
-        except Exception as e:
-            info["error"] = f"Excelファイルの読み込みに失敗しました: {str(e)}。ファイル形式やサイズ、内容を確認してください。"
-            return [], info
+                    # openpyxlで読めない形式（.xlsなど）はpandasのエンジン自動判定に任せる
+                    rewind_excel_source(input_excel)
+                    df = pd.read_excel(input_excel)
+            except Exception as e:
+                info["error"] = f"Excelファイルの読み込みに失敗しました: {str(e)}。ファイル形式やサイズ、内容を確認してください。"
+                return [], info
         
         info["total_rows"] = len(df)
         
@@ -160,30 +217,40 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
         
         # 列名の存在チェック (列名の空白や大文字・小文字の違いを許容)
         df_columns = [col.strip() for col in df.columns]
+        df_columns_set = frozenset(df_columns)
+        df_columns_lower = build_lower_column_map(df_columns)
         missing_columns = []
         for col in required_columns:
-            col_found = False
             # 完全一致を最初に確認
-            if col in df_columns:
-                col_found = True
-            else:
-                # 大文字小文字を無視して確認
-                col_lower = col.lower()
-                for df_col in df_columns:
-                    if df_col.lower() == col_lower:
-                        col_found = True
-                        # 元の列名を新しい列名に置き換え (列名を正規化)
-                        df = df.rename(columns={df_col: col})
-                        break
+            if col in df_columns_set:
+                continue
             
-            if not col_found:
+            # 大文字小文字を無視して確認
+            df_col = df_columns_lower.get(col.lower())
+            if df_col is None:
                 missing_columns.append(col)
+            else:
+                # 元の列名を新しい列名に置き換え (列名を正規化)
+                df = df.rename(columns={df_col: col})
         
         if missing_columns:
             info["error"] = f"以下の列がExcelファイルに見つかりません: {', '.join(missing_columns)}\n"\
                            f"ファイルに含まれる列: {', '.join(df.columns)}"
             return [], info
         
+        # 図面番号列の判定は列単位でまとめて行う
+        figure_present, figure_stripped = get_figure_number_status(df["図面番号"])
+        figure_blank = (figure_stripped == "").to_numpy()
+        
+        # 各列の値を一度だけPythonのリストとして取り出し、以降は行番号で参照する
+        # （iterrows/ilocによる行ごとのSeries生成を避ける）
+        symbol_values = df["符号"].tolist()
+        comment_values = df["構成コメント"].tolist()
+        quantity_values = df["構成数"].tolist()
+        if include_maker_info:
+            maker_names = df["メーカ名"].tolist()
+            maker_models = df["メーカ型式"].tolist()
+        
         # 使用するアセンブリ番号のリストを初期化
         assembly_numbers = []
         
@@ -198,12 +265,10 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
                 assembly_numbers = [suggested_assembly_number]
         else:
             # 抽出されたアセンブリ番号が図面番号に存在するか確認
-            assembly_found = False
-            for i, row in df.iterrows():
-                if pd.notna(row["図面番号"]) and str(row["図面番号"]) == suggested_assembly_number:
-                    assembly_numbers = [suggested_assembly_number]
-                    assembly_found = True
-                    break
+            assembly_found = bool(
+                (figure_present & (df["図面番号"].astype(str) == suggested_assembly_number)).any())
+            if assembly_found:
+                assembly_numbers = [suggested_assembly_number]
             
             # アセンブリ番号が見つからなかった場合は、自動的に全ての可能なアセンブリ番号を使用
             if not assembly_found:
@@ -214,7 +279,7 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
                     info["assembly_number"] = ",".join(assembly_numbers)
                 else:
                     # 可能なアセンブリ番号も見つからない場合は、ファイル名全体を使用
-                    assembly_number = os.path.splitext(os.path.basename(input_excel))[0]
+                    assembly_number = os.path.splitext(filename)[0]
                     info["assembly_number"] = assembly_number
                     assembly_numbers = [assembly_number]
         
@@ -225,27 +290,15 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
         # 各アセンブリ番号について処理を実行
         for assembly_number in assembly_numbers:
             # 処理対象の行を特定
-            start_processing = False
+            # アセンブリ番号と一致する最初の図面番号の行（処理対象外）の次の行から、
+            # 図面番号が空白でなくなる直前の行までを処理対象とする
             processing_rows = []
-            
-            for i, row in df.iterrows():
-                try:
-                    # アセンブリ番号と一致する図面番号を探す
-                    figure_num = str(row["図面番号"]) if pd.notna(row["図面番号"]) else ""
-                    if not start_processing and pd.notna(row["図面番号"]) and figure_num.strip() == assembly_number.strip():
-                        start_processing = True
-                        continue  # 一致した行は処理対象外
-                    
-                    # 処理開始後、図面番号が空白の行を処理対象とする
-                    if start_processing:
-                        if pd.isna(row["図面番号"]) or str(row["図面番号"]).strip() == "":
-                            processing_rows.append(i)
-                        else:
-                            # 図面番号が空白でなくなったら処理終了
-                            break
-                except Exception as e:
-                    # 行の処理中にエラーが発生した場合はスキップ
-                    continue
+            matches = np.flatnonzero((figure_present & (figure_stripped == assembly_number.strip())).to_numpy())
+            if len(matches) > 0:
+                start = matches[0] + 1
+                non_blank = np.flatnonzero(~figure_blank[start:])
+                end = start + non_blank[0] if len(non_blank) > 0 else len(figure_blank)
+                processing_rows = list(range(start, end))
             
             total_processed_rows += len(processing_rows)
             
@@ -258,20 +311,22 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
             # 処理対象の行だけを処理
             for idx in processing_rows:
                 try:
-                    row = df.iloc[idx]
+                    comment = comment_values[idx]
+                    symbol_value = symbol_values[idx]
+                    quantity = quantity_values[idx]
                     
                     # 符号または構成コメントからシンボルを取得
-                    if pd.notna(row["構成コメント"]) and "_" in str(row["構成コメント"]):
+                    if pd.notna(comment) and "_" in str(comment):
                         # 構成コメントに"_"が含まれる場合はそちらを使用
-                        base_symbols = str(row["構成コメント"]).split("_")
+                        base_symbols = str(comment).split("_")
                     else:
                         # そうでなければ符号を使用
-                        symbol_str = str(row["符号"]) if pd.notna(row["符号"]) else ""
+                        symbol_str = str(symbol_value) if pd.notna(symbol_value) else ""
                         base_symbols = symbol_str.split("_") if "_" in symbol_str else [symbol_str]
                     
                     # 数値型の場合は整数に変換する
                     try:
-                        qty = int(row["構成数"]) if pd.notna(row["構成数"]) else 0
+                        qty = int(quantity) if pd.notna(quantity) else 0
                     except (ValueError, TypeError):
                         # 数値に変換できない場合は0として扱う
                         qty = 0
@@ -305,8 +360,8 @@ def extract_circuit_symbols(input_excel, assembly_number=None, use_all_assemblie
                     
                     # メーカー情報を含める場合
                     if include_maker_info:
-                        maker_name = str(row["メーカ名"]) if pd.notna(row["メーカ名"]) else ""
-                        maker_model = str(row["メーカ型式"]) if pd.notna(row["メーカ型式"]) else ""
+                        maker_name = str(maker_names[idx]) if pd.notna(maker_names[idx]) else ""
+                        maker_model = str(maker_models[idx]) if pd.notna(maker_models[idx]) else ""
                         
                         # 各シンボルにメーカー情報を追加
                         symbols_with_info = []